@@ -8,7 +8,6 @@ import (
 	"fmt"
 	"io"
 	"io/ioutil"
-	"log"
 	"net"
 	"net/http"
 	"net/url"
@@ -339,6 +338,11 @@ func getMeta(albumId string, token string, storefront string) (*structs.AutoGene
 	} else {
 		mtype = "albums"
 	}
+	// 常驻 worker 模式下同一专辑的多个音轨请求复用元数据
+	metaCacheKey := strings.Join([]string{storefront, mtype, albumId, Config.Language}, "/")
+	if cached := cachedMeta(metaCacheKey); cached != nil {
+		return cached, nil
+	}
 	req, err := http.NewRequest("GET", fmt.Sprintf("https://amp-api.music.apple.com/v1/catalog/%s/%s/%s", storefront, mtype, albumId), nil)
 	if err != nil {
 		return nil, err
@@ -405,6 +409,7 @@ func getMeta(albumId string, token string, storefront string) (*structs.AutoGene
 			}
 		}
 	}
+	storeMeta(metaCacheKey, obj)
 	return obj, nil
 }
 
@@ -613,6 +618,18 @@ func downloadTrack(trackNum int, trackTotal int, meta *structs.AutoGenerated, tr
 	filename := fmt.Sprintf("%s.m4a", forbiddenNames.ReplaceAllString(songName, "_"))
 	lrcFilename := fmt.Sprintf("%s.%s", forbiddenNames.ReplaceAllString(songName, "_"), Config.LrcFormat)
 	trackPath := filepath.Join(sanAlbumFolder, filename)
+	// 供调度器维护本地音乐库索引 (song_id / album_id -> 文件路径与音质)
+	trackCodec := Codec
+	if dl_atmos {
+		trackCodec = "ATMOS"
+	} else if needDlAacLc {
+		trackCodec = "AAC"
+	}
+	if trackFile, err := json.Marshal(map[string]string{
+		"song_id": track.ID, "album_id": albumId, "path": trackPath, "codec": trackCodec, "quality": Quality,
+	}); err == nil {
+		fmt.Printf("TRACK_FILE:%s\n", trackFile)
+	}
 
 	//get lrc
 	var lrc string = ""
@@ -1210,6 +1227,11 @@ func writeMP4Tags(trackPath string, meta *structs.AutoGenerated, trackNum, track
 }
 
 func main() {
+	// 常驻 worker 模式：配置随每个请求传入，不从 stdin 一次性读取 (见 worker.go)
+	if len(os.Args) > 1 && os.Args[1] == "--worker" {
+		runWorker()
+		return
+	}
 	err := loadConfig()
 	if err != nil {
 		fmt.Printf("load Config failed: %v", err)
@@ -1283,83 +1305,97 @@ func main() {
 		}
 		os.Args = append(albumArgs, mvArgs...)
 	}
-	albumTotal := len(os.Args)
 	for {
-		for albumNum, urlRaw := range os.Args {
-			fmt.Printf("Album %d of %d:\n", albumNum+1, albumTotal)
-			var storefront, albumId string
-			//mv dl dev
-			if strings.Contains(urlRaw, "/music-video/") {
-				if debug_mode {
-					continue
-				}
-				counter.Total++
-				if len(Config.MediaUserToken) <= 50 {
-					fmt.Println("meida-user-token is not set, skip MV dl")
-					counter.Success++
-					continue
-				}
-				if _, err := exec.LookPath("mp4decrypt"); err != nil {
-					fmt.Println("mp4decrypt is not found, skip MV dl")
-					counter.Success++
-					continue
-				}
-				mvSaveDir := strings.NewReplacer(
-					"{ArtistName}", "",
-					"{UrlArtistName}", "",
-					"{ArtistId}", "",
-				).Replace(Config.ArtistFolderFormat)
-				if mvSaveDir != "" {
-					mvSaveDir = filepath.Join(Config.AlacSaveFolder, mvSaveDir)
-				} else {
-					mvSaveDir = Config.AlacSaveFolder
-				}
-				storefront, albumId = checkUrlMv(urlRaw)
-				err := mvDownloader(albumId, mvSaveDir, token, storefront, Config.MediaUserToken, nil)
-				if err != nil {
-					fmt.Println("\u26A0 Failed to dl MV:", err)
-					counter.Error++
-					continue
-				}
+		if err := ripUrls(os.Args, token); err != nil {
+			fmt.Println(err)
+			os.Exit(1)
+		}
+		printCounterSummary()
+		if counter.Error == 0 {
+			break
+		}
+		fmt.Println("Error detected, press Enter to try again...")
+		fmt.Scanln()
+		fmt.Println("Start trying again...")
+		counter = structs.Counter{}
+	}
+}
+
+// ripUrls 依次下载 urls 中的专辑 / 播放列表 / 单曲 / MV，结果累计到 counter；链接无法解析时返回错误 (不退出进程)
+func ripUrls(urls []string, token string) error {
+	albumTotal := len(urls)
+	for albumNum, urlRaw := range urls {
+		fmt.Printf("Album %d of %d:\n", albumNum+1, albumTotal)
+		var storefront, albumId string
+		//mv dl dev
+		if strings.Contains(urlRaw, "/music-video/") {
+			if debug_mode {
+				continue
+			}
+			counter.Total++
+			if len(Config.MediaUserToken) <= 50 {
+				fmt.Println("meida-user-token is not set, skip MV dl")
 				counter.Success++
 				continue
 			}
-			if strings.Contains(urlRaw, "/song/") {
-				urlRaw, err = getUrlSong(urlRaw, token)
-				dl_song = true
-				if err != nil {
-					fmt.Println("Failed to get Song info.")
-				}
+			if _, err := exec.LookPath("mp4decrypt"); err != nil {
+				fmt.Println("mp4decrypt is not found, skip MV dl")
+				counter.Success++
+				continue
 			}
-			if strings.Contains(urlRaw, "/playlist/") {
-				storefront, albumId = checkUrlPlaylist(urlRaw)
+			mvSaveDir := strings.NewReplacer(
+				"{ArtistName}", "",
+				"{UrlArtistName}", "",
+				"{ArtistId}", "",
+			).Replace(Config.ArtistFolderFormat)
+			if mvSaveDir != "" {
+				mvSaveDir = filepath.Join(Config.AlacSaveFolder, mvSaveDir)
 			} else {
-				storefront, albumId = checkUrl(urlRaw)
-			}
-			if albumId == "" {
-				fmt.Printf("Invalid URL: %s\n", urlRaw)
-				continue
+				mvSaveDir = Config.AlacSaveFolder
 			}
-			parse, err := url.Parse(urlRaw)
+			storefront, albumId = checkUrlMv(urlRaw)
+			err := mvDownloader(albumId, mvSaveDir, token, storefront, Config.MediaUserToken, nil)
 			if err != nil {
-				log.Fatalf("Invalid URL: %v", err)
+				fmt.Println("\u26A0 Failed to dl MV:", err)
+				counter.Error++
+				continue
 			}
-			var urlArg_i = parse.Query().Get("i")
-			err = rip(albumId, token, storefront, Config.MediaUserToken, urlArg_i)
+			counter.Success++
+			continue
+		}
+		if strings.Contains(urlRaw, "/song/") {
+			var err error
+			urlRaw, err = getUrlSong(urlRaw, token)
+			dl_song = true
 			if err != nil {
-				fmt.Println("Album failed.")
-				fmt.Println(err)
+				fmt.Println("Failed to get Song info.")
 			}
 		}
-		fmt.Printf("=======  [\u2714 ] Completed: %d/%d  |  [\u26A0 ] Warnings: %d  |  [\u2716 ] Errors: %d  =======\n", counter.Success, counter.Total, counter.Unavailable+counter.NotSong, counter.Error)
-		if counter.Error == 0 {
-			break
+		if strings.Contains(urlRaw, "/playlist/") {
+			storefront, albumId = checkUrlPlaylist(urlRaw)
+		} else {
+			storefront, albumId = checkUrl(urlRaw)
+		}
+		if albumId == "" {
+			fmt.Printf("Invalid URL: %s\n", urlRaw)
+			continue
+		}
+		parse, err := url.Parse(urlRaw)
+		if err != nil {
+			return fmt.Errorf("Invalid URL: %v", err)
+		}
+		var urlArg_i = parse.Query().Get("i")
+		err = rip(albumId, token, storefront, Config.MediaUserToken, urlArg_i)
+		if err != nil {
+			fmt.Println("Album failed.")
+			fmt.Println(err)
 		}
-		fmt.Println("Error detected, press Enter to try again...")
-		fmt.Scanln()
-		fmt.Println("Start trying again...")
-		counter = structs.Counter{}
 	}
+	return nil
+}
+
+func printCounterSummary() {
+	fmt.Printf("=======  [\u2714 ] Completed: %d/%d  |  [\u26A0 ] Warnings: %d  |  [\u2716 ] Errors: %d  =======\n", counter.Success, counter.Total, counter.Unavailable+counter.NotSong, counter.Error)
 }
 func mvDownloader(adamID string, saveDir string, token string, storefront string, mediaUserToken string, meta *structs.AutoGenerated) error {
 	MVInfo, err := getMVInfoFromAdam(adamID, token, storefront)
@@ -2169,7 +2205,10 @@ func getToken() (string, error) {
 		return staticToken, nil
 	}
 
-	// 3. 如果以上都没有，则从网站获取
+	// 3. 如果以上都没有，则从网站获取 (常驻 worker 模式下复用上次获取的 token)
+	if token, ok := cachedWebToken(); ok {
+		return token, nil
+	}
 	// log.Println("No pre-configured token found, fetching new token from Apple Music website.") // 可选的调试日志
 	req, err := http.NewRequest("GET", "https://beta.music.apple.com", nil)
 	if err != nil {
@@ -2214,5 +2253,6 @@ func getToken() (string, error) {
 	if token == "" {
 		return "", errors.New("failed to find token in JS file")
 	}
+	storeWebToken(token)
 	return token, nil
 }
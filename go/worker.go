@@ -0,0 +1,284 @@
+package main
+
+// 常驻 worker 模式 (main --worker)
+//
+// Python 端的 GoWorkerPool 启动常驻进程，通过 stdin / stdout 逐行 JSON 通信，避免每个音轨重复启动进程、
+// 解析配置、获取 token 和专辑元数据:
+//   请求: {"id": 1, "args": ["<url>", "--song", "--skip-check"], "config": "<渲染后的 source.yaml>"}
+//   事件: {"event": "ready", "pid": 123}
+//         {"event": "output", "id": 1, "stream": "stdout", "line": "..."}   原 stdout / stderr 的每一行
+//         {"event": "result", "id": 1, "exit_code": 0}                       该请求的全部输出之后发送
+// 请求串行处理；stdin 关闭后进程退出。
+
+import (
+	"bufio"
+	"bytes"
+	"encoding/json"
+	"fmt"
+	"log"
+	"os"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"time"
+
+	"main/utils/structs"
+
+	"github.com/fatih/color"
+	"gopkg.in/yaml.v2"
+)
+
+const (
+	workerFlushMarker  = "\x00AMDL_WORKER_FLUSH\x00"
+	workerMaxLineBytes = 16 * 1024 * 1024
+	webTokenTTL        = 30 * time.Minute
+	metaCacheTTL       = 10 * time.Minute
+)
+
+type workerRequest struct {
+	ID     int64    `json:"id"`
+	Args   []string `json:"args"`
+	Config string   `json:"config"`
+}
+
+type workerEvent struct {
+	Event    string `json:"event"`
+	ID       int64  `json:"id,omitempty"`
+	Stream   string `json:"stream,omitempty"`
+	Line     string `json:"line,omitempty"`
+	ExitCode *int   `json:"exit_code,omitempty"`
+	Pid      int    `json:"pid,omitempty"`
+}
+
+type metaCacheEntry struct {
+	meta     *structs.AutoGenerated
+	storedAt time.Time
+}
+
+var (
+	workerMode      bool
+	workerOut       *os.File
+	workerOutMu     sync.Mutex
+	workerRequestID int64
+
+	webTokenMu    sync.Mutex
+	webToken      string
+	webTokenSetAt time.Time
+
+	metaCacheMu sync.Mutex
+	metaCache   = make(map[string]metaCacheEntry)
+)
+
+func runWorker() {
+	workerMode = true
+	workerOut = os.Stdout
+
+	// 下载逻辑中的 fmt / log / color 输出全部改写到管道，再按行转成 output 事件
+	stdoutReader, stdoutWriter, err := os.Pipe()
+	if err != nil {
+		fmt.Fprintf(os.Stderr, "create stdout pipe failed: %v\n", err)
+		os.Exit(1)
+	}
+	stderrReader, stderrWriter, err := os.Pipe()
+	if err != nil {
+		fmt.Fprintf(os.Stderr, "create stderr pipe failed: %v\n", err)
+		os.Exit(1)
+	}
+	os.Stdout = stdoutWriter
+	os.Stderr = stderrWriter
+	log.SetOutput(stderrWriter)
+	color.Output = stdoutWriter
+	color.Error = stderrWriter
+
+	stdoutFlushed := make(chan struct{})
+	stderrFlushed := make(chan struct{})
+	go forwardWorkerStream(stdoutReader, "stdout", stdoutFlushed)
+	go forwardWorkerStream(stderrReader, "stderr", stderrFlushed)
+
+	emitWorkerEvent(workerEvent{Event: "ready", Pid: os.Getpid()})
+
+	scanner := bufio.NewScanner(os.Stdin)
+	scanner.Buffer(make([]byte, 64*1024), workerMaxLineBytes)
+	for scanner.Scan() {
+		line := bytes.TrimSpace(scanner.Bytes())
+		if len(line) == 0 {
+			continue
+		}
+		var request workerRequest
+		if err := json.Unmarshal(line, &request); err != nil {
+			exitCode := 1
+			emitWorkerEvent(workerEvent{Event: "output", Stream: "stderr", Line: fmt.Sprintf("invalid worker request: %v\n", err)})
+			emitWorkerEvent(workerEvent{Event: "result", ExitCode: &exitCode})
+			continue
+		}
+		atomic.StoreInt64(&workerRequestID, request.ID)
+		exitCode := handleWorkerRequest(request)
+		// 等两条管道中属于本请求的输出全部转发后再发送结果
+		fmt.Fprint(os.Stdout, workerFlushMarker+"\n")
+		fmt.Fprint(os.Stderr, workerFlushMarker+"\n")
+		<-stdoutFlushed
+		<-stderrFlushed
+		emitWorkerEvent(workerEvent{Event: "result", ID: request.ID, ExitCode: &exitCode})
+	}
+}
+
+// handleWorkerRequest 按请求中的配置和参数执行一次下载，与单次运行 main 的行为一致:
+// 有错误时同样输出 "press Enter" 提示 (但不等待输入) 并返回非零退出码，由 Python 端决定是否重试
+func handleWorkerRequest(request workerRequest) (exitCode int) {
+	defer func() {
+		if r := recover(); r != nil {
+			fmt.Printf("worker request panic: %v\n", r)
+			exitCode = 2
+		}
+	}()
+
+	Config = structs.ConfigSet{}
+	if err := yaml.Unmarshal([]byte(request.Config), &Config); err != nil {
+		fmt.Printf("load Config failed: %v\n", err)
+		return 1
+	}
+	dl_atmos, dl_aac, dl_select, dl_song = false, false, false, false
+	artist_select, debug_mode, skip_check = false, false, false
+	var urls []string
+	for _, arg := range request.Args {
+		switch arg {
+		case "--song":
+			dl_song = true
+		case "--skip-check":
+			skip_check = true
+		case "--atmos":
+			dl_atmos = true
+		case "--aac":
+			dl_aac = true
+		default:
+			if strings.HasPrefix(arg, "--") {
+				fmt.Printf("Unsupported worker option: %s\n", arg)
+				return 1
+			}
+			urls = append(urls, arg)
+		}
+	}
+	if len(urls) == 0 {
+		fmt.Println("No URLs provided. Please provide at least one URL.")
+		return 1
+	}
+
+	token, err := getToken()
+	if err != nil {
+		fmt.Println("Failed to get token.")
+		return 1
+	}
+	counter = structs.Counter{}
+	okDict = make(map[string][]int)
+	if err := ripUrls(urls, token); err != nil {
+		fmt.Println(err)
+		return 1
+	}
+	printCounterSummary()
+	// 有错误，或没有任何音轨被处理 (链接无效、专辑获取失败等)
+	if counter.Error > 0 || counter.Success+counter.Unavailable+counter.NotSong == 0 {
+		fmt.Println("Error detected, press Enter to try again...")
+		return 1
+	}
+	return 0
+}
+
+func emitWorkerEvent(event workerEvent) {
+	data, err := json.Marshal(event)
+	if err != nil {
+		return
+	}
+	workerOutMu.Lock()
+	defer workerOutMu.Unlock()
+	workerOut.Write(append(data, '\n'))
+}
+
+// forwardWorkerStream 把管道中的输出按行 (\n 或 \r，与 Python 的通用换行一致) 转为 output 事件，读到刷新标记时通知 flushed
+func forwardWorkerStream(reader *os.File, stream string, flushed chan<- struct{}) {
+	scanner := bufio.NewScanner(reader)
+	scanner.Buffer(make([]byte, 64*1024), workerMaxLineBytes)
+	scanner.Split(scanLinesOrCR)
+	for scanner.Scan() {
+		line := scanner.Text()
+		if idx := strings.Index(line, workerFlushMarker); idx >= 0 {
+			if idx > 0 {
+				emitWorkerEvent(workerEvent{Event: "output", ID: atomic.LoadInt64(&workerRequestID), Stream: stream, Line: line[:idx] + "\n"})
+			}
+			flushed <- struct{}{}
+			continue
+		}
+		emitWorkerEvent(workerEvent{Event: "output", ID: atomic.LoadInt64(&workerRequestID), Stream: stream, Line: line + "\n"})
+	}
+}
+
+func scanLinesOrCR(data []byte, atEOF bool) (advance int, token []byte, err error) {
+	for i, b := range data {
+		if b == '\n' {
+			return i + 1, data[:i], nil
+		}
+		if b == '\r' {
+			if i+1 == len(data) && !atEOF {
+				return 0, nil, nil // 需要下一个字节判断是否为 \r\n
+			}
+			if i+1 < len(data) && data[i+1] == '\n' {
+				return i + 2, data[:i], nil
+			}
+			return i + 1, data[:i], nil
+		}
+	}
+	if atEOF && len(data) > 0 {
+		return len(data), data, nil
+	}
+	return 0, nil, nil
+}
+
+// --- 常驻期间的缓存 (仅 worker 模式启用) ---
+
+func cachedWebToken() (string, bool) {
+	if !workerMode {
+		return "", false
+	}
+	webTokenMu.Lock()
+	defer webTokenMu.Unlock()
+	if webToken != "" && time.Since(webTokenSetAt) < webTokenTTL {
+		return webToken, true
+	}
+	return "", false
+}
+
+func storeWebToken(token string) {
+	if !workerMode {
+		return
+	}
+	webTokenMu.Lock()
+	defer webTokenMu.Unlock()
+	webToken = token
+	webTokenSetAt = time.Now()
+}
+
+func cachedMeta(key string) *structs.AutoGenerated {
+	if !workerMode {
+		return nil
+	}
+	metaCacheMu.Lock()
+	defer metaCacheMu.Unlock()
+	entry, ok := metaCache[key]
+	if !ok || time.Since(entry.storedAt) >= metaCacheTTL {
+		return nil
+	}
+	return entry.meta
+}
+
+func storeMeta(key string, meta *structs.AutoGenerated) {
+	if !workerMode {
+		return
+	}
+	metaCacheMu.Lock()
+	defer metaCacheMu.Unlock()
+	for cachedKey, entry := range metaCache {
+		if time.Since(entry.storedAt) >= metaCacheTTL {
+			delete(metaCache, cachedKey)
+		}
+	}
+	metaCache[key] = metaCacheEntry{meta: meta, storedAt: time.Now()}
+}
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# adaptive_concurrency.py - Go 进程并发数的自适应控制 (AIMD: 加性增、乘性减)
+#
+# 每次 Go 执行尝试开始时登记 (begin)、结束后由 execute_single_track 上报结果；每个统计窗口结束时评估一次:
+#   窗口内出现拥塞类失败 (令牌失败 / Get-EOF / E:n / 连接解密器失败 / 卡住) 或成功率低于阈值 -> 上限乘以 decrease_factor
+#   成功率达标、吞吐未下降且槽位已被占满 -> 上限加 increase_step
+# 后台定时器按在途尝试的时长检测卡住 (未返回的 Go 进程也能触发缩减)，并在没有尝试结束时照常结束窗口。
+# 上限保持在 [min_limit, max_limit]，max_limit 不超过 MAX_GLOBAL_GO_PROCESSES，变化时通过 on_change 回调生效 (全局音轨工作池的活动线程数)。
+
+import time
+import logging
+import itertools
+import threading
+from collections import deque
+
+# --- 默认配置 ---
+DEFAULT_ADAPTIVE_CONFIG = {
+    "enabled": False,
+    "min_limit": 1,               # 下限
+    "max_limit": None,            # 上限，默认且不超过 MAX_GLOBAL_GO_PROCESSES (工作池按该值创建线程)
+    "window_seconds": 60,         # 统计窗口(秒)
+    "min_samples": 3,             # 窗口内少于该尝试数时不调整
+    "increase_step": 1,           # 健康时每个窗口增加的并发数
+    "decrease_factor": 0.5,       # 拥塞时的缩减系数
+    "min_success_rate": 0.9,      # 低于该成功率视为拥塞
+    "stall_seconds": 600,         # 单次尝试超过该时间视为卡住
+}
+CONGESTION_CLASSES = frozenset({"token", "network", "errors", "connect", "stall"})
+MAX_DECISION_HISTORY = 50
+MAX_CHECK_INTERVAL = 10  # 定时检查卡住 / 窗口结束的最长间隔(秒)
+
+
+class AdaptiveConcurrencyController:
+    """按窗口统计 Go 执行结果并调整并发上限 (线程安全)。"""
+
+    def __init__(self, initial_limit, on_change, min_limit=1, max_limit=10, window_seconds=60, min_samples=3,
+                 increase_step=1, decrease_factor=0.5, min_success_rate=0.9, stall_seconds=600):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = min(self.max_limit, max(self.min_limit, int(initial_limit)))
+        self.on_change = on_change  # on_change(new_limit)
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.increase_step = max(1, int(increase_step))
+        self.decrease_factor = min(0.99, max(0.01, float(decrease_factor)))
+        self.min_success_rate = min_success_rate
+        self.stall_seconds = stall_seconds
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window = self._empty_window()
+        self.last_throughput = None
+        self.decisions = deque(maxlen=MAX_DECISION_HISTORY)
+        self.attempt_ids = itertools.count(1)
+        self.in_flight = {}      # 尝试 id -> 开始时间 (monotonic)
+        self.stalled = set()     # 已按卡住计入窗口的在途尝试 id
+        check_interval = max(1, min(MAX_CHECK_INTERVAL, window_seconds, stall_seconds))
+        threading.Thread(target=self._check_loop, args=(check_interval,), name="adaptive-concurrency", daemon=True).start()
+        logging.info(f"自适应 Go 并发控制已启用: 初始 {self.limit}，范围 [{self.min_limit}, {self.max_limit}]，窗口 {window_seconds} 秒")
+
+    @staticmethod
+    def _empty_window():
+        return {"attempts": 0, "successes": 0, "congestion": 0, "peak_busy": 0, "classes": {}}
+
+    def begin(self):
+        """登记一次开始执行的尝试，返回尝试 id (结束时传给 record 或 abandon)。"""
+        with self.lock:
+            attempt_id = next(self.attempt_ids)
+            self.in_flight[attempt_id] = time.monotonic()
+        return attempt_id
+
+    def abandon(self, attempt_id):
+        """尝试未上报结果就结束 (如 Python 侧异常) 时移除登记，已上报的尝试无操作。"""
+        with self.lock:
+            self.in_flight.pop(attempt_id, None)
+            self.stalled.discard(attempt_id)
+
+    def record(self, success, failure_classes=(), duration=None, busy=None, attempt_id=None):
+        """上报一次执行尝试的结果。failure_classes 为失败类别 (见 main.analyze_go_output)，busy 为当前占用的槽位数。"""
+        classes = set(failure_classes or ())
+        if duration is not None and duration > self.stall_seconds:
+            classes.add("stall")
+        with self.lock:
+            self.in_flight.pop(attempt_id, None)
+            window = self.window
+            if attempt_id in self.stalled:
+                # 执行期间已按卡住计入窗口，不再重复计数
+                self.stalled.discard(attempt_id)
+            else:
+                window["attempts"] += 1
+                if success and "stall" not in classes:
+                    window["successes"] += 1
+                if classes & CONGESTION_CLASSES:
+                    window["congestion"] += 1
+                for failure_class in classes:
+                    window["classes"][failure_class] = window["classes"].get(failure_class, 0) + 1
+            if busy is not None:
+                window["peak_busy"] = max(window["peak_busy"], busy)
+            decision = self._maybe_adjust()
+        if decision is not None:
+            self.on_change(decision)
+
+    def _check_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"自适应 Go 并发定时检查出错: {e}", exc_info=True)
+
+    def check(self):
+        """把运行超过 stall_seconds 的在途尝试按卡住计入当前窗口，并在窗口到期时评估。"""
+        now = time.monotonic()
+        with self.lock:
+            window = self.window
+            for attempt_id, started in self.in_flight.items():
+                if attempt_id in self.stalled or now - started <= self.stall_seconds:
+                    continue
+                self.stalled.add(attempt_id)
+                window["attempts"] += 1
+                window["congestion"] += 1
+                window["classes"]["stall"] = window["classes"].get("stall", 0) + 1
+                logging.warning(f"自适应 Go 并发: 有 Go 执行已运行 {now - started:.0f} 秒未结束，按卡住计入。")
+            decision = self._maybe_adjust()
+        if decision is not None:
+            self.on_change(decision)
+
+    def _maybe_adjust(self):
+        """在持有锁时调用：窗口结束则评估并开启新窗口，上限变化时返回新上限。"""
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.window_seconds:
+            return None
+        window, self.window, self.window_start = self.window, self._empty_window(), now
+        if window["attempts"] < self.min_samples and not window["classes"].get("stall"):
+            return None
+        success_rate = window["successes"] / window["attempts"]
+        throughput = window["successes"] / elapsed * 60  # 每分钟成功数
+        old_limit = self.limit
+        if window["congestion"] or success_rate < self.min_success_rate:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+            action = "decrease"
+        elif (window["peak_busy"] >= self.limit and self.limit < self.max_limit
+              and (self.last_throughput is None or throughput >= self.last_throughput * 0.9)):
+            self.limit = min(self.max_limit, self.limit + self.increase_step)
+            action = "increase"
+        else:
+            action = "hold"
+        self.last_throughput = throughput
+        self.decisions.append({
+            "time": time.time(), "action": action, "from": old_limit, "to": self.limit,
+            "attempts": window["attempts"], "success_rate": round(success_rate, 3),
+            "throughput_per_min": round(throughput, 2), "failure_classes": dict(window["classes"]),
+        })
+        if self.limit != old_limit:
+            logging.info(f"自适应 Go 并发: {old_limit} -> {self.limit} ({action}，成功率 {success_rate:.0%}，"
+                         f"失败类别 {window['classes'] or '无'})")
+            return self.limit
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "window": dict(self.window, classes=dict(self.window["classes"])),
+                "in_flight": len(self.in_flight),
+                "decisions": list(self.decisions),
+            }
+
+
+def create_adaptive_controller(config, initial_limit, on_change):
+    """根据 config.yaml 中的 adaptive_concurrency 配置创建控制器，未启用时返回 None。
+
+    initial_limit 为 MAX_GLOBAL_GO_PROCESSES，同时作为 max_limit 的上界：控制器只在运维设定的预算内调整。
+    """
+    section = config.get("adaptive_concurrency", {}) or {}
+    settings = dict(DEFAULT_ADAPTIVE_CONFIG)
+    settings.update({key: value for key, value in section.items() if key in settings})
+    if not settings.pop("enabled"):
+        return None
+    if settings["max_limit"] is None:
+        settings["max_limit"] = initial_limit
+    elif int(settings["max_limit"]) > initial_limit:
+        logging.warning(f"adaptive_concurrency.max_limit ({settings['max_limit']}) 超过 MAX_GLOBAL_GO_PROCESSES ({initial_limit})，已限制为 {initial_limit}。")
+        settings["max_limit"] = initial_limit
+    settings["min_limit"] = min(int(settings["min_limit"]), int(settings["max_limit"]))
+    return AdaptiveConcurrencyController(initial_limit, on_change, **settings)
@@ -12,6 +12,7 @@ import shutil  # <--- 添加导入
 import io      # <--- 添加导入
 import socket  # <--- 新增导入
 import hashlib # <--- 新增导入，用于缓存key生成
+import gzip
 from collections import Counter, defaultdict
 from datetime import datetime, timedelta, timezone
 from functools import wraps
@@ -29,17 +30,28 @@ except ImportError:
 import yaml
 import requests
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 from filelock import FileLock, Timeout
 
 # --- 导入共享工具 --- #
 from utils import (
     read_json_with_lock, write_json_with_lock,
+    json_dumps, json_dumps_bytes, json_loads, configure_json_codec,
+    atomic_write_bytes, configure_durability, get_lock_stats, get_io_stats,
     read_yaml_with_lock,
     setup_logging,
     normalize_username,
     parse_link,
+    is_track_done,
+    TASK_PRIORITIES, DEFAULT_TASK_PRIORITY,
     PROJECT_ROOT # 使用 utils 中定义的项目根目录
 )
+from task_store import create_task_store
+from history_store import create_history_store, HISTORY_STATUSES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from change_feed import (
+    ChangeFeedPublisher, ChangeFeedSubscriber, ChangeLog, resolve_socket_path,
+    DEFAULT_CHANGE_LOG_SIZE, CHANGE_ADD, CHANGE_TASK, CHANGE_TRACK, CHANGE_REMOVE
+)
 
 # --- 配置基础路径 --- #
 # SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -55,69 +67,146 @@ TASK_QUEUE_FILEPATH = None
 TASK_QUEUE_LOCK_FILEPATH = None
 API_TOKEN_LOCK_FILEPATH = None
 APP_LOCKS = {"task_queue": None, "api_token": None}
+TASK_STORE = None # 任务队列存储后端 (task_store.TaskStore)
+CHANGE_FEED_SUBSCRIBER = None # 任务队列跨进程变更订阅 (change_feed.ChangeFeedSubscriber)
+QUEUE_CHANGE_LOG = ChangeLog() # 最近版本的变更条目，用于 GET /task?since= 增量响应
+QUEUE_EPOCH = uuid.uuid4().hex[:8] # 本进程的 ETag 前缀，版本号被重置时也不会误判为未修改
+TASK_SNAPSHOT_CACHE = None # GET /task 共享的任务队列快照 (TaskSnapshotCache)
+HISTORY_STORE = None # 已完成 / 失败任务的历史存储 (history_store.TaskHistoryStore)
 LOCAL_TZ = None # 将存储本地时区对象
+TOKEN_FORCE_REFRESH_MIN_INTERVAL = 60 # GET /token?refresh=1 强制刷新的最短间隔(秒)，Token 比该时间更新时不再刷新
+TOKEN_FORCE_REFRESH_LOCK = threading.Lock()
+LAST_FORCED_TOKEN_REFRESH = 0.0 # 上次强制刷新的时间 (monotonic)
+LOOPBACK_ADDRESSES = ("127.0.0.1", "::1", "localhost")
 
 # --- 长轮询支持 ---
 class TaskQueueNotifier:
-    """任务队列变化通知器，支持长轮询 (使用 threading.Condition)"""
+    """任务队列变化通知器，支持长轮询 (使用 threading.Condition)
+
+    用递增的代数 (generation) 表示变化：等待者记住开始等待时的代数，代数改变即返回，
+    因此一次通知会唤醒所有并发的长轮询请求，而不是只有第一个消费通知的请求。
+    """
     def __init__(self):
         self._lock = threading.Lock()
         self._condition = threading.Condition(self._lock)
-        self._change_pending = False # 标志是否有未处理的通知
-        # 保留日志初始化，以便调试
+        self._generation = 0
         logging.debug("TaskQueueNotifier initialized with Condition.")
 
-    def wait_for_change(self, timeout=30):
+    def current_generation(self):
+        """返回当前代数。应在读取队列之前调用，避免读取与等待之间的变化被漏掉。"""
+        with self._lock:
+            return self._generation
+
+    def wait_for_change(self, timeout=30, since_generation=None):
         """等待队列变化，返回 True 表示有变化，False 表示超时"""
         with self._lock: # self._condition 会使用这个锁
-            logging.debug(f"wait_for_change: 开始等待，当前 change_pending: {self._change_pending}")
-            start_time = time.time()
-            
-            # 循环以处理 spurious wakeups，并确保 _change_pending 为 True 时才退出
-            while not self._change_pending:
-                remaining_timeout = timeout - (time.time() - start_time)
-                if remaining_timeout <= 0:
-                    logging.debug("wait_for_change: 等待超时 (在进入wait之前或循环中计算)。")
-                    return False # 在等待开始前或等待中已超时
-
-                # wait() 会释放锁，直到被通知或超时
-                # 如果被通知，wait() 返回 True (Python 3.2+); 如果超时，返回 False
-                # 对于旧版本 Python, 超时时 wait() 不返回值 (None)，被通知时也不一定返回 True
-                # 因此，最可靠的是在唤醒后重新检查 self._change_pending
-                self._condition.wait(remaining_timeout) 
-                
-                # 无论 wait() 返回什么，或者是否是 spurious wakeup，
-                # 我们都需要在重新获得锁后检查 _change_pending 的状态。
-                if self._change_pending:
-                    # 条件满足，跳出循环
-                    break
-                
-                # 如果执行到这里，说明 self._change_pending 仍为 False
-                # 这可能是因为 wait() 超时了，或者是一个 spurious wakeup 但条件仍未满足
-                # 检查 remaining_timeout 以确定是否是真的超时
-                if (time.time() - start_time) >= timeout:
-                    logging.debug("wait_for_change: 确认等待超时 (循环内检查)。")
-                    return False # 确实超时了
-                
-                # 否则，是 spurious wakeup 且条件未满足，继续循环等待
-                logging.debug("wait_for_change: Spurious wakeup 或条件仍未满足，继续等待。")
-
-            # 到这里时，self._change_pending 肯定是 True
-            logging.debug("wait_for_change: 检测到变化，消耗通知。")
-            self._change_pending = False # 消耗这个通知
-            return True # 表示有变化
+            start_generation = self._generation if since_generation is None else since_generation
+            # wait_for 会在 spurious wakeup 后重新检查条件
+            changed = self._condition.wait_for(lambda: self._generation != start_generation, timeout)
+            logging.debug(f"wait_for_change: {'检测到变化' if changed else '等待超时'} (代数 {start_generation} -> {self._generation})")
+            return changed
 
     def notify_change(self):
         """通知队列发生变化"""
         with self._lock: # self._condition 会使用这个锁
-            logging.debug("notify_change: 设置 change_pending 为 True 并通知所有等待者。")
-            self._change_pending = True # 确保状态被设置
+            self._generation += 1
             self._condition.notify_all() # 唤醒所有等待的线程
 
 # 全局通知器实例
 QUEUE_NOTIFIER = TaskQueueNotifier()
 
+
+def on_queue_change(version, changes):
+    """任务队列变更订阅回调：记录变更并唤醒长轮询"""
+    QUEUE_CHANGE_LOG.record(version, changes)
+    QUEUE_NOTIFIER.notify_change()
+
+
+# --- 任务队列快照 ---
+class TaskSnapshot:
+    """某一版本任务队列的解析结果，JSON 编码与 gzip 压缩在首次需要时生成，所有请求共享 (只读)"""
+    def __init__(self, signature, tasks):
+        self.signature = signature
+        self.version = signature[0]
+        self.tasks = tasks
+        self._lock = threading.Lock()
+        self._body = None
+        self._gzip_body = None
+        self._by_uuid = None
+
+    def body(self):
+        with self._lock:
+            if self._body is None:
+                self._body = json_dumps_bytes(self.tasks, pretty=False)
+            return self._body
+
+    def gzip_body(self, level):
+        body = self.body()
+        with self._lock:
+            if self._gzip_body is None:
+                self._gzip_body = gzip.compress(body, compresslevel=level)
+            return self._gzip_body
+
+    def get_task(self, task_uuid):
+        with self._lock:
+            if self._by_uuid is None:
+                self._by_uuid = {t.get("uuid"): t for t in self.tasks if isinstance(t, dict)}
+            return self._by_uuid.get(task_uuid)
+
+
+class TaskSnapshotCache:
+    """缓存最近一次读取的任务队列快照，按存储的 (版本号, 文件签名) 失效；并发请求只解析一次"""
+    def __init__(self, config):
+        snapshot_config = config.get("task_snapshot", {}) or {}
+        self.gzip_enabled = snapshot_config.get("gzip", True)
+        self.gzip_min_bytes = snapshot_config.get("gzip_min_bytes", 2048)
+        self.gzip_level = snapshot_config.get("gzip_level", 5)
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def get(self, store):
+        """返回当前快照，读取失败时返回 None"""
+        signature = store.data_signature()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+        with self._lock:
+            # 等待锁期间其他请求可能已经生成了同一版本的快照
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.signature == signature:
+                return snapshot
+            tasks = store.load_tasks()  # 签名先于数据读取，快照内容至少与签名一样新
+            if tasks is None:
+                return None
+            snapshot = TaskSnapshot(signature, tasks)
+            self._snapshot = snapshot
+            logging.debug(f"任务队列快照已更新 (版本: {snapshot.version}, {len(tasks)} 个任务)")
+            return snapshot
+
+    def response(self, snapshot):
+        """用快照中预编码的字节构造响应，客户端支持且足够大时返回 gzip"""
+        body = snapshot.body()
+        response = app.response_class(body, mimetype="application/json")
+        if self.gzip_enabled and len(body) >= self.gzip_min_bytes:
+            response.vary.add("Accept-Encoding")
+            if request.accept_encodings["gzip"] > 0:
+                response.set_data(snapshot.gzip_body(self.gzip_level))
+                response.headers["Content-Encoding"] = "gzip"
+        return response
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """让 jsonify 使用 utils 中可切换的 JSON 编解码 (紧凑输出)"""
+    def dumps(self, obj, **kwargs):
+        try:
+            return json_dumps(obj, pretty=False)
+        except TypeError:
+            return super().dumps(obj, **kwargs)  # 日期等需要 default 处理的值
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
 
 # --- 日志配置 ---
 # def setup_logging(config): ... # 移动到 utils.py
@@ -250,8 +339,8 @@ class SearchCacheManager:
                 return None
             
             # 读取缓存内容
-            with open(cache_filepath, 'r', encoding='utf-8') as f:
-                cached_data = json.load(f)
+            with open(cache_filepath, 'rb') as f:
+                cached_data = json_loads(f.read())
             
             logging.info(f"搜索缓存命中: {cache_key} (缓存年龄: {cache_age_hours:.1f}小时)")
             return cached_data
@@ -277,8 +366,7 @@ class SearchCacheManager:
             self._cleanup_cache_if_needed()
             
             # 写入缓存
-            with open(cache_filepath, 'w', encoding='utf-8') as f:
-                json.dump(result_data, f, ensure_ascii=False, separators=(',', ':'))
+            atomic_write_bytes(cache_filepath, json_dumps_bytes(result_data))
             
             logging.debug(f"搜索结果已缓存: {cache_key}")
             
@@ -407,7 +495,7 @@ class ApiTokenManager:
             logging.info(f"准备保存新的 API Token 到文件: {self.token_file_path}")
             logging.debug(f"Token 信息: 时间戳={self.timestamp.isoformat()}, Token 前10位={self.token[:10]}...")
             # 使用 utils 函数
-            if write_json_with_lock(self.token_file_path, self.lock, token_info):
+            if write_json_with_lock(self.token_file_path, self.lock, token_info, critical=True):
                 logging.info(f"新 API Token 已成功保存到 {self.token_file_path}")
             else:
                 logging.error(f"无法保存 API Token 到 {self.token_file_path}")
@@ -845,32 +933,43 @@ def filter_metadata(link_info, metadata_dict):
 
 
 # --- 后台任务处理 ---
+def send_scheduler_signal(log_prefix):
+    """向主调度器 (main.py) 发送 UDP 唤醒信号，使其立即检查队列中的 ready 任务。"""
+    signal_port = CONFIG.get('SCHEDULER_SIGNAL_PORT') # 从全局 CONFIG 获取端口
+    if not signal_port:
+        logging.warning(f"{log_prefix} 未在配置中找到 SCHEDULER_SIGNAL_PORT，无法发送唤醒信号。")
+        return
+    try:
+        # 创建临时 UDP 套接字发送信号
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            # 发送到 localhost 的指定端口
+            sock.sendto(b'check_queue', ("localhost", signal_port))
+            logging.info(f"{log_prefix} 已向主调度器 (localhost:{signal_port}) 发送唤醒信号。")
+    except socket.error as send_err:
+        logging.warning(f"{log_prefix} 发送 UDP 唤醒信号到 localhost:{signal_port} 失败: {send_err}")
+    except Exception as send_e:
+        logging.error(f"{log_prefix} 发送 UDP 唤醒信号时发生未知错误: {send_e}", exc_info=True)
+
 def process_task_background(task_uuid): # <--- 修改：只接收 UUID
     """后台线程处理单个任务 (使用本地时区)"""
-    global TOKEN_MANAGER, CONFIG, TASK_QUEUE_FILEPATH, APP_LOCKS, LOCAL_TZ
+    global TOKEN_MANAGER, CONFIG, TASK_STORE, LOCAL_TZ
     # --- 从队列中获取任务信息 ---
-    task_queue_lock = APP_LOCKS["task_queue"]
     link_info = None
     standard_user = None
     link = None
     log_prefix = f"[Task {task_uuid[:8]}]" # 简化日志前缀
 
     try:
-        with task_queue_lock.acquire(timeout=5): # 短暂获取锁读取信息
-            current_tasks = read_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, default=[])
-            task_data = next((task for task in current_tasks if task.get("uuid") == task_uuid), None)
-            if task_data:
-                link_info = task_data.get("link_info")
-                standard_user = task_data.get("user")
-                link = task_data.get("link")
-                log_prefix = f"[Task {task_uuid} | {link_info.get('type', 'unknown')} {link_info.get('id', 'unknown')}]" # 更新日志前缀
-                logging.info(f"{log_prefix} 后台任务启动。用户: {standard_user}, 链接: {link}")
-            else:
-                logging.error(f"[Task {task_uuid}] 后台任务启动失败：在队列中未找到对应的任务占位符。")
-                return # 找不到任务，无法继续
-    except Timeout:
-        logging.error(f"[Task {task_uuid}] 后台任务启动失败：获取任务队列锁超时（读取阶段）。")
-        return
+        task_data = TASK_STORE.get_task(task_uuid)
+        if task_data:
+            link_info = task_data.get("link_info")
+            standard_user = task_data.get("user")
+            link = task_data.get("link")
+            log_prefix = f"[Task {task_uuid} | {link_info.get('type', 'unknown')} {link_info.get('id', 'unknown')}]" # 更新日志前缀
+            logging.info(f"{log_prefix} 后台任务启动。用户: {standard_user}, 链接: {link}")
+        else:
+            logging.error(f"[Task {task_uuid}] 后台任务启动失败：在队列中未找到对应的任务占位符。")
+            return # 找不到任务，无法继续
     except Exception as e:
          logging.error(f"[Task {task_uuid}] 后台任务启动失败：读取任务队列时发生错误: {e}", exc_info=True)
          return
@@ -895,40 +994,31 @@ def process_task_background(task_uuid): # <--- 修改：只接收 UUID
                 if new_link_info:
                     # 检查队列中是否已存在相同的专辑任务
                     try:
-                        with task_queue_lock.acquire(timeout=10):
-                            current_tasks = read_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, default=[])
-                            # 查找是否存在相同用户的相同专辑任务
-                            existing_task = next((t for t in current_tasks 
-                                                if t.get("user") == standard_user 
-                                                and t.get("link_info", {}).get("type") == "album"
-                                                and t.get("link_info", {}).get("id") == new_link_info["id"]), None)
-                            
-                            if existing_task:
-                                logging.info(f"{log_prefix} 发现重复的专辑任务 (UUID: {existing_task.get('uuid')})，将删除当前单曲任务。")
-                                # 从队列中删除当前单曲任务
-                                current_tasks = [t for t in current_tasks if t.get("uuid") != task_uuid]
-                                if write_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, current_tasks):
-                                    logging.info(f"{log_prefix} 成功删除重复的单曲任务。")
-                                    # 通知长轮询等待的请求
-                                    QUEUE_NOTIFIER.notify_change()
-                                return
+                        current_tasks = TASK_STORE.load_tasks() or []
+                        # 查找是否存在相同用户的相同专辑任务
+                        existing_task = next((t for t in current_tasks 
+                                            if t.get("user") == standard_user 
+                                            and t.get("link_info", {}).get("type") == "album"
+                                            and t.get("link_info", {}).get("id") == new_link_info["id"]), None)
+                        
+                        if existing_task:
+                            logging.info(f"{log_prefix} 发现重复的专辑任务 (UUID: {existing_task.get('uuid')})，将删除当前单曲任务。")
+                            # 从队列中删除当前单曲任务
+                            if TASK_STORE.remove_tasks([task_uuid]) > 0:
+                                logging.info(f"{log_prefix} 成功删除重复的单曲任务。")
+                                # 通知长轮询等待的请求
+                                QUEUE_NOTIFIER.notify_change()
+                            return
+                        else:
+                            # 更新当前任务为专辑任务
+                            if TASK_STORE.update_task(task_uuid, {"link": album_url, "link_info": new_link_info}):
+                                logging.info(f"{log_prefix} 成功将单曲任务更新为专辑任务。")
+                                # 通知长轮询等待的请求
+                                QUEUE_NOTIFIER.notify_change()
+                                link_info = new_link_info
+                                link = album_url
                             else:
-                                # 更新当前任务为专辑任务
-                                for t in current_tasks:
-                                    if t.get("uuid") == task_uuid:
-                                        t["link"] = album_url
-                                        t["link_info"] = new_link_info
-                                        break
-                                if write_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, current_tasks):
-                                    logging.info(f"{log_prefix} 成功将单曲任务更新为专辑任务。")
-                                    # 通知长轮询等待的请求
-                                    QUEUE_NOTIFIER.notify_change()
-                                    link_info = new_link_info
-                                    link = album_url
-                                else:
-                                    logging.error(f"{log_prefix} 更新任务为专辑任务失败。")
-                    except Timeout:
-                        logging.error(f"{log_prefix} 获取任务队列锁超时（专辑转换阶段）。")
+                                logging.error(f"{log_prefix} 更新任务为专辑任务失败。")
                     except Exception as e:
                         logging.error(f"{log_prefix} 处理专辑转换时发生错误: {e}", exc_info=True)
                 else:
@@ -961,63 +1051,29 @@ def process_task_background(task_uuid): # <--- 修改：只接收 UUID
     # --- 更新任务队列中的条目 ---
     update_success = False
     try:
-        # 使用 utils 函数
-        with task_queue_lock.acquire(timeout=20):
-            current_tasks = read_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, default=None)
-            if current_tasks is None:
-                logging.error(f"{log_prefix} 更新任务失败：无法读取现有的 task_queue.json。")
-                return
-
-            task_found = False
-            for i, task in enumerate(current_tasks):
-                if task.get("uuid") == task_uuid:
-                    # 更新找到的任务
-                    current_tasks[i]["status"] = status
-                    current_tasks[i]["metadata"] = metadata_filtered
-                    if status == "error" and error_reason:
-                         current_tasks[i]["error_reason"] = error_reason
-                    else:
-                         # 如果之前有错误原因，成功后可以清除它
-                         current_tasks[i].pop("error_reason", None)
-                    task_found = True
-                    break # 找到并更新后退出循环
+        task_fields = {"status": status, "metadata": metadata_filtered}
+        remove_keys = ()
+        if status == "error" and error_reason:
+            task_fields["error_reason"] = error_reason
+        else:
+            # 如果之前有错误原因，成功后可以清除它
+            remove_keys = ("error_reason",)
 
-            if not task_found:
-                 logging.error(f"{log_prefix} 更新任务失败：在写入阶段未找到任务 UUID {task_uuid}。")
-                 return
+        # 仅更新该任务的行，不重写整个队列
+        if TASK_STORE.update_task(task_uuid, task_fields, remove_keys=remove_keys):
+            logging.info(f"{log_prefix} 任务成功处理并已更新到任务队列。新状态: {status}")
+            update_success = True
+             
+            # 通知长轮询等待的请求
+            QUEUE_NOTIFIER.notify_change()
 
-            # 写回整个列表
-            # 使用 utils 函数
-            if write_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, current_tasks):
-                 logging.info(f"{log_prefix} 任务成功处理并已更新到 task_queue.json。新状态: {status}")
-                 update_success = True
-                 
-                 # 通知长轮询等待的请求
-                 QUEUE_NOTIFIER.notify_change()
-
-                 # --- 如果状态更新为 ready，发送 UDP 信号给 main.py ---
-                 if status == "ready":
-                     signal_port = CONFIG.get('SCHEDULER_SIGNAL_PORT') # 从全局 CONFIG 获取端口
-                     if signal_port:
-                         try:
-                             # 创建临时 UDP 套接字发送信号
-                             with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-                                 # 发送到 localhost 的指定端口
-                                 sock.sendto(b'check_queue', ("localhost", signal_port))
-                                 logging.info(f"{log_prefix} 已向主调度器 (localhost:{signal_port}) 发送唤醒信号。")
-                         except socket.error as send_err:
-                             logging.warning(f"{log_prefix} 发送 UDP 唤醒信号到 localhost:{signal_port} 失败: {send_err}")
-                         except Exception as send_e:
-                             logging.error(f"{log_prefix} 发送 UDP 唤醒信号时发生未知错误: {send_e}", exc_info=True)
-                     else:
-                         logging.warning(f"{log_prefix} 未在配置中找到 SCHEDULER_SIGNAL_PORT，无法发送唤醒信号。")
-                 # --- 发送信号结束 ---
+            # --- 如果状态更新为 ready，发送 UDP 信号给 main.py ---
+            if status == "ready":
+                send_scheduler_signal(log_prefix)
 
-            else:
-                 logging.error(f"{log_prefix} 更新任务失败：无法写回 task_queue.json。")
+        else:
+            logging.error(f"{log_prefix} 更新任务失败：任务不存在或写入任务存储失败。")
 
-    except Timeout:
-        logging.error(f"{log_prefix} 获取 task_queue 文件锁超时（写入阶段），任务更新失败。")
     except Exception as e:
         logging.error(f"{log_prefix} 在更新任务队列时发生错误: {e}", exc_info=True)
 
@@ -1160,7 +1216,7 @@ def trigger_remote_compilation_upload(config):
 @app.route("/task", methods=["POST"])
 def submit_task():
     """接收用户提交的任务，添加占位符，然后启动后台处理"""
-    global USERS_DATA, CONFIG, TASK_QUEUE_FILEPATH, APP_LOCKS, LOCAL_TZ
+    global USERS_DATA, CONFIG, TASK_STORE, LOCAL_TZ
     
     # --- 打印 HTTP 请求头 ---
     logging.info("=" * 60)
@@ -1189,8 +1245,6 @@ def submit_task():
     validation_failures = []
     request_task_identifiers_seen = set()
     allowed_storefronts = set(CONFIG.get("storefront_language_map", {}).keys())
-    task_queue_lock = APP_LOCKS["task_queue"]
-    existing_task_identifiers = set()
 
     # --- 从 HTTP 头获取默认用户名 ---
     x_user_header = request.headers.get("X-User")
@@ -1227,6 +1281,8 @@ def submit_task():
             
         link_info = parse_link(processed_link, allowed_storefronts)
         if not link_info: validation_failures.append({"input_index": index, "input_task": task_input, "reason": "链接无效"}); continue
+        priority = task_input.get("priority", DEFAULT_TASK_PRIORITY)
+        if priority not in TASK_PRIORITIES: validation_failures.append({"input_index": index, "input_task": task_input, "reason": f"优先级无效 (可选: {', '.join(TASK_PRIORITIES)})"}); continue
         task_identifier = (standard_user, processed_link)
         if task_identifier in request_task_identifiers_seen: validation_failures.append({"input_index": index, "input_task": task_input, "reason": "请求内重复"}); continue
 
@@ -1243,7 +1299,8 @@ def submit_task():
             "metadata": None,
             "submit_time": submit_time_iso,
             "order_index": index, # 保留原始顺序
-            "skip_check": task_input.get("skip_check", False) # 添加 skip_check 参数，默认为 False
+            "skip_check": task_input.get("skip_check", False), # 添加 skip_check 参数，默认为 False
+            "priority": priority # 调度优先级: high / normal / low
         }
         newly_accepted_tasks.append(placeholder_task)
 
@@ -1251,60 +1308,28 @@ def submit_task():
     tasks_to_start_processing = [] # 实际需要启动后台线程的任务
     if newly_accepted_tasks:
         try:
-            with task_queue_lock.acquire(timeout=10): # 需要足够时间读写
-                current_tasks = read_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, default=None)
-                if current_tasks is None:
-                     logging.error("添加任务失败：无法读取现有的 task_queue.json。")
-                     for task in newly_accepted_tasks:
-                         validation_failures.append({"input_index": task['order_index'], "input_task": {"user": task['user'], "link": task['link']}, "reason": "服务器内部错误(队列读失败)"})
-                     newly_accepted_tasks.clear()
-                     raise Exception("无法读取任务队列")
-
-                existing_task_identifiers = set((t.get('user'), t.get('link')) for t in current_tasks if t.get('user') and t.get('link'))
-
-                added_count = 0
-                for placeholder in newly_accepted_tasks:
-                    task_identifier = (placeholder['user'], placeholder['link'])
-                    if task_identifier in existing_task_identifiers:
-                        validation_failures.append({"input_index": placeholder['order_index'], "input_task": {"user": placeholder['user'], "link": placeholder['link']}, "reason": "队列中已存在"})
-                    else:
-                        current_tasks.append(placeholder) # 按顺序追加到列表末尾
-                        tasks_to_start_processing.append(placeholder['uuid']) # 记录需要启动线程的 UUID
-                        added_count += 1
-
-                # 如果有新任务添加，则写回文件
-                if added_count > 0:
-                    # 使用 utils 函数
-                    if write_json_with_lock(TASK_QUEUE_FILEPATH, task_queue_lock, current_tasks):
-                         logging.info(f"成功将 {added_count} 个新任务占位符写入 task_queue.json。")
-                         # 通知长轮询等待的请求
-                         QUEUE_NOTIFIER.notify_change()
-                    else:
-                         logging.error("写入任务占位符到 task_queue.json 失败！")
-                         # 标记刚才添加的任务为失败
-                         for task_uuid_to_fail in tasks_to_start_processing:
-                              task_data_orig = next((t for t in newly_accepted_tasks if t['uuid'] == task_uuid_to_fail), None)
-                              if task_data_orig:
-                                   validation_failures.append({"input_index": task_data_orig['order_index'], "input_task": {"user": task_data_orig['user'], "link": task_data_orig['link']}, "reason": "服务器内部错误(队列写失败)"})
-                         tasks_to_start_processing.clear() # 清空，因为写入失败
-
-        except Timeout:
-            logging.error("获取任务队列锁超时，无法添加新任务。")
-            # 标记所有尝试添加的任务为失败
-            for task in newly_accepted_tasks:
-                 validation_failures.append({"input_index": task['order_index'], "input_task": {"user": task['user'], "link": task['link']}, "reason": "服务器内部错误(队列锁超时)"})
-            tasks_to_start_processing.clear() # 清空
+            # 按 (user, link) 去重并追加，由任务存储保证原子性
+            add_result = TASK_STORE.add_tasks(newly_accepted_tasks, unique_fields=("user", "link"))
+            if add_result is None:
+                logging.error("写入任务占位符到任务队列失败！")
+                for task in newly_accepted_tasks:
+                    validation_failures.append({"input_index": task['order_index'], "input_task": {"user": task['user'], "link": task['link']}, "reason": "服务器内部错误(队列写失败)"})
+            else:
+                added_tasks, duplicate_tasks = add_result
+                for placeholder in duplicate_tasks:
+                    validation_failures.append({"input_index": placeholder['order_index'], "input_task": {"user": placeholder['user'], "link": placeholder['link']}, "reason": "队列中已存在"})
+                tasks_to_start_processing = [placeholder['uuid'] for placeholder in added_tasks] # 记录需要启动线程的 UUID
+                if added_tasks:
+                    logging.info(f"成功将 {len(added_tasks)} 个新任务占位符写入任务队列。")
+                    # 通知长轮询等待的请求
+                    QUEUE_NOTIFIER.notify_change()
         except Exception as e:
              logging.error(f"添加任务到队列时发生错误: {e}", exc_info=True)
-             # 标记所有尝试添加的任务为失败 (除非已在上面处理)
-             if not tasks_to_start_processing: # 如果上面已经处理过失败，这里就不再重复添加失败记录
-                 pass
-             else:
-                  for task in newly_accepted_tasks:
-                       # 避免重复添加失败记录
-                       if not any(vf['input_index'] == task['order_index'] for vf in validation_failures):
-                            validation_failures.append({"input_index": task['order_index'], "input_task": {"user": task['user'], "link": task['link']}, "reason": "服务器内部错误(队列处理异常)"})
-                  tasks_to_start_processing.clear() # 清空
+             for task in newly_accepted_tasks:
+                  # 避免重复添加失败记录
+                  if not any(vf['input_index'] == task['order_index'] for vf in validation_failures):
+                       validation_failures.append({"input_index": task['order_index'], "input_task": {"user": task['user'], "link": task['link']}, "reason": "服务器内部错误(队列处理异常)"})
+             tasks_to_start_processing.clear() # 清空
 
 
     # --- 步骤 3: 启动后台线程 ---
@@ -1345,66 +1370,313 @@ def submit_task():
     return jsonify(response_data), 200
 
 
+def build_queue_delta(since, version, snapshot):
+    """计算 since 版本之后的增量：变化的任务 (完整)、变化的音轨 (按 uuid 分组) 与已移除的 UUID。
+    任务数据取自不早于 version 的快照；变更记录不完整时返回 None，调用方应返回全量。"""
+    changes = QUEUE_CHANGE_LOG.changes_since(since, version)
+    if changes is None:
+        return None
+    task_uuids, track_ids, removed = {}, {}, {}  # dict 作为有序集合
+    for change in changes:
+        kind, task_uuid, song_id = change.get("kind"), change.get("uuid"), change.get("song_id")
+        if kind == CHANGE_REMOVE:
+            removed[task_uuid] = True
+            task_uuids.pop(task_uuid, None)
+            track_ids.pop(task_uuid, None)
+        elif kind in (CHANGE_ADD, CHANGE_TASK) or (kind == CHANGE_TRACK and song_id is None):
+            task_uuids[task_uuid] = True
+            removed.pop(task_uuid, None)
+        elif kind == CHANGE_TRACK:
+            track_ids.setdefault(task_uuid, {})[song_id] = True
+    tasks, tracks = [], {}
+    for task_uuid in task_uuids:
+        task = snapshot.get_task(task_uuid)
+        if task is None:
+            removed[task_uuid] = True
+        else:
+            tasks.append(task)
+    for task_uuid, song_ids in track_ids.items():
+        if task_uuid in task_uuids:
+            continue
+        task = snapshot.get_task(task_uuid)
+        if task is None:
+            removed[task_uuid] = True
+            continue
+        task_tracks = (task.get("metadata") or {}).get("tracks") or []
+        tracks[task_uuid] = [t for t in task_tracks if isinstance(t, dict) and t.get("song_id") in song_ids]
+    return {"version": version, "full": False, "tasks": tasks, "tracks": tracks, "removed": list(removed)}
+
+
 @app.route("/task", methods=["GET"])
 def get_tasks():
-    """获取任务队列中的所有任务，支持长轮询"""
-    global TASK_QUEUE_FILEPATH, QUEUE_NOTIFIER
+    """获取任务队列中的所有任务，支持长轮询与增量
+
+    响应头 X-Queue-Version 为当前队列版本号，全量响应带 ETag，If-None-Match 命中时返回 304。
+    带 version 参数长轮询时，版本号不同立即返回，相同则等待任意变化，超时无变化返回 204。
+    带 since 参数时返回 {"version", "full", "tasks", "tracks", "removed"}：
+    full 为 false 时 tasks 只含变化的任务，tracks 为 {uuid: [变化的音轨]}；变更记录不完整时 full 为 true 并返回全部任务。
+    """
+    global TASK_STORE, QUEUE_NOTIFIER, TASK_SNAPSHOT_CACHE
     
     # 获取长轮询参数
     wait = request.args.get('wait', 'false').lower() == 'true'
     timeout = min(int(request.args.get('timeout', '30')), 60)  # 最大60秒超时
+    since = request.args.get('since', type=int)  # 增量模式的起始版本号
+    client_version = request.args.get('version', type=int)  # 客户端已持有的队列版本号
+    if client_version is None:
+        client_version = since
     
-    def read_current_tasks():
-        """读取当前任务列表"""
+    def read_current_version():
         try:
-            if not os.path.exists(TASK_QUEUE_FILEPATH):
-                return []
-            with open(TASK_QUEUE_FILEPATH, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except json.JSONDecodeError as e:
-            logging.error(f"GET /task: 解析任务队列 JSON 文件失败: {e}")
-            return None  # 表示错误
+            return TASK_STORE.get_version()
+        except Exception as e:
+            logging.error(f"GET /task: 读取队列版本号时出错: {e}", exc_info=True)
+            return None
+    
+    def read_snapshot():
+        """读取当前任务队列快照 (所有请求共享，版本未变时不重新解析与编码)"""
+        try:
+            return TASK_SNAPSHOT_CACHE.get(TASK_STORE)  # None 表示错误
         except Exception as e:
-            logging.error(f"GET /task: 读取任务队列文件时出错: {e}", exc_info=True)
+            logging.error(f"GET /task: 读取任务队列时出错: {e}", exc_info=True)
             return None  # 表示错误
     
-    # 首次读取任务
-    tasks = read_current_tasks()
-    if tasks is None:
+    def full_response(snapshot):
+        response = TASK_SNAPSHOT_CACHE.response(snapshot)
+        response.set_etag(f"{QUEUE_EPOCH}-{snapshot.version}")
+        response.headers["X-Queue-Version"] = str(snapshot.version)
+        return response
+    
+    def queue_response(version):
+        """按请求模式构造响应；先读版本号，返回的数据至少与该版本一样新。"""
+        snapshot = read_snapshot()
+        if snapshot is None:
+            return jsonify({"error": "无法读取任务队列。"}), 500
+        if since is None:
+            logging.info(f"GET /task: 返回 {len(snapshot.tasks)} 个任务 (版本: {snapshot.version}, 长轮询: {wait})")
+            return full_response(snapshot)
+        # 订阅线程可能尚未收到最新版本的消息，先返回已记录部分，其余在下次请求中补齐
+        latest = QUEUE_CHANGE_LOG.latest_version()
+        if latest is not None and since <= latest < version:
+            version = latest
+        try:
+            delta = build_queue_delta(since, version, snapshot)
+        except Exception as e:
+            logging.error(f"GET /task: 计算增量时出错: {e}", exc_info=True)
+            delta = None
+        if delta is not None:
+            logging.info(f"GET /task: 返回版本 {since} -> {version} 的增量 ({len(delta['tasks'])} 个任务, {len(delta['tracks'])} 个任务的音轨, {len(delta['removed'])} 个移除)")
+            response = jsonify(delta)
+            response.headers["X-Queue-Version"] = str(version)
+            return response
+        logging.info(f"GET /task: 版本 {since} 的变更记录不完整，返回全量 {len(snapshot.tasks)} 个任务 (版本: {snapshot.version})")
+        body = b'{"version":%d,"full":true,"tasks":%s,"tracks":{},"removed":[]}' % (snapshot.version, snapshot.body())
+        response = app.response_class(body, mimetype="application/json")
+        response.headers["X-Queue-Version"] = str(snapshot.version)
+        return response
+    
+    # 首次读取 (先记录通知代数，读取之后发生的变化不会被漏掉)
+    generation = QUEUE_NOTIFIER.current_generation()
+    version = read_current_version()
+    if version is None:
         return jsonify({"error": "无法读取任务队列。"}), 500
+    etag = f"{QUEUE_EPOCH}-{version}"
+    
+    # 客户端缓存仍是最新版本
+    if since is None and not wait and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers["X-Queue-Version"] = str(version)
+        return response
     
-    # 如果不启用长轮询，或者有任务，直接返回
-    if not wait or len(tasks) > 0:
-        logging.info(f"GET /task: 返回 {len(tasks)} 个任务 (长轮询: {wait})")
-        return jsonify(tasks)
+    # 如果不启用长轮询，或者客户端版本已过期，直接返回
+    if not wait or (client_version is not None and client_version != version):
+        return queue_response(version)
     
-    # 启用长轮询且当前无任务，等待变化
+    if client_version is None:
+        # 旧版长轮询：有任务时直接返回，无任务时等待变化
+        snapshot = read_snapshot()
+        if snapshot is None:
+            return jsonify({"error": "无法读取任务队列。"}), 500
+        if len(snapshot.tasks) > 0:
+            logging.info(f"GET /task: 返回 {len(snapshot.tasks)} 个任务 (版本: {snapshot.version}, 长轮询: {wait})")
+            return full_response(snapshot)
+    
+    # 启用长轮询且队列无变化，等待变化
     logging.info(f"GET /task: 启用长轮询，等待最多 {timeout} 秒...")
     
     start_time = time.time()
-    has_change = QUEUE_NOTIFIER.wait_for_change(timeout)
+    has_change = QUEUE_NOTIFIER.wait_for_change(timeout, since_generation=generation)
     wait_time = time.time() - start_time
     
     if has_change:
-        # 有变化，重新读取任务
-        tasks = read_current_tasks()
-        if tasks is None:
+        # 有变化，重新读取
+        version = read_current_version()
+        if version is None:
             return jsonify({"error": "无法读取任务队列。"}), 500
-        logging.info(f"GET /task: 长轮询检测到变化，等待 {wait_time:.1f}s，返回 {len(tasks)} 个任务")
-        return jsonify(tasks)
+        logging.info(f"GET /task: 长轮询检测到变化，等待 {wait_time:.1f}s (版本: {version})")
+        return queue_response(version)
+    elif client_version is not None:
+        # 超时且无变化
+        logging.info(f"GET /task: 长轮询超时 ({wait_time:.1f}s)，版本 {version} 无变化")
+        response = app.response_class(status=204)
+        response.headers["X-Queue-Version"] = str(version)
+        return response
     else:
         # 超时，返回空列表
         logging.info(f"GET /task: 长轮询超时 ({wait_time:.1f}s)，返回空列表")
-        return jsonify([])
+        response = jsonify([])
+        response.headers["X-Queue-Version"] = str(version)
+        return response
+
+@app.route("/task/<task_uuid>/retry-failed", methods=["POST"])
+def retry_failed_tracks(task_uuid):
+    """只重试任务中失败 (未完成) 的音轨：任务重新进入 ready，已完成的音轨 (completion 检查点) 不再下载，
+    全部音轨结束后照常执行专辑校验与通知。已退役到历史存储的失败任务会被重新放回队列。
+
+    与提交任务相同，调用方用户由 X-User 头给出 (也可在请求体 {"user": "..."} 中提供)，须为有效用户且与任务所属用户一致。
+    """
+    if TASK_STORE is None:
+        return jsonify({"error": "任务存储不可用。"}), 503
+    log_prefix = f"[Task {task_uuid[:8]}]"
+    payload = request.get_json(silent=True) or {}
+    submitted_user = request.headers.get("X-User") or payload.get("user")
+    if not submitted_user:
+        return jsonify({"error": "缺少必需的 X-User HTTP 头。"}), 400
+    user = normalize_username(submitted_user, USERS_DATA)
+    if not user:
+        return jsonify({"error": "用户无效。"}), 403
+    task = TASK_STORE.get_task(task_uuid)
+    from_history = False
+    if task is None and HISTORY_STORE is not None:
+        task = HISTORY_STORE.get(task_uuid)
+        from_history = task is not None
+    if task is None:
+        return jsonify({"error": "未找到该任务。"}), 404
+    if user != task.get("user"):
+        return jsonify({"error": "无权重试该任务。"}), 403
+    if task.get("status") != "error":
+        return jsonify({"error": f"只能重试失败的任务，当前状态: {task.get('status')}。"}), 409
+    metadata = task.get("metadata")
+    if not isinstance(metadata, dict):
+        return jsonify({"error": "任务缺少元数据，请重新提交。"}), 409
+
+    if (task.get("link_info") or {}).get("type") in ("album", "playlist"):
+        tracks = [t for t in (metadata.get("tracks") or []) if isinstance(t, dict)]
+        completed = sum(1 for t in tracks if is_track_done(t))
+    else:
+        # 单曲 / MV 任务由调度器作为一个整体重新执行 (与 execute_task 一致)
+        tracks, completed = [task], 0
+    retry_fields = {
+        "status": "ready",
+        "retry_count": task.get("retry_count", 0) + 1,
+        "retry_requested_at": datetime.now(timezone.utc).isoformat(),
+    }
+    retry_remove_keys = ("error_reason", "error_log", "process_complete_time", "checking")
+    try:
+        if from_history:
+            # 已退役：先移除历史记录再放回队列 (保留音轨检查点)，放回失败时恢复历史记录；任务再次结束时重新归档
+            if not HISTORY_STORE.remove([task_uuid]):
+                return jsonify({"error": "任务已被重试。"}), 409
+            requeued = {k: v for k, v in task.items() if k not in retry_remove_keys}
+            requeued.update(retry_fields)
+            try:
+                result = TASK_STORE.add_tasks([requeued], unique_fields=("uuid",))
+            except Exception:
+                result = None
+                logging.error(f"{log_prefix} 任务放回队列时出错。", exc_info=True)
+            if not result or not result[0]:
+                HISTORY_STORE.archive([task], notified=True)
+                return jsonify({"error": "任务放回队列失败。"}), 500
+        elif not TASK_STORE.update_task(task_uuid, retry_fields, remove_keys=retry_remove_keys):
+            return jsonify({"error": "更新任务状态失败。"}), 500
+    except Exception as e:
+        logging.error(f"{log_prefix} 重试失败音轨时出错: {e}", exc_info=True)
+        return jsonify({"error": "重试任务失败。"}), 500
+
+    logging.info(f"{log_prefix} 重试失败音轨: {len(tracks) - completed} 个待重试，{completed} 个已完成将跳过" + ("，已从历史存储放回队列。" if from_history else "。"))
+    QUEUE_NOTIFIER.notify_change()
+    send_scheduler_signal(log_prefix)
+    return jsonify({
+        "uuid": task_uuid, "status": "ready", "retry_count": retry_fields["retry_count"],
+        "tracks_to_retry": len(tracks) - completed, "tracks_completed": completed, "requeued_from_history": from_history,
+    })
+
+@app.route("/history", methods=["GET"])
+def get_task_history():
+    """分页查询已完成 / 失败任务的历史 (不含 error_log)
+
+    参数: user, status (finish / error), since, until (ISO 日期或时间，按完成时间过滤), limit, offset
+    """
+    if HISTORY_STORE is None:
+        return jsonify({"error": "任务历史存储不可用。"}), 503
+    status = request.args.get("status") or None
+    if status and status not in HISTORY_STATUSES:
+        return jsonify({"error": f"status 只能是 {', '.join(HISTORY_STATUSES)}。"}), 400
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    user = request.args.get("user") or None
+    if user:
+        user = normalize_username(user, USERS_DATA) or user
+    try:
+        items, total = HISTORY_STORE.query(
+            user=user, status=status,
+            since=request.args.get("since"), until=request.args.get("until"),
+            limit=limit, offset=offset
+        )
+    except Exception as e:
+        logging.error(f"GET /history: 查询任务历史失败: {e}", exc_info=True)
+        return jsonify({"error": "查询任务历史失败。"}), 500
+    return jsonify({"total": total, "limit": min(max(1, limit), MAX_PAGE_SIZE), "offset": max(0, offset), "items": items})
+
+@app.route("/history/<task_uuid>", methods=["GET"])
+def get_task_history_detail(task_uuid):
+    """获取单个历史任务的完整数据 (含解压后的 error_log，log=false 时省略)"""
+    if HISTORY_STORE is None:
+        return jsonify({"error": "任务历史存储不可用。"}), 503
+    include_log = request.args.get("log", "true").lower() != "false"
+    task = HISTORY_STORE.get(task_uuid, include_log=include_log)
+    if task is None:
+        return jsonify({"error": "未找到该任务的历史记录。"}), 404
+    return jsonify(task)
+
+@app.route("/stats/locks", methods=["GET"])
+def get_file_lock_stats():
+    """获取本进程文件锁 (共享读 / 排他写) 的等待与持有时间统计"""
+    return jsonify(get_lock_stats())
+
+@app.route("/stats/io", methods=["GET"])
+def get_io_call_site_stats():
+    """获取本进程按调用点统计的 I/O 直方图 (锁等待/持有、解析/序列化耗时、读写字节数、超时次数)"""
+    return jsonify(get_io_stats())
+
+def force_token_refresh():
+    """处理 refresh=1：只接受本机调用方 (调度器)，且两次强制刷新至少间隔 TOKEN_FORCE_REFRESH_MIN_INTERVAL 秒，
+    当前 Token 比该间隔更新时直接复用，避免客户端反复触发上游获取。"""
+    global LAST_FORCED_TOKEN_REFRESH
+    if request.remote_addr not in LOOPBACK_ADDRESSES:
+        logging.warning(f"忽略来自 {request.remote_addr} 的强制刷新 Token 请求 (仅允许本机)。")
+        return False
+    with TOKEN_FORCE_REFRESH_LOCK:
+        now = time.monotonic()
+        if now - LAST_FORCED_TOKEN_REFRESH < TOKEN_FORCE_REFRESH_MIN_INTERVAL:
+            logging.info("距上次强制刷新 Token 不足间隔，复用当前 Token。")
+            return False
+        token_age = (datetime.now(TOKEN_MANAGER.local_tz) - TOKEN_MANAGER.timestamp).total_seconds() if TOKEN_MANAGER.timestamp else None
+        if token_age is not None and token_age < TOKEN_FORCE_REFRESH_MIN_INTERVAL:
+            logging.info(f"当前 Token 获取于 {token_age:.0f} 秒前，不再强制刷新。")
+            return False
+        LAST_FORCED_TOKEN_REFRESH = now
+    TOKEN_MANAGER.invalidate_token()
+    return True
 
 @app.route("/token", methods=["GET"])
 def get_api_token():
-    """获取当前有效的 API Token，如果即将过期则主动刷新"""
+    """获取当前有效的 API Token，如果即将过期则主动刷新；refresh=1 时先使缓存的 Token 失效 (调用方报告令牌失败)"""
     global TOKEN_MANAGER
     try:
+        if request.args.get("refresh") in ("1", "true"):
+            force_token_refresh()
         # 检查当前 Token 状态
         current_token = TOKEN_MANAGER.token
         current_timestamp = TOKEN_MANAGER.timestamp
@@ -1542,7 +1814,7 @@ def proxy_search():
         if cached_result:
             logging.info(f"搜索缓存命中，跳过API请求: {request.query_string.decode()}")
             return Response(
-                json.dumps(cached_result, ensure_ascii=False, separators=(',', ':')),
+                json_dumps_bytes(cached_result, pretty=False),
                 status=200,
                 mimetype='application/json'
             )
@@ -1591,7 +1863,7 @@ def proxy_search():
                     SEARCH_CACHE_MANAGER.cache_result(storefront, query_params, response_data)
                 
                 return Response(
-                    json.dumps(response_data, ensure_ascii=False, separators=(',', ':')),
+                    json_dumps_bytes(response_data, pretty=False),
                     status=200,
                     mimetype='application/json'
                 )
@@ -1627,7 +1899,8 @@ def initialize_app():
     """加载配置、设置日志、初始化 Token 管理器、检测本地时区"""
     global CONFIG, USERS_DATA, TOKEN_MANAGER, SEARCH_CACHE_MANAGER, LOCAL_TZ
     global TASK_QUEUE_FILEPATH, TASK_QUEUE_LOCK_FILEPATH
-    global API_TOKEN_LOCK_FILEPATH, APP_LOCKS
+    global API_TOKEN_LOCK_FILEPATH, APP_LOCKS, TASK_STORE, CHANGE_FEED_SUBSCRIBER, QUEUE_CHANGE_LOG, TASK_SNAPSHOT_CACHE
+    global HISTORY_STORE
 
     # 1. 加载配置
     config_path = os.path.join(SERVER_DIR, "config", "config.yaml")
@@ -1643,6 +1916,8 @@ def initialize_app():
     # 2. 设置日志 (使用 utils 函数，并传递中文名)
     # 确保在 validate_config 之前调用，因为 validate_config 内部会使用 logging
     setup_logging(CONFIG, script_chinese_name="后端服务器")
+    configure_json_codec(CONFIG)
+    configure_durability(CONFIG)
     
     # 校验配置 (现在可以安全使用 logging)
     validate_config(CONFIG)
@@ -1704,6 +1979,27 @@ def initialize_app():
     logging.info(f"API Token 文件: {token_file_path}"); logging.info(f"API Token 锁: {API_TOKEN_LOCK_FILEPATH}")
     os.makedirs(os.path.dirname(TASK_QUEUE_LOCK_FILEPATH), exist_ok=True)
     os.makedirs(os.path.dirname(API_TOKEN_LOCK_FILEPATH), exist_ok=True)
+    # 6.1 初始化任务存储 (json / sqlite)
+    try:
+        TASK_STORE = create_task_store(CONFIG, TASK_QUEUE_FILEPATH, APP_LOCKS["task_queue"])
+        logging.info(f"任务存储后端: {TASK_STORE.name}")
+    except Exception as e: logging.critical(f"初始化任务存储失败: {e}。", exc_info=True); exit(1)
+    TASK_SNAPSHOT_CACHE = TaskSnapshotCache(CONFIG)
+    # 6.3 任务历史存储 (只读查询，归档由 main.py 写入)
+    try:
+        HISTORY_STORE = create_history_store(CONFIG)
+    except Exception as e:
+        logging.error(f"初始化任务历史存储失败: {e}，/history 接口不可用。", exc_info=True)
+        HISTORY_STORE = None
+    # 6.2 订阅任务队列变更 (调度器与本进程的写入都会唤醒 GET /task 长轮询)
+    socket_path = resolve_socket_path(CONFIG)
+    if socket_path:
+        try:
+            QUEUE_CHANGE_LOG = ChangeLog((CONFIG.get("change_feed", {}) or {}).get("log_size", DEFAULT_CHANGE_LOG_SIZE))
+            CHANGE_FEED_SUBSCRIBER = ChangeFeedSubscriber(socket_path, on_queue_change)
+            TASK_STORE.set_publisher(ChangeFeedPublisher(socket_path))
+        except OSError as e:
+            logging.error(f"初始化任务队列变更订阅失败: {e}，长轮询将只响应本进程内的变化。")
     # 7. 初始化 Token Manager
     try:
         TOKEN_MANAGER = ApiTokenManager(CONFIG)
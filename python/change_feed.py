@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# change_feed.py - 任务队列跨进程变更通知 (Unix 域数据报套接字)
+#
+# 每次任务队列提交后，写入方 (main.py 调度器 / backend.py) 发布一条消息:
+#   {"version": 版本号, "changes": [{"uuid": ..., "kind": ..., "song_id": ...}, ...]}
+# backend.py 订阅该套接字，收到消息即唤醒 GET /task 长轮询。
+
+import os
+import socket
+import logging
+import threading
+from collections import OrderedDict
+
+from utils import PROJECT_ROOT, json_dumps_bytes, json_loads
+
+# --- 默认配置 ---
+DEFAULT_CHANGE_FEED_SOCKET = "info/queue_changes.sock"
+MAX_CHANGES_PER_MESSAGE = 500  # 超过时只发送版本号，订阅方按整体变化处理
+DEFAULT_CHANGE_LOG_SIZE = 1024  # 订阅方保留的最近版本数，用于 GET /task?since= 增量响应
+
+# 变更类型
+CHANGE_ADD = "add"
+CHANGE_TASK = "task"
+CHANGE_TRACK = "track"
+CHANGE_REMOVE = "remove"
+CHANGE_RESET = "reset"
+
+
+def change_feed_supported():
+    return hasattr(socket, "AF_UNIX")
+
+
+def resolve_socket_path(config):
+    """从 config.yaml 的 change_feed 配置解析套接字路径，禁用或平台不支持时返回 None。"""
+    feed_config = config.get("change_feed", {}) or {}
+    if not feed_config.get("enabled", True):
+        return None
+    if not change_feed_supported():
+        logging.warning("当前平台不支持 Unix 域套接字，任务队列变更通知已禁用。")
+        return None
+    socket_path = feed_config.get("socket_path", DEFAULT_CHANGE_FEED_SOCKET)
+    if not os.path.isabs(socket_path):
+        socket_path = os.path.normpath(os.path.join(PROJECT_ROOT, socket_path))
+    return socket_path
+
+
+class ChangeFeedPublisher:
+    """变更发布方：非阻塞发送，订阅方不存在时静默丢弃。"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.lock = threading.Lock()
+
+    def publish(self, version, changes):
+        if len(changes) > MAX_CHANGES_PER_MESSAGE:
+            changes = [{"uuid": None, "kind": CHANGE_RESET, "song_id": None}]
+        message = json_dumps_bytes({"version": version, "changes": changes}, pretty=False)
+        try:
+            with self.lock:
+                self.sock.sendto(message, self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            pass  # 订阅方未启动或缓冲区已满，订阅方会在下次读取时按版本号对齐
+        except OSError as e:
+            logging.debug(f"发布任务队列变更失败: {e}")
+
+
+class ChangeFeedSubscriber:
+    """变更订阅方：绑定套接字并在后台线程中把收到的消息交给回调。"""
+
+    def __init__(self, socket_path, callback):
+        self.socket_path = socket_path
+        self.callback = callback
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # 上次未正常退出留下的套接字文件
+        socket_dir = os.path.dirname(socket_path)
+        if socket_dir:
+            os.makedirs(socket_dir, exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(socket_path)
+        self.thread = threading.Thread(target=self._run, name="队列变更订阅", daemon=True)
+        self.thread.start()
+        logging.info(f"已订阅任务队列变更通知: {socket_path}")
+
+    def _run(self):
+        while True:
+            try:
+                data = self.sock.recv(1 << 20)
+                message = json_loads(data)
+                self.callback(message.get("version"), message.get("changes") or [])
+            except ValueError as e:
+                logging.warning(f"忽略无法解析的任务队列变更消息: {e}")
+            except OSError as e:
+                logging.error(f"任务队列变更订阅套接字出错，停止订阅: {e}")
+                return
+            except Exception as e:
+                logging.error(f"处理任务队列变更消息时发生错误: {e}", exc_info=True)
+
+
+class ChangeLog:
+    """订阅方保留最近若干个版本的变更条目 (环形缓冲)，用于计算 since 版本之后的增量。"""
+
+    def __init__(self, max_versions=DEFAULT_CHANGE_LOG_SIZE):
+        self.max_versions = max(1, int(max_versions))
+        self._entries = OrderedDict()  # version -> changes
+        self._lock = threading.Lock()
+
+    def record(self, version, changes):
+        if not isinstance(version, int):
+            return
+        with self._lock:
+            self._entries[version] = changes
+            while len(self._entries) > self.max_versions:
+                self._entries.popitem(last=False)
+
+    def latest_version(self):
+        with self._lock:
+            return next(reversed(self._entries), None)
+
+    def changes_since(self, since, current):
+        """返回 (since, current] 之间按版本顺序排列的全部变更条目。
+
+        缺少任意一个版本 (已被淘汰、消息丢失或尚未收到) 或其中包含 reset 时返回 None，调用方应返回全量。
+        """
+        if since > current:
+            return None
+        changes = []
+        with self._lock:
+            for version in range(since + 1, current + 1):
+                entry = self._entries.get(version)
+                if entry is None:
+                    return None
+                changes.extend(entry)
+        if any(change.get("kind") == CHANGE_RESET for change in changes):
+            return None
+        return changes
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# decryptor_balancer.py - 解密器 (wrapper) 端点的健康感知负载均衡
+#
+# 取代对 source.yaml 中 decrypt-m3u8-port / get-m3u8-port 列表的盲目轮询:
+#   每个端点记录在途请求数与容量上限，优先选择在途最少、健康分最高的端点；
+#   健康分为执行结果的指数滑动平均 (只有 ENDPOINT_FAILURE_CLASSES 中的失败计入，token / not_found 等与端点无关的失败不计分)，连接解密器失败 (GO_CONNECT_ERROR_PATTERN) 连续达到阈值或健康分过低时熔断，
+#   熔断 open_seconds 秒后进入半开状态，只放行一个探测请求，成功则恢复、失败则再次熔断；
+#   可选的主动 TCP 检查定期探测端点；重试时避开上一次失败的端点。
+
+import time
+import socket
+import logging
+import threading
+
+# --- 默认配置 ---
+DEFAULT_BALANCER_CONFIG = {
+    "capacity": 4,                 # 每个端点的在途请求上限 (全部占满时仍选择在途最少的端点)
+    "failure_threshold": 3,        # 连续连接失败次数达到该值时熔断
+    "min_health": 0.3,             # 健康分低于该值 (且样本足够) 时熔断
+    "min_samples": 5,
+    "health_alpha": 0.2,           # 健康分滑动平均系数
+    "open_seconds": 60,            # 熔断持续时间(秒)，之后半开探测
+    "active_check_interval": 0,    # 主动 TCP 检查间隔(秒)，0 表示关闭
+    "active_check_timeout": 2,
+}
+ENDPOINT_KINDS = (("decrypt", "decrypt-m3u8-port"), ("get", "get-m3u8-port"))
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+ENDPOINT_FAILURE_CLASSES = frozenset(("connect", "network", "errors"))  # 可归因于解密器端点的失败类别
+
+
+class DecryptorEndpoint:
+    def __init__(self, kind, address):
+        self.kind = kind
+        self.address = address
+        self.in_flight = 0
+        self.health = 1.0
+        self.samples = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def snapshot(self):
+        return {
+            "address": self.address, "state": self.state, "in_flight": self.in_flight,
+            "health": round(self.health, 3), "successes": self.successes, "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class DecryptorLease:
+    """一次执行尝试占用的端点，结束后交给 DecryptorBalancer.release。"""
+
+    def __init__(self, endpoints):
+        self.endpoints = endpoints  # kind -> DecryptorEndpoint / None (source.yaml 未配置列表时)
+        self.values = {kind: (endpoint.address if endpoint else None) for kind, endpoint in endpoints.items()}
+
+    @property
+    def decrypt_m3u8_port(self):
+        return self.values.get("decrypt")
+
+    @property
+    def get_m3u8_port(self):
+        return self.values.get("get")
+
+    def addresses(self):
+        return {endpoint.address for endpoint in self.endpoints.values() if endpoint is not None}
+
+
+class DecryptorBalancer:
+    def __init__(self, capacity=4, failure_threshold=3, min_health=0.3, min_samples=5, health_alpha=0.2,
+                 open_seconds=60, active_check_interval=0, active_check_timeout=2):
+        self.capacity = max(1, int(capacity))
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.min_health = min_health
+        self.min_samples = min_samples
+        self.health_alpha = health_alpha
+        self.open_seconds = open_seconds
+        self.active_check_timeout = active_check_timeout
+        self.lock = threading.Lock()
+        self.endpoints = {}  # (kind, address) -> DecryptorEndpoint
+        self.rotation = 0    # 同等条件下轮流选择
+        if active_check_interval and active_check_interval > 0:
+            threading.Thread(target=self._active_check_loop, args=(active_check_interval,), name="decryptor-health", daemon=True).start()
+
+    # --- 选择与归还 ---
+    def acquire(self, source_data_dict, avoid=()):
+        """为一次执行尝试选择 decrypt / get 端点。avoid 为上一次失败的端点地址，有其他可用端点时避开。"""
+        now = time.time()
+        chosen = {}
+        with self.lock:
+            self.rotation += 1
+            for kind, key in ENDPOINT_KINDS:
+                value = source_data_dict.get(key, '')
+                if isinstance(value, list) and value:
+                    addresses = [str(address) for address in value]
+                elif isinstance(value, str) and value:
+                    addresses = [value]
+                else:
+                    chosen[kind] = None
+                    continue
+                endpoint = self._select(kind, addresses, set(avoid), now)
+                endpoint.in_flight += 1
+                if endpoint.state == HALF_OPEN:
+                    endpoint.probing = True
+                chosen[kind] = endpoint
+        lease = DecryptorLease(chosen)
+        # 未配置列表时保留 source.yaml 中的原值
+        for kind, key in ENDPOINT_KINDS:
+            if chosen[kind] is None:
+                lease.values[kind] = source_data_dict.get(key, '')
+        return lease
+
+    def _select(self, kind, addresses, avoid, now):
+        """在持有锁时调用。"""
+        candidates = []
+        for address in addresses:
+            endpoint = self.endpoints.get((kind, address))
+            if endpoint is None:
+                endpoint = self.endpoints[(kind, address)] = DecryptorEndpoint(kind, address)
+            if endpoint.state == OPEN and now - endpoint.opened_at >= self.open_seconds:
+                endpoint.state = HALF_OPEN
+                endpoint.probing = False
+                logging.info(f"解密器端点 {address} ({kind}) 熔断到期，进入半开探测。")
+            candidates.append(endpoint)
+        usable = [e for e in candidates if e.state == CLOSED or (e.state == HALF_OPEN and not e.probing)]
+        if not usable:
+            # 全部熔断：选择最早熔断的端点，避免任务直接失败
+            return min(candidates, key=lambda e: e.opened_at)
+        preferred = [e for e in usable if e.address not in avoid] or usable
+        under_capacity = [e for e in preferred if e.in_flight < self.capacity] or preferred
+        offset = self.rotation % len(under_capacity)
+        rotated = under_capacity[offset:] + under_capacity[:offset]
+        return min(rotated, key=lambda e: (e.in_flight, -round(e.health, 1)))
+
+    def release(self, lease, success=None, failure_classes=()):
+        """归还端点并记录结果。success 为 None 时 (未执行到 Go) 只归还不计分。
+        连接解密器失败 (connect) 计为端点的硬失败，network / errors 只降低健康分，其他类别的失败不计分。"""
+        failure_classes = set(failure_classes or ())
+        if not success and not failure_classes & ENDPOINT_FAILURE_CLASSES:
+            success = None
+        now = time.time()
+        with self.lock:
+            for endpoint in lease.endpoints.values():
+                if endpoint is None:
+                    continue
+                endpoint.in_flight = max(0, endpoint.in_flight - 1)
+                was_probe = endpoint.probing
+                endpoint.probing = False
+                if success is None:
+                    continue
+                hard_failure = "connect" in failure_classes
+                endpoint.samples += 1
+                endpoint.health = (1 - self.health_alpha) * endpoint.health + self.health_alpha * (1.0 if success else 0.0)
+                if success:
+                    endpoint.successes += 1
+                    endpoint.consecutive_failures = 0
+                    if endpoint.state != CLOSED:
+                        logging.info(f"解密器端点 {endpoint.address} ({endpoint.kind}) 探测成功，恢复使用。")
+                        endpoint.state = CLOSED
+                    continue
+                endpoint.failures += 1
+                if hard_failure:
+                    endpoint.consecutive_failures += 1
+                if (was_probe and hard_failure) or endpoint.consecutive_failures >= self.failure_threshold or \
+                        (endpoint.samples >= self.min_samples and endpoint.health < self.min_health):
+                    self._open(endpoint, now)
+
+    def _open(self, endpoint, now):
+        if endpoint.state != OPEN:
+            logging.warning(f"解密器端点 {endpoint.address} ({endpoint.kind}) 熔断 {self.open_seconds} 秒 "
+                            f"(连续连接失败 {endpoint.consecutive_failures}，健康分 {endpoint.health:.2f})。")
+        endpoint.state = OPEN
+        endpoint.opened_at = now
+        endpoint.consecutive_failures = 0
+        endpoint.health = max(endpoint.health, self.min_health)  # 恢复后从阈值重新累计，避免立即再次熔断
+
+    # --- 主动检查 ---
+    def _active_check_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                endpoints = list(self.endpoints.values())
+            for endpoint in endpoints:
+                reachable = self._tcp_check(endpoint.address)
+                with self.lock:
+                    if not reachable and endpoint.state != OPEN:
+                        logging.warning(f"解密器端点 {endpoint.address} ({endpoint.kind}) 主动检查不可达。")
+                        self._open(endpoint, time.time())
+                    elif reachable and endpoint.state == OPEN:
+                        endpoint.state = HALF_OPEN
+                        endpoint.probing = False
+
+    def _tcp_check(self, address):
+        host, _, port = address.rpartition(":")
+        try:
+            with socket.create_connection((host or "127.0.0.1", int(port)), timeout=self.active_check_timeout):
+                return True
+        except (OSError, ValueError):
+            return False
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for (kind, _), endpoint in self.endpoints.items():
+                result.setdefault(kind, []).append(endpoint.snapshot())
+            return result
+
+
+def create_decryptor_balancer(config):
+    """根据 config.yaml 中的 decryptor_balancer 配置创建均衡器。"""
+    section = config.get("decryptor_balancer", {}) or {}
+    settings = dict(DEFAULT_BALANCER_CONFIG)
+    settings.update({key: value for key, value in section.items() if key in settings})
+    logging.info(f"解密器端点均衡: {settings}")
+    return DecryptorBalancer(**settings)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# fair_share.py - 按用户公平分配任务槽位与全局音轨工作槽位 (赤字轮转 DRR)
+#
+# users.yaml 中每个用户可选配置:
+#   weight: 2                  # 份额权重 (默认 1)，争用时按权重比例分配
+#   max_concurrent_tasks: 2    # 该用户同时运行的任务数上限 (默认不限)
+#   max_go_processes: 4        # 该用户同时占用的 Go 进程数上限 (默认不限)
+
+import logging
+from collections import deque
+
+DEFAULT_USER_WEIGHT = 1
+MIN_USER_WEIGHT = 0.1
+
+
+def user_weight(users_data, user):
+    """读取 users.yaml 中用户的份额权重，缺省或无效时为 1。"""
+    user_config = users_data.get(user) if isinstance(users_data, dict) else None
+    weight = user_config.get("weight", DEFAULT_USER_WEIGHT) if isinstance(user_config, dict) else DEFAULT_USER_WEIGHT
+    try:
+        return max(MIN_USER_WEIGHT, float(weight))
+    except (TypeError, ValueError):
+        logging.warning(f"用户 {user} 的 weight 配置无效: {weight}，按 {DEFAULT_USER_WEIGHT} 处理。")
+        return DEFAULT_USER_WEIGHT
+
+
+def user_limit(users_data, user, key):
+    """读取 users.yaml 中用户的并发上限 (max_concurrent_tasks / max_go_processes)，未配置时返回 None。"""
+    user_config = users_data.get(user) if isinstance(users_data, dict) else None
+    limit = user_config.get(key) if isinstance(user_config, dict) else None
+    if limit is None:
+        return None
+    try:
+        return max(1, int(limit))
+    except (TypeError, ValueError):
+        logging.warning(f"用户 {user} 的 {key} 配置无效: {limit}，按不限处理。")
+        return None
+
+
+class DeficitRoundRobin:
+    """按用户的赤字轮转：轮到某用户时给其增加 weight 份额度，每分配一个槽位消耗 1，额度用完轮到下一位。
+
+    状态在多次调用之间保留，调用方负责加锁。
+    """
+
+    def __init__(self, weight_of):
+        self.weight_of = weight_of  # weight_of(user) -> 权重
+        self.ring = deque()
+        self.deficits = {}
+
+    def next_user(self, candidates):
+        """从当前有待处理工作 (且未达上限) 的用户中选出下一个应获得槽位的用户，无候选时返回 None。"""
+        for user in list(self.ring):
+            if user not in candidates:
+                # 没有待处理工作的用户退出轮转，额度清零 (DRR 不为空闲用户积攒额度)
+                self.ring.remove(user)
+                self.deficits.pop(user, None)
+        for user in candidates:
+            if user not in self.deficits:
+                self.deficits[user] = 0
+                self.ring.append(user)
+        if not self.ring:
+            return None
+        while True:
+            user = self.ring[0]
+            if self.deficits[user] >= 1:
+                self.deficits[user] -= 1
+                if self.deficits[user] < 1:
+                    self.ring.rotate(-1)  # 本轮额度用完，轮到下一位
+                return user
+            self.deficits[user] += self.weight_of(user)
+            if self.deficits[user] < 1:
+                self.ring.rotate(-1)  # 权重小于 1 的用户需要多轮累积
+
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# go_worker.py - 常驻 Go worker 进程池 (取代每个音轨启动一次 Go 二进制)
+#
+# Go 二进制以 `main --worker` 常驻运行，stdin / stdout 上逐行 JSON 通信 (协议见 go/worker.go):
+#   请求: {"id": 1, "args": ["<url>", "--song"], "config": "<渲染后的 source.yaml>"}
+#   事件: ready / output (原 stdout、stderr 的每一行) / result (exit_code)
+# start() 返回的 GoWorkerRequest 提供与 subprocess.Popen 相近的接口 (stdout / stderr / poll / kill)，
+# 因此 execute_single_track 的输出解析与重试逻辑保持不变。
+# worker 崩溃、处理请求数或常驻内存超过上限时回收；二进制不支持 --worker 时 start() 返回 None，由调用方回退为单次进程。
+# 只有 worker 未就绪即退出并报告未知参数 (旧版二进制) 时才永久停用；其他启动失败 (超时、崩溃) 只暂停 retry_cooldown 秒。
+
+import re
+import json
+import time
+import queue
+import logging
+import itertools
+import threading
+import subprocess
+
+# --- 默认配置 ---
+DEFAULT_GO_WORKER_CONFIG = {
+    "enabled": True,
+    "max_requests": 200,    # 单个 worker 处理的请求数上限，达到后回收
+    "max_rss_mb": 1024,     # 常驻内存上限 (MB)，超过后回收 (仅 Linux 可读取)
+    "startup_timeout": 10,  # 等待 worker 发送 ready 的超时时间(秒)
+    "retry_cooldown": 60,   # worker 启动失败后暂停使用的时间(秒)，期间回退为单次进程
+}
+UNSUPPORTED_OUTPUT_PATTERN = re.compile(r'unknown (flag|shorthand flag)|usage', re.IGNORECASE)  # 旧版二进制不认识 --worker 时的输出
+MAX_STARTUP_OUTPUT_LINES = 20
+
+
+class _LineStream:
+    """按行读取的输出流，readline() 在流关闭后返回空字符串 (与文件对象一致)。"""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def put(self, line):
+        self.lines.put(line)
+
+    def close(self):
+        self.lines.put("")
+
+    def readline(self):
+        return self.lines.get()
+
+
+class GoWorkerRequest:
+    """提交给常驻 worker 的一次执行。"""
+
+    stdin = None  # 配置已随请求发送，调用方无需再写入 stdin
+
+    def __init__(self, pool, worker, request_id):
+        self.pool = pool
+        self.worker = worker
+        self.request_id = request_id
+        self.pid = worker.process.pid
+        self.stdout = _LineStream()
+        self.stderr = _LineStream()
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        """请求尚未完成时终止所在的 worker (随后回收)；已完成时无操作。"""
+        if self.returncode is None:
+            self.pool._discard(self.worker, "请求被调用方终止")
+
+    def _finish(self, returncode):
+        if self.returncode is not None:
+            return
+        self.stdout.close()
+        self.stderr.close()
+        self.returncode = returncode
+
+
+class GoWorker:
+    """一个常驻 Go 进程及其 stdout 事件读取线程。"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = subprocess.Popen(
+            [pool.go_bin_path, "--worker"], cwd=pool.cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace', bufsize=1
+        )
+        self.ready = threading.Event()
+        self.current = None  # 正在执行的 GoWorkerRequest
+        self.requests_served = 0
+        self.alive = True
+        self.started = False      # 已收到 ready 事件
+        self.startup_output = []  # 就绪前的非协议输出，用于判断二进制是否支持 --worker
+        threading.Thread(target=self._read_events, name=f"go-worker-{index}", daemon=True).start()
+        self.stderr_thread = threading.Thread(target=self._read_stderr, name=f"go-worker-{index}-stderr", daemon=True)
+        self.stderr_thread.start()
+
+    def submit(self, request, args, config_text):
+        self.current = request
+        self.process.stdin.write(json.dumps({"id": request.request_id, "args": list(args), "config": config_text}, ensure_ascii=False) + "\n")
+        self.process.stdin.flush()
+
+    def rss_mb(self):
+        """读取 worker 的常驻内存 (MB)，非 Linux 或读取失败时返回 None。"""
+        try:
+            with open(f"/proc/{self.process.pid}/status", encoding="ascii", errors="replace") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError, IndexError):
+            return None
+        return None
+
+    def terminate(self):
+        self.alive = False
+        try:
+            self.process.kill()
+        except Exception:
+            pass
+
+    def _read_events(self):
+        for raw in iter(self.process.stdout.readline, ''):
+            try:
+                event = json.loads(raw)
+            except ValueError:
+                logging.debug(f"Go worker {self.index}: 忽略非协议输出: {raw.rstrip()}")
+                if not self.started and len(self.startup_output) < MAX_STARTUP_OUTPUT_LINES:
+                    self.startup_output.append(raw)
+                continue
+            kind = event.get("event")
+            if kind == "ready":
+                self.started = True
+                self.ready.set()
+            elif kind == "output":
+                request = self.current
+                if request is not None and event.get("id") == request.request_id:
+                    (request.stderr if event.get("stream") == "stderr" else request.stdout).put(event.get("line", ""))
+            elif kind == "result":
+                request = self.current
+                if request is not None and event.get("id") == request.request_id:
+                    self.current = None
+                    self.requests_served += 1
+                    self.pool._release(self)  # 先归还，使下一个音轨能立即复用该 worker
+                    request._finish(int(event.get("exit_code", 0)))
+        # stdout 关闭：进程已退出 (崩溃或被终止)
+        self.alive = False
+        self.ready.set()  # 未就绪即退出时不必等到启动超时
+        return_code = self.process.wait()
+        request, self.current = self.current, None
+        if request is not None:
+            request.stderr.put(f"Go worker 进程意外退出 (返回码 {return_code})\n")
+            request._finish(return_code if return_code else -1)
+        self.pool._on_exit(self, return_code)
+
+    def _read_stderr(self):
+        # 正常情况下 worker 自身的 stderr 已转为 output 事件，这里只会收到 Go 运行时的崩溃信息
+        for line in iter(self.process.stderr.readline, ''):
+            request = self.current
+            if request is not None:
+                request.stderr.put(line)
+            else:
+                if not self.started and len(self.startup_output) < MAX_STARTUP_OUTPUT_LINES:
+                    self.startup_output.append(line)
+                logging.warning(f"Go worker {self.index}: {line.rstrip()}")
+
+
+class GoWorkerPool:
+    """最多 max_workers 个常驻 Go worker，按需启动，空闲时复用。"""
+
+    def __init__(self, go_bin_path, cwd, max_workers, max_requests=200, max_rss_mb=1024, startup_timeout=10, retry_cooldown=60):
+        self.go_bin_path = go_bin_path
+        self.cwd = cwd
+        self.max_workers = max(1, int(max_workers))
+        self.max_requests = max_requests
+        self.max_rss_mb = max_rss_mb
+        self.startup_timeout = startup_timeout
+        self.retry_cooldown = retry_cooldown
+        self.lock = threading.Lock()
+        self.idle = []
+        self.workers = set()
+        self.unsupported = False
+        self.disabled_until = 0.0  # 启动失败后的暂停截止时间 (monotonic)
+        self.worker_ids = itertools.count(1)
+        self.request_ids = itertools.count(1)
+        self.stats = {"requests": 0, "spawned": 0, "recycled": 0, "crashed": 0, "fallbacks": 0, "startup_failures": 0}
+        logging.info(f"常驻 Go worker 池已启用: 最多 {self.max_workers} 个 worker，每个最多处理 {max_requests} 个请求，内存上限 {max_rss_mb} MB")
+
+    def start(self, args, config_text):
+        """在空闲 worker 上提交一次执行 (args 为 Go 二进制的命令行参数)，返回 GoWorkerRequest；
+        worker 模式不可用或 worker 已满时返回 None。"""
+        if self.unsupported or time.monotonic() < self.disabled_until:
+            return None
+        worker = self._acquire()
+        if worker is None:
+            with self.lock:
+                self.stats["fallbacks"] += 1
+            return None
+        request = GoWorkerRequest(self, worker, next(self.request_ids))
+        try:
+            worker.submit(request, args, config_text)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Go worker {worker.index}: 提交请求失败 ({e})，回收该 worker。")
+            self._discard(worker, "提交请求失败")
+            with self.lock:
+                self.stats["fallbacks"] += 1
+            return None
+        with self.lock:
+            self.stats["requests"] += 1
+        return request
+
+    def _acquire(self):
+        with self.lock:
+            while self.idle:
+                worker = self.idle.pop()
+                if worker.alive:
+                    return worker
+            if len(self.workers) >= self.max_workers:
+                return None
+            index = next(self.worker_ids)
+            try:
+                worker = GoWorker(self, index)
+            except OSError as e:
+                logging.error(f"启动 Go worker 失败: {e}")
+                return None
+            self.workers.add(worker)
+            self.stats["spawned"] += 1
+        if worker.ready.wait(self.startup_timeout) and worker.alive:
+            logging.info(f"Go worker {index} 已就绪 (PID {worker.process.pid})")
+            return worker
+        self._on_startup_failure(worker)
+        return None
+
+    def _on_startup_failure(self, worker):
+        """worker 未就绪：旧版二进制 (未就绪即退出并报告未知参数) 永久停用 worker 模式，其他情况暂停 retry_cooldown 秒后再试。"""
+        return_code = None
+        if not worker.alive:
+            try:
+                return_code = worker.process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                pass
+            worker.stderr_thread.join(timeout=1)  # 读完退出前的 stderr
+        output = "".join(worker.startup_output)
+        self._discard(worker, "未就绪")
+        with self.lock:
+            self.stats["startup_failures"] += 1
+            if return_code and UNSUPPORTED_OUTPUT_PATTERN.search(output):
+                self.unsupported = True
+            else:
+                self.disabled_until = time.monotonic() + self.retry_cooldown
+        if self.unsupported:
+            logging.warning(f"Go 二进制 {self.go_bin_path} 不支持 --worker 模式 (返回码 {return_code})，后续回退为每个音轨启动一次进程。")
+        elif return_code is None:
+            logging.warning(f"Go worker {worker.index} 未在 {self.startup_timeout} 秒内就绪，{self.retry_cooldown} 秒内回退为每个音轨启动一次进程。")
+        else:
+            logging.warning(f"Go worker {worker.index} 启动时退出 (返回码 {return_code})，{self.retry_cooldown} 秒内回退为每个音轨启动一次进程。")
+
+    def _release(self, worker):
+        """请求完成后归还 worker，超过请求数或内存上限时回收。"""
+        reason = None
+        if self.max_requests and worker.requests_served >= self.max_requests:
+            reason = f"已处理 {worker.requests_served} 个请求"
+        else:
+            rss = worker.rss_mb()
+            if self.max_rss_mb and rss is not None and rss > self.max_rss_mb:
+                reason = f"常驻内存 {rss:.0f} MB 超过上限"
+        if reason:
+            logging.info(f"回收 Go worker {worker.index}: {reason}")
+            with self.lock:
+                self.stats["recycled"] += 1
+            self._discard(worker, reason)
+            return
+        with self.lock:
+            if worker.alive and worker in self.workers:
+                self.idle.append(worker)
+
+    def _discard(self, worker, reason):
+        with self.lock:
+            self.workers.discard(worker)
+            if worker in self.idle:
+                self.idle.remove(worker)
+        logging.debug(f"终止 Go worker {worker.index}: {reason}")
+        worker.terminate()
+        try:
+            worker.process.stdin.close()
+        except Exception:
+            pass
+
+    def _on_exit(self, worker, return_code):
+        with self.lock:
+            crashed = worker in self.workers
+            self.workers.discard(worker)
+            if worker in self.idle:
+                self.idle.remove(worker)
+            if crashed:
+                self.stats["crashed"] += 1
+        if crashed:
+            logging.warning(f"Go worker {worker.index} (PID {worker.process.pid}) 意外退出，返回码 {return_code}，将按需重新启动。")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "enabled": not self.unsupported,
+                "paused_for": max(0, round(self.disabled_until - time.monotonic())),
+                "max_workers": self.max_workers,
+                "workers": len(self.workers),
+                "idle": len(self.idle),
+                **self.stats,
+            }
+
+
+def create_go_worker_pool(config, go_bin_path, cwd, max_workers):
+    """根据 config.yaml 中的 go_workers 配置创建 worker 池，未启用时返回 None。"""
+    section = config.get("go_workers", {}) or {}
+    settings = dict(DEFAULT_GO_WORKER_CONFIG)
+    settings.update({key: value for key, value in section.items() if key in settings})
+    if not settings["enabled"]:
+        logging.info("常驻 Go worker 未启用，每个音轨启动一次 Go 进程。")
+        return None
+    return GoWorkerPool(
+        go_bin_path, cwd, max_workers,
+        max_requests=settings["max_requests"], max_rss_mb=settings["max_rss_mb"], startup_timeout=settings["startup_timeout"],
+        retry_cooldown=settings["retry_cooldown"]
+    )
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# history_store.py - 已完成 / 失败任务的历史存储 (SQLite，替代整文件重写的 info/errors.json)
+#
+# 只追加：每个任务按 uuid 归档一次；按用户、状态、完成时间建索引；
+# 任务数据与 error_log (Go 的完整输出) 分别以 zlib 压缩存放，列表查询不读取日志。
+
+import os
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+
+from utils import PROJECT_ROOT, json_dumps_bytes, json_loads, read_json_with_lock, get_task_display_info, durability_mode
+from task_store import SQLITE_SYNCHRONOUS_BY_DURABILITY, rollback_open_transaction
+
+# --- 默认配置 ---
+DEFAULT_HISTORY_DB_PATH = "info/task_history.db"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+HISTORY_STATUSES = ("finish", "error")
+
+
+def _compress(data):
+    return zlib.compress(data, 6)
+
+
+def _decompress_json(blob):
+    return json_loads(zlib.decompress(blob))
+
+
+def _iso_to_epoch(value):
+    """ISO 时间 (或日期) 字符串转为时间戳，无时区时按本地时间处理；无法解析时返回 None。"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except (ValueError, TypeError):
+        return None
+
+
+class TaskHistoryStore:
+    """任务历史存储 (SQLite WAL)。main.py 在任务退役时归档，backend.py 提供分页查询。"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS history ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " uuid TEXT NOT NULL UNIQUE,"
+        " user TEXT,"
+        " status TEXT,"
+        " type TEXT,"
+        " name TEXT,"
+        " link TEXT,"
+        " error_reason TEXT,"
+        " track_count INTEGER NOT NULL DEFAULT 0,"
+        " submit_time TEXT,"
+        " process_start_time TEXT,"
+        " process_complete_time TEXT,"
+        " finished_at REAL NOT NULL,"
+        " archived_at REAL NOT NULL,"
+        " notified INTEGER NOT NULL DEFAULT 0,"
+        " task BLOB NOT NULL,"
+        " error_log BLOB)",
+        "CREATE INDEX IF NOT EXISTS idx_history_user ON history(user, finished_at)",
+        "CREATE INDEX IF NOT EXISTS idx_history_status ON history(status, finished_at)",
+        "CREATE INDEX IF NOT EXISTS idx_history_finished ON history(finished_at)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+    )
+    POST_UPGRADE_SCHEMA = (
+        "CREATE INDEX IF NOT EXISTS idx_history_pending ON history(notified) WHERE notified = 0",
+    )
+    SUMMARY_COLUMNS = (
+        "uuid", "user", "status", "type", "name", "link", "error_reason", "track_count",
+        "submit_time", "process_start_time", "process_complete_time", "finished_at", "archived_at",
+    )
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        self._upgrade_schema(conn)
+        for statement in self.POST_UPGRADE_SCHEMA:
+            conn.execute(statement)
+        logging.info(f"任务历史存储已就绪: {db_path}")
+
+    def _upgrade_schema(self, conn):
+        """旧库缺少 notified 列时补齐，已有记录视为已通知。"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+        if "notified" not in columns:
+            conn.execute("ALTER TABLE history ADD COLUMN notified INTEGER NOT NULL DEFAULT 1")
+            logging.info("任务历史存储: 已补充邮件通知标记列。")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS_BY_DURABILITY[durability_mode()]}")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    # --- 写入 ---
+    def _row(self, task, archived_at, notified):
+        task = dict(task)
+        error_log = task.pop("error_log", None)
+        name, _, type_key = get_task_display_info(task)
+        tracks = (task.get("metadata") or {}).get("tracks") if isinstance(task.get("metadata"), dict) else None
+        finished_at = _iso_to_epoch(task.get("process_complete_time")) or archived_at
+        return (
+            task.get("uuid"), task.get("user"), task.get("status"), type_key, name, task.get("link"),
+            task.get("error_reason"), len(tracks) if isinstance(tracks, list) else 0,
+            task.get("submit_time"), task.get("process_start_time"), task.get("process_complete_time"),
+            finished_at, archived_at, 1 if notified else 0,
+            _compress(json_dumps_bytes(task, pretty=False)),
+            _compress(str(error_log).encode("utf-8")) if error_log else None,
+        )
+
+    def archive(self, tasks, notified=False):
+        """归档任务 (已归档的 uuid 会被跳过)，返回新写入的数量，失败返回 -1。
+        notified=False 的记录会在队列空闲时进入邮件汇总。"""
+        tasks = [t for t in tasks if isinstance(t, dict) and t.get("uuid")]
+        if not tasks:
+            return 0
+        now = time.time()
+        rows = [self._row(task, now, notified) for task in tasks]
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany(
+                    f"INSERT OR IGNORE INTO history ({', '.join(self.SUMMARY_COLUMNS)}, notified, task, error_log)"
+                    f" VALUES ({', '.join('?' * (len(self.SUMMARY_COLUMNS) + 3))})",
+                    rows
+                )
+                added = conn.total_changes - before
+                conn.execute("COMMIT")
+            except Exception:
+                rollback_open_transaction(conn)
+                raise
+        except sqlite3.Error as e:
+            logging.error(f"归档任务到历史存储失败: {e}", exc_info=True)
+            return -1
+        return added
+
+    def import_json_archive(self, errors_path, errors_lock):
+        """首次启动时导入旧的 errors.json 归档 (只执行一次，原文件保留)。"""
+        conn = self._conn()
+        if conn.execute("SELECT value FROM meta WHERE key = 'errors_json_imported'").fetchone():
+            return 0
+        if not errors_path or not os.path.exists(errors_path):
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('errors_json_imported', ?)", (str(time.time()),))
+            return 0
+        archived = read_json_with_lock(errors_path, errors_lock, default=[])
+        if not isinstance(archived, list):
+            logging.error(f"错误归档文件 {errors_path} 无法读取或不是列表，暂不导入历史存储。")
+            return -1
+        added = self.archive(archived, notified=True)  # 旧归档不再发送邮件
+        if added < 0:
+            return -1
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('errors_json_imported', ?)", (str(time.time()),))
+        logging.info(f"已将 {errors_path} 中的 {added} 个任务导入历史存储 (原文件保留，不再写入)。")
+        return added
+
+    def remove(self, uuids):
+        """删除归档记录 (任务被重新放回队列时)，返回删除数量。"""
+        uuids = [u for u in uuids if u]
+        if not uuids:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = sum(conn.execute("DELETE FROM history WHERE uuid = ?", (u,)).rowcount for u in uuids)
+            conn.execute("COMMIT")
+        except Exception:
+            rollback_open_transaction(conn)
+            raise
+        return removed
+
+    # --- 邮件汇总 ---
+    def pending_notifications(self):
+        """返回尚未进入邮件汇总的任务 (不含 error_log)，按完成时间排序。"""
+        rows = self._conn().execute("SELECT task FROM history WHERE notified = 0 ORDER BY finished_at, id").fetchall()
+        return [_decompress_json(row[0]) for row in rows]
+
+    def mark_notified(self, uuids):
+        uuids = [u for u in uuids if u]
+        if not uuids:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changed = sum(conn.execute("UPDATE history SET notified = 1 WHERE uuid = ?", (u,)).rowcount for u in uuids)
+            conn.execute("COMMIT")
+        except Exception:
+            rollback_open_transaction(conn)
+            raise
+        return changed
+
+    # --- 查询 ---
+    def query(self, user=None, status=None, since=None, until=None, limit=DEFAULT_PAGE_SIZE, offset=0):
+        """按条件分页查询摘要 (按完成时间倒序)。since / until 为 ISO 时间或日期。返回 (摘要列表, 总数)。"""
+        conditions, params = [], []
+        if user:
+            conditions.append("user = ?"); params.append(user)
+        if status:
+            conditions.append("status = ?"); params.append(status)
+        since_ts, until_ts = _iso_to_epoch(since), _iso_to_epoch(until)
+        if since_ts is not None:
+            conditions.append("finished_at >= ?"); params.append(since_ts)
+        if until_ts is not None:
+            conditions.append("finished_at < ?"); params.append(until_ts)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        offset = max(0, int(offset))
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM history{where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT {', '.join(self.SUMMARY_COLUMNS)} FROM history{where} ORDER BY finished_at DESC, id DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return [dict(zip(self.SUMMARY_COLUMNS, row)) for row in rows], total
+
+    def get(self, uuid, include_log=True):
+        """返回完整的归档任务 (含解压后的 error_log)，不存在时返回 None。"""
+        row = self._conn().execute("SELECT task, error_log FROM history WHERE uuid = ?", (uuid,)).fetchone()
+        if row is None:
+            return None
+        task = _decompress_json(row[0])
+        if include_log and row[1] is not None:
+            task["error_log"] = zlib.decompress(row[1]).decode("utf-8", errors="replace")
+        return task
+
+
+def create_history_store(config):
+    """根据 config.yaml 中的 history_store 配置创建历史存储。"""
+    history_config = config.get("history_store", {}) or {}
+    db_path = history_config.get("path", DEFAULT_HISTORY_DB_PATH)
+    if not os.path.isabs(db_path):
+        db_path = os.path.normpath(os.path.join(PROJECT_ROOT, db_path))
+    return TaskHistoryStore(db_path)
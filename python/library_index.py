@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# library_index.py - 本地音乐库索引: song_id / album_id -> 文件路径与音质 (SQLite)
+#
+# 索引来源:
+#   1. Go 在算出音轨路径后输出 TRACK_FILE:{"song_id", "album_id", "path", "codec", "quality"}，
+#      音轨成功 (下载完成或已存在) 后由 execute_single_track 调用 record() 写入；
+#   2. 按 source.yaml 的 alac-save-folder / atmos-save-folder 增量扫描 (scan)：只有 mtime 变化的目录才与索引对账，
+#      移除已删除的文件；song-file-format 含 {SongId} 时可直接从文件名识别新文件。
+# execute_task 派发前用 find_tracks() 查询，文件仍存在的音轨直接标记为 exists，不再启动 Go。
+# 注意: 查询不比较音质，格式中含 {Quality} 且音质变化时 Go 会重新下载，而索引仍视为已存在。
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+from utils import PROJECT_ROOT, durability_mode
+from task_store import SQLITE_SYNCHRONOUS_BY_DURABILITY
+
+# --- 默认配置 ---
+DEFAULT_LIBRARY_INDEX_CONFIG = {
+    "enabled": True,
+    "path": "info/library_index.db",
+    "scan_interval": 3600,  # 增量扫描间隔(秒)，0 表示只在启动时扫描一次
+}
+TRACK_FILE_EXTENSIONS = (".m4a",)
+FORBIDDEN_NAME_CHARS = re.compile(r'[/\\<>:"|?*]')  # 与 Go 的 forbiddenNames 一致
+FORMAT_PLACEHOLDER = re.compile(r'\{(\w+)\}')
+SQLITE_MAX_VARIABLES = 500
+
+
+def _format_to_regex(name_format, captures):
+    """把 song-file-format / album-folder-format 转为匹配文件 (夹) 名的正则；captures 为 {占位符: 分组名}，
+    格式中不含任何 captures 占位符时返回 None。"""
+    if not name_format or not any(f"{{{key}}}" in name_format for key in captures):
+        return None
+    parts, position, used = [], 0, set()
+    for match in FORMAT_PLACEHOLDER.finditer(name_format):
+        parts.append(re.escape(FORBIDDEN_NAME_CHARS.sub("_", name_format[position:match.start()])))
+        group = captures.get(match.group(1))
+        if group and group not in used:
+            parts.append(f"(?P<{group}>[\\w.-]+?)")
+            used.add(group)
+        else:
+            parts.append(".*?")
+        position = match.end()
+    parts.append(re.escape(FORBIDDEN_NAME_CHARS.sub("_", name_format[position:])))
+    return re.compile("".join(parts))
+
+
+class LibraryIndex:
+    """本地音乐库索引 (SQLite WAL，线程安全)。layout_provider() 返回当前 source.yaml 字典，用于确定扫描目录与命名格式。"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tracks ("
+        " path TEXT PRIMARY KEY,"
+        " dir TEXT NOT NULL,"
+        " song_id TEXT,"
+        " album_id TEXT,"
+        " codec TEXT,"
+        " quality TEXT,"
+        " size INTEGER,"
+        " mtime REAL,"
+        " indexed_at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_tracks_song ON tracks(song_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tracks_album ON tracks(album_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tracks_dir ON tracks(dir)",
+        "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER NOT NULL)",
+    )
+    COLUMNS = ("path", "song_id", "album_id", "codec", "quality", "size", "mtime")
+
+    def __init__(self, db_path, layout_provider=None):
+        self.db_path = db_path
+        self.layout_provider = layout_provider
+        self._local = threading.local()
+        self.scan_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "recorded": 0, "scans": 0}
+        self.last_scan = None
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        logging.info(f"本地音乐库索引已就绪: {db_path}")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS_BY_DURABILITY[durability_mode()]}")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    # --- 写入 ---
+    def record(self, entry):
+        """记录 Go 报告的音轨文件 (TRACK_FILE)，文件不存在时忽略。返回是否写入。"""
+        path = entry.get("path")
+        if not path or not entry.get("song_id"):
+            return False
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        self._conn().execute(
+            "INSERT OR REPLACE INTO tracks (path, dir, song_id, album_id, codec, quality, size, mtime, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, os.path.dirname(path), str(entry["song_id"]), entry.get("album_id") or None, entry.get("codec") or None,
+             entry.get("quality") or None, stat.st_size, stat.st_mtime, time.time()))
+        self._count("recorded")
+        return True
+
+    # --- 查询 ---
+    def find_tracks(self, song_ids, root, exclude_roots=()):
+        """返回 {song_id: 条目} ：位于 root 下 (且不在 exclude_roots 下) 且文件仍存在的音轨。已删除的文件会从索引移除。"""
+        song_ids = [str(s) for s in dict.fromkeys(song_ids) if s]
+        if not song_ids or not root:
+            return {}
+        root = os.path.join(os.path.abspath(root), "")
+        excluded = [os.path.join(os.path.abspath(r), "") for r in exclude_roots if r]
+        conn = self._conn()
+        rows = []
+        for start in range(0, len(song_ids), SQLITE_MAX_VARIABLES):
+            chunk = song_ids[start:start + SQLITE_MAX_VARIABLES]
+            rows.extend(conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM tracks WHERE song_id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        found, stale = {}, []
+        for row in rows:
+            entry = dict(zip(self.COLUMNS, row))
+            path = entry["path"]
+            if not path.startswith(root) or any(path.startswith(r) for r in excluded) or entry["song_id"] in found:
+                continue
+            if not os.path.isfile(path):
+                stale.append(path)
+                continue
+            found[entry["song_id"]] = entry
+        if stale:
+            conn.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in stale])
+            self._count("stale", len(stale))
+        self._count("hits", len(found))
+        self._count("misses", len(song_ids) - len(found))
+        return found
+
+    def album_tracks(self, album_id):
+        """返回索引中属于该专辑的全部音轨条目。"""
+        rows = self._conn().execute(f"SELECT {', '.join(self.COLUMNS)} FROM tracks WHERE album_id = ?", (str(album_id),)).fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    # --- 增量扫描 ---
+    def _layout(self):
+        """从 source.yaml 取得扫描根目录 ({user} 之前的公共目录) 与命名格式。"""
+        source = self.layout_provider() if self.layout_provider else None
+        if not isinstance(source, dict):
+            return [], None, None
+        roots = []
+        for key in ("alac-save-folder", "atmos-save-folder"):
+            folder = source.get(key)
+            if folder and isinstance(folder, str):
+                roots.append(os.path.abspath(folder.split("{user}")[0] or "."))
+        # 嵌套的根目录只扫描外层
+        roots = sorted(set(roots))
+        roots = [r for r in roots if not any(r != other and r.startswith(os.path.join(other, "")) for other in roots)]
+        song_regex = _format_to_regex(source.get("song-file-format"), {"SongId": "song_id"})
+        album_regex = _format_to_regex(source.get("album-folder-format"), {"AlbumId": "album_id"})
+        return roots, song_regex, album_regex
+
+    def scan(self):
+        """增量扫描保存目录：mtime 变化的目录与索引对账 (移除已删除文件、按文件名识别新文件)，已消失的目录整体移除。"""
+        if not self.scan_lock.acquire(blocking=False):
+            return None  # 已有扫描在进行
+        try:
+            started = time.monotonic()
+            roots, song_regex, album_regex = self._layout()
+            conn = self._conn()
+            known_dirs = dict(conn.execute("SELECT path, mtime FROM dirs").fetchall())
+            seen, changed, added, removed = set(), 0, 0, 0
+            stack = [r for r in roots if os.path.isdir(r)]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                    entries = list(os.scandir(directory))
+                except OSError:
+                    continue
+                seen.add(directory)
+                stack.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+                if known_dirs.get(directory) == mtime:
+                    continue
+                changed += 1
+                files = {e.path: e for e in entries if e.is_file(follow_symlinks=False) and e.name.lower().endswith(TRACK_FILE_EXTENSIONS)}
+                dir_added, dir_removed = self._reconcile_dir(conn, directory, files, song_regex, album_regex)
+                added += dir_added
+                removed += dir_removed
+                conn.execute("INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)", (directory, mtime))
+            vanished = [d for d in known_dirs if d not in seen and any(d == r or d.startswith(os.path.join(r, "")) for r in roots)]
+            for directory in vanished:
+                removed += conn.execute("DELETE FROM tracks WHERE dir = ?", (directory,)).rowcount
+                conn.execute("DELETE FROM dirs WHERE path = ?", (directory,))
+            self.last_scan = {
+                "time": time.time(), "duration_seconds": round(time.monotonic() - started, 3), "roots": roots,
+                "dirs": len(seen), "changed_dirs": changed, "vanished_dirs": len(vanished), "added": added, "removed": removed,
+            }
+            self._count("scans")
+            if changed or vanished:
+                logging.info(f"本地音乐库增量扫描: {self.last_scan}")
+            return self.last_scan
+        finally:
+            self.scan_lock.release()
+
+    def _reconcile_dir(self, conn, directory, files, song_regex, album_regex):
+        indexed = {row[0] for row in conn.execute("SELECT path FROM tracks WHERE dir = ?", (directory,))}
+        missing = [p for p in indexed if p not in files]
+        if missing:
+            conn.executemany("DELETE FROM tracks WHERE path = ?", [(p,) for p in missing])
+        added = 0
+        if song_regex is None:
+            return added, len(missing)
+        album_match = album_regex.fullmatch(os.path.basename(directory)) if album_regex else None
+        album_id = album_match.group("album_id") if album_match else None
+        now = time.time()
+        for path, entry in files.items():
+            if path in indexed:
+                continue
+            match = song_regex.fullmatch(os.path.splitext(entry.name)[0])
+            if not match:
+                continue
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            conn.execute(
+                "INSERT OR IGNORE INTO tracks (path, dir, song_id, album_id, codec, quality, size, mtime, indexed_at) "
+                "VALUES (?, ?, ?, ?, NULL, NULL, ?, ?, ?)",
+                (path, directory, match.group("song_id"), album_id, stat.st_size, stat.st_mtime, now))
+            added += 1
+        return added, len(missing)
+
+    def start_background_scan(self, interval):
+        """启动后台扫描线程：立即扫描一次，之后每 interval 秒扫描 (interval <= 0 时只扫描一次)。"""
+        def loop():
+            while True:
+                try:
+                    self.scan()
+                except Exception as e:
+                    logging.error(f"本地音乐库扫描失败: {e}", exc_info=True)
+                if not interval or interval <= 0:
+                    return
+                time.sleep(interval)
+        threading.Thread(target=loop, name="音乐库扫描", daemon=True).start()
+
+    def get_stats(self):
+        conn = self._conn()
+        tracks, albums = conn.execute("SELECT COUNT(*), COUNT(DISTINCT album_id) FROM tracks").fetchone()
+        dirs = conn.execute("SELECT COUNT(*) FROM dirs").fetchone()[0]
+        with self.stats_lock:
+            stats = dict(self.stats)
+        return {**stats, "tracks": tracks, "albums": albums, "dirs": dirs, "last_scan": self.last_scan}
+
+
+def create_library_index(config, layout_provider):
+    """根据 config.yaml 中的 library_index 配置创建索引并启动后台扫描，未启用时返回 None。"""
+    section = config.get("library_index", {}) or {}
+    settings = dict(DEFAULT_LIBRARY_INDEX_CONFIG)
+    settings.update({key: value for key, value in section.items() if key in settings})
+    if not settings["enabled"]:
+        logging.info("本地音乐库索引未启用，已存在的音轨由 Go 逐个检查。")
+        return None
+    db_path = settings["path"]
+    if not os.path.isabs(db_path):
+        db_path = os.path.normpath(os.path.join(PROJECT_ROOT, db_path))
+    index = LibraryIndex(db_path, layout_provider)
+    index.start_background_scan(settings["scan_interval"])
+    return index
@@ -13,8 +13,8 @@ import filelock
 from filelock import Timeout # <-- 添加 Timeout 导入
 import sys
 import socket
-import select
-import concurrent.futures
+from collections import deque
+import heapq
 # import random # 移除未使用的导入
 from datetime import datetime, timezone
 from flask import Flask, Response, request, jsonify
@@ -33,11 +33,31 @@ from notifications import (
 from utils import (
     PROJECT_ROOT, DEFAULT_PATHS_RELATIVE_TO_ROOT, # 路径常量
     read_json_with_lock, write_json_with_lock,   # JSON 读写
+    json_dumps, configure_json_codec,             # JSON 编解码
+    configure_durability,                         # 写入持久化策略
+    get_lock_stats, get_io_stats,                 # 文件锁 / I/O 统计
+    IO_STATS, io_call_site,                       # I/O 调用点统计
     read_yaml_with_lock,                          # YAML 读写
     resolve_paths,                                # 路径解析
     get_task_display_info,                       # 任务助手
+    TASK_PRIORITIES, DEFAULT_TASK_PRIORITY,      # 任务优先级
+    Histogram,                                    # 统计直方图
+    build_global_track_map, TaskQueueIndex,      # 任务索引
+    is_track_done,                                # 音轨完成检查点
     setup_logging # Import setup_logging from utils
 )
+# --- 导入任务存储 --- #
+from task_store import create_task_store, failed_result
+from change_feed import ChangeFeedPublisher, resolve_socket_path
+from history_store import create_history_store
+from fair_share import DeficitRoundRobin, user_weight, user_limit
+from track_pool import TrackWorkPool
+from adaptive_concurrency import create_adaptive_controller
+from decryptor_balancer import DecryptorBalancer, create_decryptor_balancer
+from go_worker import GoWorkerRequest, create_go_worker_pool
+from source_config import ApiTokenClient, SourceConfigRenderer
+from retry_policy import create_retry_policy
+from library_index import create_library_index
 
 # --- 创建Flask应用，用于SSE服务 --- #
 app = Flask(__name__)
@@ -96,10 +116,10 @@ def stream_progress(uuid):
             with task_progress_lock:
                 if task_uuid in task_progress:
                     for song_id, progress_data in task_progress[task_uuid].items():
-                        progress_json = json.dumps({
+                        progress_json = json_dumps({
                             "song_id": song_id,
                             "progress": progress_data
-                        })
+                        }, pretty=False)
                         yield f"data: {progress_json}\n\n"
             
             # 发送一个初始连接成功事件
@@ -230,13 +250,97 @@ def sse_status():
     
     return jsonify(status_info)
 
+@app.route('/api/progress/stats', methods=['GET'])
+def progress_persist_stats():
+    """获取下载进度合并写入与任务队列批量写入的统计"""
+    writer_stats = task_writer.get_stats() if task_writer is not None else None
+    if progress_coalescer is None:
+        return jsonify({"enabled": False, "writer": writer_stats})
+    return jsonify(dict(progress_coalescer.get_stats(), enabled=True, writer=writer_stats))
+
+@app.route('/api/locks/stats', methods=['GET'])
+def lock_stats():
+    """获取本进程文件锁 (共享读 / 排他写) 的等待与持有时间统计"""
+    return jsonify(get_lock_stats())
+
+@app.route('/api/io/stats', methods=['GET'])
+def io_stats():
+    """获取按调用点统计的 I/O 直方图 (锁等待/持有、解析/序列化耗时、写入字节数、超时次数)，附带当前并发配置"""
+    with running_set_lock:
+        running_tasks = len(running_task_uuids)
+        running_by_user = {}
+        for task_user in running_task_users.values():
+            running_by_user[task_user] = running_by_user.get(task_user, 0) + 1
+    pool = track_pool.snapshot() if track_pool is not None else None
+    return jsonify({
+        "sites": get_io_stats(),
+        "locks": get_lock_stats(),
+        "writer": task_writer.get_stats() if task_writer is not None else None,
+        "concurrency": {
+            "max_parallel": config_data.get('MAX_PARALLEL', DEFAULT_MAX_PARALLEL),
+            "max_global_go_processes": max_global_go_processes,
+            "running_tasks": running_tasks,
+            "running_go_processes": pool["busy"] if pool else 0,
+            "running_tasks_by_user": running_by_user,
+            "go_processes_by_user": pool["busy_by_user"] if pool else {},
+            "queued_tracks_by_user": pool["queued_by_user"] if pool else {},
+        },
+        "track_pool": pool,
+        "go_workers": go_worker_pool.snapshot() if go_worker_pool is not None else None,
+        "token_client": token_client.get_stats(),
+        "source_render": source_renderer.get_stats() if source_renderer is not None else None,
+    })
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """获取按调度类别 (interactive / batch) 统计的排队等待时间 (秒) 与当前运行情况"""
+    with running_set_lock:
+        lanes = {}
+        for lane in running_task_lanes.values():
+            lanes[lane] = lanes.get(lane, 0) + 1
+    return jsonify({
+        "policy": scheduling_config,
+        "queue_wait_seconds": queue_wait_stats.snapshot(),
+        "running_by_lane": lanes,
+    })
+
+@app.route('/api/concurrency/stats', methods=['GET'])
+def concurrency_stats():
+    """获取 Go 并发上限、工作池占用情况与自适应控制的最近决策"""
+    return jsonify({
+        "adaptive": adaptive_controller.snapshot() if adaptive_controller is not None else {"enabled": False},
+        "track_pool": track_pool.snapshot() if track_pool is not None else None,
+        "decryptors": decryptor_balancer.snapshot(),
+    })
+
+@app.route('/api/library/stats', methods=['GET'])
+def library_stats():
+    """获取本地音乐库索引的条目数、命中统计与最近一次增量扫描结果"""
+    if library_index is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(library_index.get_stats(), enabled=True))
+
+@app.route('/api/retry/stats', methods=['GET'])
+def retry_stats():
+    """获取按失败类别的重试策略与计数 (失败 / 重试 / 放弃 / 重试后成功)"""
+    if retry_policy is None:
+        return jsonify({"enabled": False})
+    return jsonify(retry_policy.snapshot())
+
+@app.route('/api/retirement/stats', methods=['GET'])
+def retirement_stats():
+    """获取已完成任务退役 (归档并移出队列) 的统计"""
+    if task_retirer is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(task_retirer.get_stats(), enabled=True))
+
 # --- 新增：发送通知消息到所有通知客户端 --- #
 def send_notice_to_clients(notice_data):
     """向所有连接的通知客户端发送通知消息"""
     if not notice_data:
         return
     
-    message = json.dumps(notice_data)
+    message = json_dumps(notice_data, pretty=False)
     sent_count = 0
     failed_count = 0
     
@@ -312,12 +416,15 @@ LYRICS_FAILURE_PATTERN = re.compile(r'^\s*Failed to get lyrics\s*$', re.IGNORECA
 AUDIO_QUALITY_PATTERN = re.compile(r'^\s*(\d+)-bit / (\d+)\s+Hz\s*$', re.IGNORECASE)
 TRACK_EXISTS_PATTERN = re.compile(r'^\s*Track already exists locally\.\s*$', re.IGNORECASE)
 GO_CONNECT_ERROR_PATTERN = re.compile(r'^\s*Error connecting to device:', re.IGNORECASE)
+GO_NOT_FOUND_PATTERN = re.compile(r'^\s*(404 Not Found|Invalid URL:)')  # 资源不存在或链接无效，重试无意义
+TRACK_FILE_PATTERN = re.compile(r'^TRACK_FILE:(\{.*\})\s*$')  # Go 输出的音轨文件信息，用于本地音乐库索引
 GO_FILTER_PATTERNS = [
     re.compile(r'Downloading', re.IGNORECASE),
     re.compile(r'Decrypting', re.IGNORECASE),
     re.compile(r'\d+(\.\d+)?%.*of.*\d+(\.\d+)?.B'),
     re.compile(r'^\s*$'),
-    re.compile(r'SPECIFIC_LYRICS_FAILURE:.*$')  # 用于过滤特定歌词获取失败的日志
+    re.compile(r'SPECIFIC_LYRICS_FAILURE:.*$'),  # 用于过滤特定歌词获取失败的日志
+    re.compile(r'^TRACK_FILE:')  # 音轨文件信息只写入本地音乐库索引
 ]
 
 
@@ -328,6 +435,17 @@ DEFAULT_RETRY_DELAY = 10
 # DEFAULT_SLEEP_INTERVAL = 5 # 移除未使用的默认值
 DEFAULT_SCHEDULER_LONG_POLL_INTERVAL = 60
 DEFAULT_SCHEDULER_SIGNAL_PORT = 51234
+DEFAULT_PROGRESS_PERSIST_INTERVAL = 2 # 下载进度合并写入间隔(秒)
+DEFAULT_WRITER_MAX_BATCH = 200 # 单次提交的最大变更数
+DEFAULT_WRITE_WAIT_TIMEOUT = 30 # 等待写入完成的超时时间(秒)
+DEFAULT_RETIREMENT_GRACE_SECONDS = 30 # 已完成任务移出队列前的展示时间(秒)
+DEFAULT_STARTUP_QUEUE_MODE = "clear" # 启动时的任务队列处理方式: resume (恢复未完成任务) / clear (清空队列)
+DEFAULT_SCHEDULING_CONFIG = {
+    "small_job_max_tracks": 3,  # 不超过该音轨数的任务为短作业 (interactive)
+    "express_slots": 1,         # interactive 任务在 MAX_PARALLEL 之外可用的快速通道槽位
+    "aging_seconds": 600,       # 等待老化系数(秒)
+}
+QUEUE_WAIT_BUCKETS_SECONDS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400)
 # DEFAULT_PATHS_RELATIVE_TO_ROOT = { ... } # 移动到 utils.py
 
 
@@ -336,41 +454,106 @@ config_data = {} # 存储 config.yaml 内容
 users_data = {}  # 存储 users.yaml 内容
 file_paths = {} # 存储绝对文件路径
 file_locks = {} # 存储 filelock 对象
+task_store = None # 任务队列存储后端 (task_store.TaskStore)
+task_writer = None # 任务队列单写入线程 (TaskQueueWriter)
+progress_coalescer = None # 下载进度合并写入器 (None 表示每条进度立即写入)
+history_store = None # 已完成 / 失败任务的历史存储 (history_store.TaskHistoryStore)
+task_retirer = None # 已完成任务退役线程 (None 表示仅在队列空闲时清理)
+scheduling_config = dict(DEFAULT_SCHEDULING_CONFIG) # 优先级与短作业通道配置 (config.yaml 的 scheduling)
 
 # --- 全局 Go 进程数限制 --- #
 max_global_go_processes = 10  # 默认最大并发数，可通过 config.yaml 配置
-current_global_go_processes = 0
-global_go_processes_lock = threading.Lock()
-global_go_processes_condition = threading.Condition(global_go_processes_lock)
+token_client = ApiTokenClient() # backend /token 的进程内缓存，所有音轨线程共享
+decryptor_balancer = DecryptorBalancer() # 解密器端点均衡与熔断 (按 config.yaml 的 decryptor_balancer 重新创建)
+source_renderer = None # source.yaml 解析与渲染缓存 (source_config.SourceConfigRenderer)
+go_worker_pool = None  # 常驻 Go worker 池 (None 表示每个音轨启动一次 Go 进程)
+adaptive_controller = None  # Go 并发数自适应控制 (adaptive_concurrency.AdaptiveConcurrencyController)，None 表示固定并发
+retry_policy = None  # 按失败类别的重试策略与计数 (retry_policy.RetryPolicy)
+library_index = None  # 本地音乐库索引 (library_index.LibraryIndex)，None 表示由 Go 逐个检查已存在的音轨
+track_pool = None  # 全局音轨工作池，工作线程数即 Go 进程预算，按用户公平分配 (track_pool.TrackWorkPool)
 
 # --- 运行中的任务 UUID 集合及其锁 ---
 running_task_uuids = set()
+running_task_users = {}  # uuid -> user，用于按用户统计并发
+running_task_lanes = {}  # uuid -> "normal" / "express" (短作业快速通道)
 running_set_lock = threading.Lock()
+# 任务分派时在用户之间轮转 (权重来自 users.yaml)
+task_dispatch_drr = DeficitRoundRobin(lambda user: user_weight(users_data, user))
+
+# --- 任务队列单写入线程 (group commit) ---
+class PendingWrite:
+    """提交给写入线程的一条变更，可等待其结果。"""
+
+    def __init__(self, op, site):
+        self.op = op
+        self.site = site  # 统计用调用点
+        self.submitted = time.monotonic()
+        self.result = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            IO_STATS.increment(self.site, "write_wait_timeouts")
+            logging.warning(f"等待任务队列写入超时: {self.op.get('op')} {self.op.get('uuid', '')}")
+            return failed_result(self.op)
+        return self.result
+
+
+class TaskQueueWriter:
+    """调度器进程内唯一的任务队列写入者：各线程只提交变更，由本线程成批应用到任务存储。"""
+
+    def __init__(self, store, max_batch=DEFAULT_WRITER_MAX_BATCH, linger_seconds=0):
+        self.store = store
+        self.max_batch = max_batch
+        self.linger_seconds = linger_seconds
+        self.commands = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.stats = {"batches": 0, "ops": 0, "largest_batch": 0}
+        self.thread = threading.Thread(target=self._run, name="任务队列写入", daemon=True)
+        self.thread.start()
+
+    def submit(self, op, site=None):
+        pending = PendingWrite(op, site or f"task_writer.{op.get('op')}")
+        self.commands.put(pending)
+        return pending
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.commands.qsize()
+        return stats
+
+    def _collect_batch(self):
+        batch = [self.commands.get()]
+        deadline = time.monotonic() + self.linger_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.commands.get(timeout=remaining) if remaining > 0 else self.commands.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-# --- 轮询状态管理 ---
-poll_interval_lock = threading.Lock()
-current_poll_interval = None
-fast_poll_mode = False
-
-# --- 校验写入请求队列 ---
-check_write_queue = queue.Queue()
-
-# --- 主线程定期处理校验写入请求 ---
-def process_check_write_queue():
-    while True:
-        try:
-            req = check_write_queue.get(timeout=0.5)
-            if not isinstance(req, dict):
-                continue
-            uuid = req.get('uuid')
-            global_track_number = req.get('global_track_number')
-            update_data = req.get('update_data')
-            logging.info(f"[主线程] 处理校验写入: uuid={uuid}, global_track_number={global_track_number}, update_data={update_data}")
-            update_track_by_global_number_in_file(uuid, global_track_number, update_data)
-        except queue.Empty:
-            break
-        except Exception as e:
-            logging.error(f"[主线程] 处理校验写入队列异常: {e}", exc_info=True)
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                with io_call_site("task_writer"):
+                    results = self.store.apply_batch([pending.op for pending in batch])
+            except Exception as e:
+                logging.error(f"批量写入任务队列时发生意外错误: {e}", exc_info=True)
+                results = [failed_result(pending.op) for pending in batch]
+            done_at = time.monotonic()
+            for pending, result in zip(batch, results):
+                pending.result = result
+                pending.done.set()
+                IO_STATS.observe(pending.site, "write_wait_ms", (done_at - pending.submitted) * 1000)
+            with self.stats_lock:
+                self.stats["batches"] += 1
+                self.stats["ops"] += len(batch)
+                self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            if len(batch) > 1:
+                logging.debug(f"任务队列批量写入: {len(batch)} 条变更一次提交。")
 
 
 # --- Helper 函数 (read/write yaml/json with lock) --- #
@@ -416,137 +599,265 @@ def calculate_global_track_number(tracks, disc_number, track_number):
 
 # --- 校验任务专用音轨状态更新 ---
 def update_track_status_for_check(tracks, global_track_number, update_data):
-    current = 0
-    for track in sorted(tracks, key=lambda t: (t.get('disc_number', 1), t.get('track_number', 1))):
-        disc = track.get('disc_number', 1)
-        tnum = track.get('track_number', 1)
-        current += 1
-        if current == global_track_number:
-            if 'check_success' in update_data:
-                track['check_success'] = True
-            if 'download_progress' in update_data:
-                track['download_progress'] = update_data['download_progress']
-            break
-
-# --- 校验任务：通过全局音轨号实时写回 task_queue.json ---
-def update_track_by_global_number_in_file(uuid, global_track_number, update_data):
-    logging.info(f"准备写入 task_queue.json: uuid={uuid}, global_track_number={global_track_number}, update_data={update_data}")
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    if not task_queue_path or not task_queue_lock_obj:
-        logging.error(f"任务 {uuid}: 无法更新状态，任务队列文件路径或锁未配置。")
+    track = build_global_track_map(tracks).get(global_track_number)
+    if track is None:
         return
-    try:
-        with task_queue_lock_obj.acquire(timeout=10):
-            current_tasks = read_json_with_lock(task_queue_path, task_queue_lock_obj, default=None)
-            if current_tasks is None or not isinstance(current_tasks, list):
-                logging.error(f"任务 {uuid}: 读取 task_queue.json 失败。")
-                return
-            task_found = None
-            for task in current_tasks:
-                if task.get("uuid") == uuid:
-                    task_found = task
-                    break
-            if not task_found:
-                logging.warning(f"任务 {uuid}: 未找到，无法全局号更新。")
-                return
-            tracks = task_found.get("metadata", {}).get("tracks", [])
-            current = 0
-            for track in sorted(tracks, key=lambda t: (t.get('disc_number', 1), t.get('track_number', 1))):
-                current += 1
-                if current == global_track_number:
-                    # 获取当前音轨的下载进度信息
-                    current_progress = track.get('download_progress', {})
-                    total_bytes = current_progress.get('total', 1)  # 如果没有总字节数，默认使用1
-                    
-                    # 检查是否需要设置完整成功状态
-                    if "Track already exists locally." in str(update_data) or "Decrypted" in str(update_data):
-                        complete_status = {
-                            "check_success": True,
-                            "download_status": "success",
-                            "decryption_status": "success",
-                            "connection_status": "success",
-                            "download_progress": {
-                                "current": total_bytes,
-                                "total": total_bytes,
-                                "percent": 100
-                            }
-                        }
-                        track.update(complete_status)
-                        logging.info(f"校验任务: 音轨已存在或解密完成，设置完整成功状态: {complete_status}")
-                    else:
-                        track.update(update_data)
-                        logging.info(f"校验任务: 已实时写入 task_queue.json 全局音轨号 {global_track_number} 的状态: {update_data}")
-                    break
-            if not write_json_with_lock(task_queue_path, task_queue_lock_obj, current_tasks):
-                logging.error(f"任务 {uuid}: 写回 task_queue.json 失败。")
-    except Timeout:
-        logging.error(f"任务 {uuid}: 更新状态时获取文件锁超时: {task_queue_lock_obj.lock_file}")
-    except Exception as e:
-        logging.error(f"任务 {uuid}: 校验全局号更新 task_queue.json 时异常: {e}", exc_info=True)
+    if 'check_success' in update_data:
+        track['check_success'] = True
+    if 'download_progress' in update_data:
+        track['download_progress'] = update_data['download_progress']
 
-# --- 更新任务整体状态函数 ---
-def update_task_status_in_file(uuid, status, error_reason=None, error_log=None, process_complete_time_iso=None, process_start_time_iso=None, checking=None):
-    """使用 filelock 更新 task_queue.json 中特定任务的状态。"""
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    if not task_queue_path or not task_queue_lock_obj:
-        logging.error(f"任务 {uuid}: 无法更新状态，任务队列文件路径或锁未配置。")
-        return
+# --- 校验任务：通过全局音轨号实时写回任务存储 ---
+def update_track_by_global_number_in_file(uuid, global_track_number, update_data):
+    logging.info(f"准备写入任务存储: uuid={uuid}, global_track_number={global_track_number}, update_data={update_data}")
+    if task_writer is None:
+        logging.error(f"任务 {uuid}: 无法更新状态，任务队列写入线程未启动。")
+        return None
 
-    try:
-        with task_queue_lock_obj.acquire(timeout=10): # 增加写锁超时
-            current_tasks = read_json_with_lock(task_queue_path, task_queue_lock_obj, default=None)
-            if current_tasks is None:
-                logging.error(f"更新任务 {uuid} 状态失败：无法读取任务队列 {task_queue_path}。")
-                return
-            if not isinstance(current_tasks, list):
-                logging.error(f"任务队列文件 {task_queue_path} 内容不是列表，无法更新任务 {uuid}。")
+    def check_fields(track):
+        # 检查是否需要设置完整成功状态
+        if "Track already exists locally." in str(update_data) or "Decrypted" in str(update_data):
+            # 获取当前音轨的下载进度信息
+            total_bytes = track.get('download_progress', {}).get('total', 1)  # 如果没有总字节数，默认使用1
+            complete_status = {
+                "check_success": True,
+                "download_status": "success",
+                "decryption_status": "success",
+                "connection_status": "success",
+                "download_progress": {
+                    "current": total_bytes,
+                    "total": total_bytes,
+                    "percent": 100
+                }
+            }
+            logging.info(f"校验任务: 音轨已存在或解密完成，设置完整成功状态: {complete_status}")
+            return complete_status
+        logging.info(f"校验任务: 已写入任务存储全局音轨号 {global_track_number} 的状态: {update_data}")
+        return update_data
+
+    # 由写入线程异步应用，校验输出读取线程不等待
+    return task_writer.submit({"op": "track_global", "uuid": uuid, "global_number": global_track_number, "fields": check_fields},
+                              site="update_track_by_global_number_in_file")
+
+# --- 下载进度合并写入 ---
+class ProgressCoalescer:
+    """合并 DL_PROGRESS 更新：SSE 实时推送，持久化只保留每个 (uuid, song_id) 的最新值并按间隔写入。"""
+
+    def __init__(self, persist_callback, interval_seconds=DEFAULT_PROGRESS_PERSIST_INTERVAL):
+        self.persist_callback = persist_callback
+        self.interval_seconds = interval_seconds
+        self.lock = threading.Lock()
+        self.pending = {}  # {(uuid, song_id): download_progress}
+        self.stats = {"received": 0, "coalesced": 0, "persisted": 0, "milestone_flushes": 0, "interval_flushes": 0}
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="进度合并写入", daemon=True)
+        self.thread.start()
+
+    def offer(self, uuid, song_id, progress_data):
+        """记录一条进度，若同一音轨已有未写入的进度则覆盖 (计为被合并丢弃)。"""
+        with self.lock:
+            self.stats["received"] += 1
+            if (uuid, song_id) in self.pending:
+                self.stats["coalesced"] += 1
+            self.pending[(uuid, song_id)] = progress_data
+
+    def take(self, uuid, song_id):
+        """取出某音轨未写入的进度 (用于与里程碑更新合并为一次写入)。"""
+        with self.lock:
+            progress_data = self.pending.pop((uuid, song_id), None)
+            if progress_data is not None:
+                self.stats["milestone_flushes"] += 1
+                self.stats["persisted"] += 1
+            return progress_data
+
+    def flush(self, uuid=None, song_id=None):
+        """立即写入未持久化的进度；可按任务或音轨过滤，不传参数时写入全部。"""
+        with self.lock:
+            keys = [k for k in self.pending if (uuid is None or k[0] == uuid) and (song_id is None or k[1] == song_id)]
+            items = [(k, self.pending.pop(k)) for k in keys]
+            self.stats["persisted"] += len(items)
+        # 先全部提交再统一等待，使同一批进度在一次提交中写入
+        pendings = []
+        for (task_uuid, track_song_id), progress_data in items:
+            try:
+                pendings.append(self.persist_callback(task_uuid, track_song_id, {"download_progress": progress_data}, wait=False))
+            except Exception as e:
+                logging.error(f"任务 {task_uuid}, Song ID {track_song_id}: 写入合并进度失败: {e}", exc_info=True)
+        for pending in pendings:
+            pending.wait(DEFAULT_WRITE_WAIT_TIMEOUT)
+        return len(items)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pending"] = len(self.pending)
+        stats["interval_seconds"] = self.interval_seconds
+        return stats
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval_seconds)
+            self.wakeup.clear()
+            if self.flush():
+                with self.lock:
+                    self.stats["interval_flushes"] += 1
+
+
+class TaskRetirer:
+    """任务完成 / 失败后经过宽限期即归档到历史存储并移出任务队列，不再等待整个队列空闲。"""
+
+    def __init__(self, grace_seconds=DEFAULT_RETIREMENT_GRACE_SECONDS):
+        self.grace_seconds = grace_seconds
+        self.condition = threading.Condition()
+        self.due = []  # 堆: (到期时间, uuid)
+        self.scheduled = set()
+        self.stats = {"retired": 0, "archive_failures": 0, "remove_failures": 0}
+        self.thread = threading.Thread(target=self._run, name="任务退役", daemon=True)
+        self.thread.start()
+
+    def schedule(self, uuid, completed_at=None):
+        """登记一个已完成的任务，completed_at (时间戳) 缺省为当前时间。"""
+        if not uuid:
+            return
+        with self.condition:
+            if uuid in self.scheduled:
                 return
+            self.scheduled.add(uuid)
+            heapq.heappush(self.due, ((completed_at or time.time()) + self.grace_seconds, uuid))
+            self.condition.notify()
+
+    def schedule_completed(self, tasks):
+        """补登记队列中已处于 finish / error 的任务 (例如调度器重启前完成、或由其他进程修改的任务)。"""
+        for task in tasks:
+            if task.get("status") not in ("finish", "error") or task.get("uuid") in self.scheduled:
+                continue
+            completed_at = None
+            try:
+                if task.get("process_complete_time"):
+                    completed_at = datetime.fromisoformat(task["process_complete_time"]).timestamp()
+            except (ValueError, TypeError):
+                pass
+            self.schedule(task.get("uuid"), completed_at)
 
-            task_found = None
-            task_index = -1
-            for i, task in enumerate(current_tasks):
-                if task.get("uuid") == uuid:
-                    task_found = task
-                    task_index = i
-                    break
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["scheduled"] = len(self.scheduled)
+        stats["grace_seconds"] = self.grace_seconds
+        return stats
 
-            if not task_found:
-                logging.warning(f"任务 {uuid}: 在 task_queue.json 中未找到，无法更新状态。")
-                return
+    def _take_due(self):
+        with self.condition:
+            while True:
+                now = time.time()
+                if self.due and self.due[0][0] <= now:
+                    uuids = []
+                    while self.due and self.due[0][0] <= now:
+                        uuids.append(heapq.heappop(self.due)[1])
+                    return uuids
+                self.condition.wait(self.due[0][0] - now if self.due else None)
+
+    def _run(self):
+        while True:
+            uuids = self._take_due()
+            try:
+                self._retire(uuids)
+            except Exception as e:
+                logging.error(f"任务退役时发生意外错误: {e}", exc_info=True)
+                self._reschedule(uuids)
+
+    def _reschedule(self, uuids):
+        with self.condition:
+            for uuid in uuids:
+                heapq.heappush(self.due, (time.time() + self.grace_seconds, uuid))
+            self.condition.notify()
+
+    def _forget(self, uuids):
+        with self.condition:
+            self.scheduled.difference_update(uuids)
+
+    def _retire(self, uuids):
+        # 以存储中的最新状态为准：已被删除或重新排队的任务不再退役
+        tasks = [task for task in (task_store.get_task(uuid) for uuid in uuids) if task and task.get("status") in ("finish", "error")]
+        retired = {task.get("uuid") for task in tasks}
+        self._forget([uuid for uuid in uuids if uuid not in retired])
+        if not tasks:
+            return
+        if history_store.archive(tasks) < 0:
+            with self.condition:
+                self.stats["archive_failures"] += 1
+            logging.error(f"归档任务到历史存储失败，{len(tasks)} 个任务暂留在队列中，稍后重试。")
+            self._reschedule(list(retired))
+            return
+        removed = task_writer.submit({"op": "remove", "uuids": list(retired)}).wait(DEFAULT_WRITE_WAIT_TIMEOUT)
+        if removed < 0:
+            with self.condition:
+                self.stats["remove_failures"] += 1
+            logging.error(f"从任务队列移除已归档任务失败，稍后重试: {sorted(retired)}")
+            self._reschedule(list(retired))
+            return
+        self._forget(retired)
+        with self.condition:
+            self.stats["retired"] += removed
+        with task_progress_lock:
+            for uuid in retired:
+                task_progress.pop(uuid, None)
+        logging.info(f"已将 {len(tasks)} 个已完成/失败的任务归档并移出任务队列。")
+
+
+def _persist_track_update(uuid, song_id, update_data, wait=True):
+    """将音轨更新提交给写入线程；wait=False 时返回 PendingWrite 由调用方等待。"""
+    pending = task_writer.submit({"op": "track", "uuid": uuid, "song_id": song_id, "fields": update_data}, site="update_track_progress_in_file")
+    if not wait:
+        return pending
+    track_updated = pending.wait(DEFAULT_WRITE_WAIT_TIMEOUT)
+    if track_updated is None:
+        logging.warning(f"任务 {uuid}: 未能更新 Song ID {song_id} 的状态。")
+        return None
+    log_track_num_local = track_updated.get('track_number', '?')
+    log_disc_num_local = track_updated.get('disc_number')
+    log_disc_info_local = f" (光盘 {log_disc_num_local})" if log_disc_num_local else ""
+    if set(update_data) == {"download_progress"}:
+        dp_local = update_data["download_progress"]
+        logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 下载进度 {dp_local.get('current')}/{dp_local.get('total')}")
+    else:
+        logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 已更新音轨状态 {update_data}")
+    return pending
 
-            logging.info(f"任务 {uuid}: 正在更新状态为 {status}")
-            task_found["status"] = status
-            if error_reason is not None:
-                task_found["error_reason"] = error_reason
-            if error_log is not None:
-                task_found["error_log"] = error_log
-            if process_complete_time_iso is not None:
-                task_found["process_complete_time_iso"] = process_complete_time_iso
-            if process_start_time_iso is not None:
-                task_found["process_start_time_iso"] = process_start_time_iso
-            if checking is not None:
-                task_found["checking"] = checking
-            elif "checking" in task_found:
-                del task_found["checking"]
 
-            try:
-                with open(task_queue_path, 'w', encoding='utf-8') as f_write:
-                    json.dump(current_tasks, f_write, indent=4, ensure_ascii=False)
-                    f_write.flush()
-                    os.fsync(f_write.fileno())
-            except Exception as write_e: logging.error(f"任务 {uuid}: 将更新后的任务列表写回 {task_queue_path} 时出错: {write_e}")
-            logging.info(f"[{threading.current_thread().name}] 释放锁: {task_queue_lock_obj.lock_file}")
-    except filelock.Timeout: logging.error(f"任务 {uuid}: 更新状态时获取文件锁超时: {task_queue_lock_obj.lock_file}")
-    except Exception as e: logging.error(f"任务 {uuid}: 更新 task_queue.json 状态时发生意外错误: {e}", exc_info=True)
+# --- 更新任务整体状态函数 ---
+def build_status_op(uuid, status, error_reason=None, error_log=None, process_complete_time_iso=None, process_start_time_iso=None, checking=None):
+    """构造更新任务整体状态的写入变更。"""
+    fields = {"status": status}
+    if error_reason: fields["error_reason"] = error_reason
+    if error_log: fields["error_log"] = error_log
+    if process_complete_time_iso: fields["process_complete_time"] = process_complete_time_iso
+    if process_start_time_iso: fields["process_start_time"] = process_start_time_iso
+    remove_keys = ()
+    if checking is not None:
+        fields["checking"] = checking
+    else:
+        remove_keys = ("checking",)
+    return {"op": "task", "uuid": uuid, "fields": fields, "remove_keys": remove_keys}
+
+def update_task_status_in_file(uuid, status, error_reason=None, error_log=None, process_complete_time_iso=None, process_start_time_iso=None, checking=None):
+    """通过写入线程更新任务整体状态 (仅改写该任务，不重写整个队列)，等待写入完成。"""
+    if task_writer is None:
+        logging.error(f"任务 {uuid}: 无法更新状态，任务队列写入线程未启动。")
+        return
+    op = build_status_op(uuid, status, error_reason, error_log, process_complete_time_iso, process_start_time_iso, checking)
+    try:
+        pending = task_writer.submit(op, site="update_task_status_in_file")
+        if not pending.wait(DEFAULT_WRITE_WAIT_TIMEOUT):
+            logging.warning(f"任务 {uuid}: 更新状态 '{status}' 未写入任务存储。")
+        elif status in ("finish", "error") and task_retirer is not None:
+            task_retirer.schedule(uuid)  # 宽限期后归档并移出队列
+    except Exception as e: logging.error(f"任务 {uuid}: 更新任务存储状态时发生意外错误: {e}", exc_info=True)
 
 def update_track_progress_in_file(uuid, song_id, update_data):
-    """使用 filelock 和 song_id 更新 task_queue.json 中特定任务特定音轨的状态。"""
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    if not task_queue_path or not task_queue_lock_obj:
-        logging.error(f"任务 {uuid}, Song ID {song_id}: 无法更新状态，任务队列文件路径或锁未配置。")
+    """按 song_id 更新任务存储中特定任务特定音轨的状态。"""
+    if task_writer is None:
+        logging.error(f"任务 {uuid}, Song ID {song_id}: 无法更新状态，任务队列写入线程未启动。")
         return
     if not song_id:
         logging.warning(f"任务 {uuid}: 尝试更新音轨状态但 song_id 无效，跳过。")
@@ -558,75 +869,42 @@ def update_track_progress_in_file(uuid, song_id, update_data):
         with task_progress_lock:
             if uuid not in task_progress: task_progress[uuid] = {}
             task_progress[uuid][song_id] = progress_data
-        message = json.dumps({"song_id": song_id, "progress": progress_data})
+        message = json_dumps({"song_id": song_id, "progress": progress_data}, pretty=False)
         with sse_clients_lock:
             if uuid in sse_clients:
                 for _, client_q in sse_clients[uuid]:
                     try: client_q.put(message)
                     except: pass 
 
-    # --- 文件操作和日志记录 --- #
+    # --- 存储写入和日志记录 --- #
     try:
-        with task_queue_lock_obj.acquire(timeout=10): 
-            current_tasks = read_json_with_lock(task_queue_path, task_queue_lock_obj, default=None)
-            if current_tasks is None: logging.error(f"更新任务 {uuid} (Song ID: {song_id}) 状态失败：无法读取任务队列 {task_queue_path}。"); return
-            if not isinstance(current_tasks, list): logging.error(f"任务队列文件 {task_queue_path} 内容不是列表，无法更新任务 {uuid} (Song ID: {song_id})。"); return
-
-            task_found = None
-            track_to_update = None # Initialize track_to_update to None
-
-            for task_in_queue in current_tasks: # Renamed task to task_in_queue
-                if task_in_queue.get("uuid") == uuid:
-                    task_found = task_in_queue
-                    metadata = task_found.get("metadata", {})
-                    tracks = metadata.get("tracks", [])
-                    if not isinstance(tracks, list):
-                        logging.warning(f"任务 {uuid}: metadata.tracks 不是列表格式，无法更新 Song ID {song_id}。"); return
-                    
-                    for track_item in tracks: 
-                        if isinstance(track_item, dict) and track_item.get('song_id') == song_id:
-                            track_to_update = track_item
-                            break # Found the track, no need to search further in this task
-                    break # Found the task, no need to search further in current_tasks
-            
-            if not task_found:
-                logging.warning(f"任务 {uuid}: 在 task_queue.json 中未找到，无法更新 Song ID {song_id} 的状态。"); return
-
-            # --- 日志记录移到找到 track_to_update 之后 --- #
-            if track_to_update: # Check if track_to_update was found and assigned
-                log_track_num_local = track_to_update.get('track_number', '?') 
-                log_disc_num_local = track_to_update.get('disc_number') 
-                log_disc_info_local = f" (光盘 {log_disc_num_local})" if log_disc_num_local else "" 
-                log_update_data_local = {k: v for k, v in update_data.items()} 
-
-                if "download_progress" in log_update_data_local:
-                    dp_local = log_update_data_local["download_progress"] 
-                    logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 下载进度 {dp_local.get('current')}/{dp_local.get('total')}")
-                else:
-                    logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 正在更新音轨状态 {log_update_data_local}")
-                
-                track_to_update.update(update_data) # Update the actual track data
-            else:
-                # This case should ideally not be reached if song_id is valid and present, 
-                # but as a safeguard:
-                logging.warning(f"任务 {uuid}: 在元数据中未找到 Song ID {song_id} 对应的音轨，无法更新或记录其状态。")
-                return # Do not proceed to write if track was not found
-
-            if not write_json_with_lock(task_queue_path, task_queue_lock_obj, current_tasks):
-                logging.error(f"将更新后的任务列表写回 {task_queue_path} 时失败 (UUID: {uuid}, Song ID: {song_id})。")
-
-    except Timeout: logging.error(f"任务 {uuid}, Song ID {song_id}: 更新状态时获取文件锁超时: {task_queue_lock_obj.lock_file}")
-    except Exception as e: logging.error(f"任务 {uuid}, Song ID {song_id}: 更新 task_queue.json 状态时发生意外错误: {e}", exc_info=True)
+        if progress_coalescer is not None:
+            if set(update_data) == {"download_progress"} and update_data["download_progress"].get("percent", 0) < 100:
+                # 普通进度只进入合并缓冲，由后台按间隔写入
+                progress_coalescer.offer(uuid, song_id, update_data["download_progress"])
+                return
+            # 里程碑 (完成/解密/失败等)：连同尚未写入的进度一次写入
+            pending_progress = progress_coalescer.take(uuid, song_id)
+            if pending_progress is not None and "download_progress" not in update_data:
+                update_data = dict(update_data, download_progress=pending_progress)
+        _persist_track_update(uuid, song_id, update_data)
+    except Exception as e: logging.error(f"任务 {uuid}, Song ID {song_id}: 更新任务存储状态时发生意外错误: {e}", exc_info=True)
 
 
 # --- 分析 Go 输出和日志函数 ---
 # (基本保持不变)
 def analyze_go_output(return_code, total_output):
-    """分析 Go 进程的输出和返回码，判断整体是否成功，并给出失败原因。"""
+    """分析 Go 进程的输出和返回码，判断整体是否成功，并给出失败原因及失败类别。
+
+    失败类别: exit_code (返回码非零) / errors (E:n) / token (令牌失败) / network (Get/EOF) / connect (连接解密器失败) /
+    not_found (404 或链接无效)。
+    """
     warnings_detected = 0
     errors_detected = 0
     token_failure_detected = False
     get_eof_failure_detected = False
+    connect_failure_detected = False
+    not_found_detected = False
     for line in total_output.splitlines():
         stripped_line = line.strip()
         if not stripped_line: continue
@@ -634,6 +912,8 @@ def analyze_go_output(return_code, total_output):
         if m := ERROR_PATTERN.search(stripped_line): errors_detected = max(errors_detected, int(m.group(1)))
         if GO_TOKEN_FAILURE_STRING and GO_TOKEN_FAILURE_STRING in stripped_line: token_failure_detected = True
         if GO_GET_EOF_PATTERN.search(stripped_line): get_eof_failure_detected = True
+        if GO_CONNECT_ERROR_PATTERN.search(stripped_line): connect_failure_detected = True
+        if GO_NOT_FOUND_PATTERN.search(stripped_line): not_found_detected = True
     success = (return_code == 0 and errors_detected == 0 and not token_failure_detected and not get_eof_failure_detected)
     failure_reasons = []
     if return_code != 0: failure_reasons.append(f"返回码 {return_code} 非零")
@@ -642,7 +922,15 @@ def analyze_go_output(return_code, total_output):
     if get_eof_failure_detected: failure_reasons.append(f"检测到网络错误 (Get/EOF)")
     reason = ', '.join(failure_reasons) if failure_reasons else "未知失败原因"
     if not success and not failure_reasons: reason = f"Go 进程失败 (返回码 {return_code})，未检测到特定错误模式"
-    return success, reason
+    failure_classes = set()
+    if not success:
+        if return_code != 0: failure_classes.add("exit_code")
+        if errors_detected > 0: failure_classes.add("errors")
+        if token_failure_detected: failure_classes.add("token")
+        if get_eof_failure_detected: failure_classes.add("network")
+        if connect_failure_detected: failure_classes.add("connect")
+        if not_found_detected: failure_classes.add("not_found")
+    return success, reason, failure_classes
 
 def log_go_output_line(line, uuid):
     """过滤 Go 进程的单行输出，并将未过滤的行记录到日志。"""
@@ -777,33 +1065,92 @@ def get_task_display_info(task_data):
 
     return name, type_zh, type_key # 返回 key 用于可能的逻辑判断
 
-# --- 添加全局变量用于轮询算法 ---
-decrypt_port_counter = 0
-get_port_counter = 0
-port_counter_lock = threading.Lock()
+def begin_go_attempt():
+    """向自适应并发控制登记一次开始的 Go 执行尝试 (用于检测卡住)，未启用时返回 None。"""
+    return adaptive_controller.begin() if adaptive_controller is not None else None
 
-def get_next_decryptor_port(source_data_dict):
-    """从 source.yaml 中获取下一个解密器端口，实现轮询负载均衡"""
-    global decrypt_port_counter, get_port_counter
-    
-    decrypt_m3u8_port = source_data_dict.get('decrypt-m3u8-port', '')
-    get_m3u8_port = source_data_dict.get('get-m3u8-port', '')
-    
-    # 检查是否为列表格式
-    if isinstance(decrypt_m3u8_port, list) and decrypt_m3u8_port:
-        with port_counter_lock:
-            decrypt_port_counter = (decrypt_port_counter + 1) % len(decrypt_m3u8_port)
-            decrypt_m3u8_port = decrypt_m3u8_port[decrypt_port_counter]
-    
-    if isinstance(get_m3u8_port, list) and get_m3u8_port:
-        with port_counter_lock:
-            get_port_counter = (get_port_counter + 1) % len(get_m3u8_port)
-            get_m3u8_port = get_m3u8_port[get_port_counter]
-    
-    return decrypt_m3u8_port, get_m3u8_port
+def end_go_attempt(attempt_id):
+    """尝试结束时移除未上报结果的登记 (已上报时无操作)。"""
+    if adaptive_controller is not None and attempt_id is not None:
+        adaptive_controller.abandon(attempt_id)
+
+def record_go_attempt(success, failure_classes, duration, attempt_id=None):
+    """把一次 Go 执行尝试的结果上报给自适应并发控制 (未启用时忽略)。"""
+    if adaptive_controller is not None:
+        adaptive_controller.record(success, failure_classes, duration, busy=track_pool.busy if track_pool is not None else None, attempt_id=attempt_id)
 
-def execute_single_track(task_data, track, user_notification_config, max_retries, retry_delay, go_main_bin_path):
-    """执行单个音轨的下载任务"""
+def record_library_files(log_prefix, total_output):
+    """把 Go 输出中的 TRACK_FILE 记录写入本地音乐库索引 (仅在执行成功后调用，文件不存在的记录被忽略)。"""
+    if library_index is None:
+        return
+    recorded = 0
+    for line in total_output.splitlines():
+        match = TRACK_FILE_PATTERN.match(line.strip())
+        if not match:
+            continue
+        try:
+            recorded += library_index.record(json.loads(match.group(1)))
+        except (ValueError, AttributeError) as e:
+            logging.debug(f"{log_prefix}: 无法解析 TRACK_FILE 输出: {e}")
+        except Exception as e:
+            logging.warning(f"{log_prefix}: 写入本地音乐库索引失败: {e}")
+    if recorded:
+        logging.debug(f"{log_prefix}: 本地音乐库索引记录了 {recorded} 个音轨文件。")
+
+def mark_library_tracks(uuid, user, tracks):
+    """派发前查询本地音乐库索引：文件已存在的音轨直接标记为 exists (不启动 Go)，返回仍需执行的音轨。"""
+    if library_index is None or source_renderer is None:
+        return tracks
+    try:
+        source = source_renderer.load_source()
+        alac_folder = source.get('alac-save-folder') if isinstance(source, dict) else None
+        if not alac_folder or not isinstance(alac_folder, str):
+            return tracks
+        alac_root = alac_folder.replace("{user}", user)
+        atmos_folder = source.get('atmos-save-folder')
+        atmos_root = atmos_folder.replace("{user}", user) if isinstance(atmos_folder, str) and atmos_folder else None
+        # Go 默认保存到 alac-save-folder，atmos 目录位于其下时排除 (杜比全景声文件不等同于 ALAC 音轨)
+        found = library_index.find_tracks(
+            [track.get('song_id') for track in tracks],
+            alac_root, exclude_roots=[atmos_root] if atmos_root and os.path.abspath(atmos_root) != os.path.abspath(alac_root) else ()
+        )
+    except Exception as e:
+        logging.warning(f"任务 {uuid}: 查询本地音乐库索引失败，交由 Go 检查: {e}")
+        return tracks
+    if not found:
+        return tracks
+    pendings = {}
+    for song_id, entry in found.items():
+        size = entry.get("size") or 1
+        pendings[song_id] = _persist_track_update(uuid, song_id, {
+            "download_status": "exists", "decryption_status": "exists", "connection_status": "success", "completion": "exists",
+            "download_progress": {"current": size, "total": size, "percent": 100},
+        }, wait=False)
+    # 整批共用一个截止时间等待写入 (在调度线程中执行，不逐个等待完整超时)；未按时写入的音轨仍交给 Go
+    deadline = time.monotonic() + DEFAULT_WRITE_WAIT_TIMEOUT
+    marked = {song_id for song_id, pending in pendings.items() if pending.wait(max(0.0, deadline - time.monotonic()))}
+    if len(marked) < len(found):
+        logging.warning(f"任务 {uuid}: {len(found) - len(marked)} 个音轨的 exists 状态未及时写入，交由 Go 检查。")
+    if marked:
+        logging.info(f"任务 {uuid}: 本地音乐库索引中已存在 {len(marked)} 个音轨，直接标记为 exists。")
+    return [track for track in tracks if str(track.get('song_id')) not in marked]
+
+def wait_before_retry(log_prefix, decision):
+    """执行重试决策中的动作 (刷新 API Token)，然后退避等待；在音轨工作线程中等待期间让出 Go 槽位。"""
+    actions = []
+    if decision.refresh_token:
+        token_client.invalidate()
+        actions.append("刷新 API Token")
+    if decision.switch_endpoint:
+        actions.append("更换解密器端点")
+    logging.info(f"{log_prefix}: 失败类别 {decision.failure_class}，{decision.delay:.1f} 秒后重试" + (f" ({'、'.join(actions)})" if actions else "") + "。")
+    if track_pool is not None:
+        track_pool.backoff(decision.delay)
+    else:
+        time.sleep(decision.delay)
+
+def execute_single_track(task_data, track, user_notification_config, max_retries, retry_delay, go_main_bin_path, outcome=None):
+    """执行单个音轨的下载任务。outcome 为字典时，成功后写入 outcome["exists"] (Go 报告音轨已存在于本地)。"""
     uuid = task_data.get("uuid")
     skip_check = task_data.get("skip_check", False)  # 获取 skip_check 参数，默认为 False
     
@@ -844,77 +1191,45 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
     final_error_log = ""
     final_error_reason = ""
     is_check_task = (track_number == 0)
-    for attempt in range(max_retries + 1):
-        logging.info(f"{log_prefix}: 开始尝试 {attempt + 1}/{max_retries + 1}")
+    failed_endpoints = set()  # 上一次失败所用的解密器端点 (策略要求更换端点时)
+    policy = retry_policy or create_retry_policy(config_data, max_retries, retry_delay)
+    retries_by_class = {}  # 失败类别 -> 本音轨已重试次数
+    for attempt in range(policy.max_attempts):
+        logging.info(f"{log_prefix}: 开始尝试 {attempt + 1}/{policy.max_attempts}")
         process = None
         attempt_total_output = ""
-        source_yaml_template_string = None
-        # 校验任务不计入全局Go进程数
-        if not is_check_task:
-            global current_global_go_processes, max_global_go_processes, global_go_processes_condition
-            with global_go_processes_condition:
-                while current_global_go_processes >= max_global_go_processes:
-                    logging.info(f"全局 Go 进程数已达上限({max_global_go_processes})，等待空闲...")
-                    global_go_processes_condition.wait()
-                current_global_go_processes += 1
+        attempt_started = time.monotonic()
+        go_attempt_id = begin_go_attempt()
+        decryptor_lease = None
+        attempt_result = None  # (成功与否, 失败类别)，用于解密器端点计分
+        retry_decision = None  # 本次失败后的重试决策 (retry_policy.RetryDecision)
         try:
-            source_path = file_paths.get('source')
-            source_lock = file_locks.get('source')
-            if not source_path or not source_lock:
+            if source_renderer is None:
                 msg = f"{log_prefix}: Source.yaml 路径或锁未配置。"
                 logging.error(msg)
                 final_error_reason = msg; final_error_log = msg
                 break
             
-            # --- 新增：从 backend.py 获取 API Token ---
-            api_token_from_backend = None
-            try:
-                logging.info(f"{log_prefix}: 正在从 http://localhost:5000/token 获取 API Token。")
-                token_response = requests.get("http://localhost:5000/token", timeout=5)
-                token_response.raise_for_status()
-                token_data = token_response.json()
-                if token_data and "token" in token_data:
-                    api_token_from_backend = token_data["token"]
-                    logging.info(f"{log_prefix}: 成功获取 API Token。")
-                else:
-                    logging.warning(f"{log_prefix}: 获取 API Token 失败，响应中缺少 token 字段或数据无效。")
-            except requests.exceptions.RequestException as req_err:
-                logging.warning(f"{log_prefix}: 请求 /token 接口失败: {req_err}")
-            except Exception as e_token:
-                logging.warning(f"{log_prefix}: 获取 API Token 时发生未知错误: {e_token}")
-            # --- API Token 获取结束 ---
-
-            source_data_dict = read_yaml_with_lock(source_path, source_lock)
-            if isinstance(source_data_dict, dict):
-                # --- 新增：将获取到的 API Token 添加到 source_data_dict ---
-                if api_token_from_backend:
-                    source_data_dict["api_token"] = api_token_from_backend
-                    logging.debug(f"{log_prefix}: 已将 API Token 添加到传递给 Go 的配置中。")
-                else:
-                    logging.warning(f"{log_prefix}: 未能获取 API Token，Go 程序将尝试自行获取。")
-                # --- API Token 添加结束 ---
-                try:
-                    decrypt_m3u8_port, get_m3u8_port = get_next_decryptor_port(source_data_dict)
-                    source_data_dict['decrypt-m3u8-port'] = decrypt_m3u8_port
-                    source_data_dict['get-m3u8-port'] = get_m3u8_port
-                    logging.info(f"{log_prefix}: 使用解密器端口 {decrypt_m3u8_port}, 获取端口 {get_m3u8_port}")
-                    source_yaml_template_string = yaml.dump(source_data_dict, default_flow_style=False, allow_unicode=True)
-                except Exception as e:
-                    logging.error(f"{log_prefix}: source_data 转 YAML 失败: {e}")
-                    source_yaml_template_string = ""
-            else:
-                logging.warning(f"{log_prefix}: {source_path} 内容无效")
-                source_yaml_template_string = ""
-            if not source_yaml_template_string:
+            # 解析后的 source.yaml 与渲染结果均有缓存 (mtime / token 变化时失效)，API Token 由 token_client 共享
+            source_data_dict = source_renderer.load_source()
+            if not isinstance(source_data_dict, dict):
                 msg = f"{log_prefix}: 无法获取 source.yaml 内容。"
                 logging.error(msg)
                 final_error_reason = msg; final_error_log = msg
                 break
             try:
-                yaml_input_string = source_yaml_template_string.replace("{user}", user)
+                # 选择在途最少且健康的解密器端点，重试时避开上次失败的端点
+                decryptor_lease = decryptor_balancer.acquire(source_data_dict, avoid=failed_endpoints)
+                decrypt_m3u8_port, get_m3u8_port = decryptor_lease.decrypt_m3u8_port, decryptor_lease.get_m3u8_port
+                logging.info(f"{log_prefix}: 使用解密器端口 {decrypt_m3u8_port}, 获取端口 {get_m3u8_port}")
+                yaml_input_string = source_renderer.render(user, decrypt_m3u8_port, get_m3u8_port)
             except Exception as e:
-                logging.error(f"{log_prefix}: 替换 {{user}} 失败: {e}")
-                final_error_reason = "source.yaml 替换错误"; final_error_log = f"替换错误: {e}"
+                logging.error(f"{log_prefix}: source_data 转 YAML 失败: {e}")
+                yaml_input_string = None
+            if not yaml_input_string:
+                msg = f"{log_prefix}: 无法获取 source.yaml 内容。"
+                logging.error(msg)
+                final_error_reason = msg; final_error_log = msg
                 break
             go_command = [go_main_bin_path, track_url]
             if track_number != 0:
@@ -924,7 +1239,12 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
                 go_command.append("--skip-check")
             process_cwd = PROJECT_ROOT
             logging.info(f"{log_prefix}: 准备执行: {' '.join(go_command)}")
-            process = subprocess.Popen(go_command, cwd=process_cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
+            # 优先交给常驻 Go worker (配置随请求发送)，不可用时启动单次进程
+            process = go_worker_pool.start(go_command[1:], yaml_input_string) if go_worker_pool is not None else None
+            if process is not None:
+                logging.info(f"{log_prefix}: 由常驻 Go worker (PID {process.pid}) 执行。")
+            else:
+                process = subprocess.Popen(go_command, cwd=process_cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
             stdout_lines = []
             stderr_lines = []
             import threading
@@ -933,6 +1253,8 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
             if is_check_task:
                 # 获取tracks列表
                 tracks = task_data.get('metadata', {}).get('tracks', [])
+                # 全局音轨号 -> 音轨，只在启动校验时排序一次
+                global_track_map = build_global_track_map(tracks)
                 def check_read_stream(stream, output_list, uuid, update_callback, retry_event, tracks):
                     logging.info(f"check_read_stream已启动，等待Go输出...")
                     last_global_track_number = None
@@ -946,20 +1268,14 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
                         logging.info(f"[Go校验输出] {line.strip()}")
                         if last_global_track_number:
                             # 通过全局音轨号查找对应的音轨
-                            current = 0
-                            target_track = None
-                            for track in sorted(tracks, key=lambda t: (t.get('disc_number', 1), t.get('track_number', 1))):
-                                current += 1
-                                if current == last_global_track_number:
-                                    target_track = track
-                                    break
+                            target_track = global_track_map.get(last_global_track_number)
                             
                             if target_track:
                                 song_id = target_track.get('song_id')
                                 if song_id:
                                     if "Track already exists locally." in line:
                                         logging.info(f"即将写入: uuid={uuid}, global_track_number={last_global_track_number}, check_success=True")
-                                        check_write_queue.put({'uuid': uuid, 'global_track_number': last_global_track_number, 'update_data': {'check_success': True}})
+                                        update_track_by_global_number_in_file(uuid, last_global_track_number, {'check_success': True})
                                         # 推送SSE更新
                                         update_data = {
                                             "check_success": True,
@@ -973,14 +1289,14 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
                                         continue
                                     if any(x in line for x in ["Decrypted", "Downloaded", "connected"]):
                                         logging.info(f"即将写入: uuid={uuid}, global_track_number={last_global_track_number}, check_success=True, 100%")
-                                        check_write_queue.put({'uuid': uuid, 'global_track_number': last_global_track_number, 'update_data': {
+                                        update_track_by_global_number_in_file(uuid, last_global_track_number, {
                                             'check_success': True,
                                             'download_progress': {
                                                 'current': 1,
                                                 'total': 1,
                                                 'percent': 100
                                             }
-                                        }})
+                                        })
                                         # 推送SSE更新
                                         update_data = {
                                             "check_success": True,
@@ -1003,98 +1319,87 @@ def execute_single_track(task_data, track, user_notification_config, max_retries
             stdout_thread.start()
             stderr_thread.start()
             try:
-                process.stdin.write(yaml_input_string)
-                process.stdin.close()  # 必须关闭stdin，否则Go进程会卡住
+                if process.stdin is not None:
+                    process.stdin.write(yaml_input_string)
+                    process.stdin.close()  # 必须关闭stdin，否则Go进程会卡住
             except (IOError, BrokenPipeError) as e:
                 logging.warning(f"{log_prefix}: 写入 stdin 错误: {e}")
             except Exception as e:
                 logging.error(f"{log_prefix}: 写入 stdin 未知错误: {e}")
             go_retry_triggered = False
             while process.poll() is None:
-                if retry_event.is_set():
+                # 常驻 worker 输出重试信号后不会等待输入，等待其返回非零结果即可，不终止 worker
+                if retry_event.is_set() and not isinstance(process, GoWorkerRequest):
                     logging.warning(f"{log_prefix}: 检测到Go重试信号，终止本次Go进程，计入一次Python重试")
                     go_retry_triggered = True
                     process.kill()
                     break
-                process_check_write_queue()
                 time.sleep(0.1)
             stdout_thread.join(timeout=20)
             stderr_thread.join(timeout=20)
-            process_check_write_queue()
             if stdout_thread.is_alive() or stderr_thread.is_alive():
                 logging.warning(f"{log_prefix}: 输出读取线程超时未结束。")
             return_code = process.returncode
             attempt_total_output = "".join(stdout_lines + stderr_lines)
             if go_retry_triggered:
+                attempt_result = (False, {"errors"})
+                record_go_attempt(False, {"errors"}, time.monotonic() - attempt_started, go_attempt_id)
                 logging.info(f"{log_prefix}: 本次Go进程因重试信号被终止，进入下一次Python重试。")
-                if attempt < max_retries:
-                    logging.info(f"{log_prefix}: {retry_delay} 秒后重试。")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logging.error(f"{log_prefix}: 达到最大次数尝试，任务失败。")
-                    break
-            attempt_success, attempt_reason = analyze_go_output(return_code, attempt_total_output)
-            if attempt_success:
-                logging.info(f"{log_prefix}: 尝试 {attempt + 1} 成功。")
-                track_success = True
-                break
+                retry_decision = policy.decide({"errors"}, retries_by_class)
             else:
+                attempt_success, attempt_reason, failure_classes = analyze_go_output(return_code, attempt_total_output)
+                if retry_event.is_set():
+                    failure_classes.add("errors")
+                attempt_result = (attempt_success, failure_classes)
+                record_go_attempt(attempt_success, failure_classes, time.monotonic() - attempt_started, go_attempt_id)
+                if attempt_success:
+                    logging.info(f"{log_prefix}: 尝试 {attempt + 1} 成功。")
+                    track_success = True
+                    if outcome is not None:
+                        outcome["exists"] = any(TRACK_EXISTS_PATTERN.match(line) for line in attempt_total_output.splitlines())
+                    record_library_files(log_prefix, attempt_total_output)
+                    if retries_by_class:
+                        policy.record_success(retries_by_class)
+                    break
                 logging.warning(f"{log_prefix}: 尝试 {attempt + 1} 失败。原因: {attempt_reason}")
                 final_error_log = attempt_total_output
                 final_error_reason = attempt_reason
-                if attempt < max_retries:
-                    logging.info(f"{log_prefix}: {retry_delay} 秒后重试。")
-                    time.sleep(retry_delay)
-                else:
-                    logging.error(f"{log_prefix}: 达到最大次数尝试，任务失败。")
-                    break
+                retry_decision = policy.decide(failure_classes, retries_by_class)
         except Exception as e:
             msg = f"{log_prefix}: 执行尝试 {attempt + 1} 时发生意外错误: {e}"
             logging.error(msg, exc_info=True)
             track_success = False
             final_error_reason = f"意外错误: {e}"
             final_error_log = msg + "\n" + traceback.format_exc()
-            if attempt < max_retries:
-                logging.info(f"{log_prefix}: 因意外错误，{retry_delay} 秒后重试。")
-                time.sleep(retry_delay)
-            else:
-                logging.error(f"{log_prefix}: 因意外错误达到最大次数，任务失败。")
-                break
+            retry_decision = policy.decide({"exception"}, retries_by_class)
         finally:
+            end_go_attempt(go_attempt_id)
             if process:
                 try:
                     process.kill()
                 except Exception:
                     pass
-            if not is_check_task:
-                with global_go_processes_condition:
-                    current_global_go_processes -= 1
-                    global_go_processes_condition.notify_all()
+            if decryptor_lease is not None:
+                decryptor_balancer.release(decryptor_lease, *(attempt_result or (None, ())))
+                failed_endpoints = decryptor_lease.addresses() if retry_decision is not None and retry_decision.switch_endpoint else set()
+            # 本次尝试结束 (成功/失败)，立即写入该音轨尚未持久化的进度
+            if progress_coalescer is not None:
+                progress_coalescer.flush(uuid, None if is_check_task else song_id)
+        if retry_decision is None or not retry_decision.retry:
+            if retry_decision is not None:
+                logging.error(f"{log_prefix}: 失败类别 {retry_decision.failure_class} {retry_decision.reason}，不再重试，任务失败。")
+            break
+        # 退避在归还解密器端点之后进行，等待期间不占用端点和 Go 槽位
+        wait_before_retry(log_prefix, retry_decision)
     return track_success, final_error_reason, final_error_log
 
 def execute_task(task_data, user_notification_config):
-    """通过运行 Go 二进制执行任务，并在完成后触发 Bark 和 Emby 通知。"""
+    """把任务的音轨提交到全局音轨工作池 (不阻塞)，全部音轨结束后由 complete_task 完成校验与通知。"""
     uuid = task_data.get("uuid", "未知UUID")
     user = task_data.get("user", "未知用户")
     link = task_data.get("link", "未知链接")
-    threading.current_thread().name = f"任务-{uuid[:8]}"
     logging.info(f"任务开始执行。UUID: {uuid}, 用户: {user}")
 
-    # 获取通知配置
-    emby_url = user_notification_config.get('emby_url')
-    # bark_urls 现在是一个对象列表，每个对象包含 server 和 click_url_template
-    bark_configs = user_notification_config.get('bark_urls', []) 
-    # bark_config = config_data.get('bark_notification', {}) # 不再需要全局 Bark 配置
-
-    # 构建完整的 Bark URLs - 这部分逻辑需要大改，因为现在每个 bark_config 都有自己的 click_url_template
-    # complete_bark_urls = [] # 不再构建这个列表，直接在发送时处理
-    # for base_url in bark_urls:
-    #     if base_url:
-    #         # 构建完整的 URL，包含路径、图标和跳转链接
-    #         complete_url = f"{base_url}{bark_config.get(\'path\', \'\')}?icon={bark_config.get(\'icon\', \'\')}&url={bark_config.get(\'url\', \'\')}"
-    #         complete_bark_urls.append(complete_url)
-
     # 获取重试参数等 (保持不变)
     max_retries = config_data.get('MAX_RETRIES', DEFAULT_MAX_RETRIES)
     retry_delay = config_data.get('RETRY_DELAY', DEFAULT_RETRY_DELAY)
@@ -1103,9 +1408,7 @@ def execute_task(task_data, user_notification_config):
         msg = f"任务 {uuid}: Go 二进制文件路径无效或不可执行: {go_main_bin_path}"
         logging.error(msg)
         update_task_status_in_file(uuid, "error", msg, msg)
-        with running_set_lock:
-            if uuid in running_task_uuids:
-                running_task_uuids.remove(uuid)
+        release_running_task(uuid)
         return
     # 检查任务类型
     task_type = task_data.get('link_info', {}).get('type', '')
@@ -1117,9 +1420,7 @@ def execute_task(task_data, user_notification_config):
             msg = f"任务 {uuid}: 专辑/播放列表任务没有音轨信息。"
             logging.error(msg)
             update_task_status_in_file(uuid, "error", msg, msg)
-            with running_set_lock:
-                if uuid in running_task_uuids:
-                    running_task_uuids.remove(uuid)
+            release_running_task(uuid)
             return
         
         # --- 移除按全局音轨号排序的逻辑 --- #
@@ -1140,56 +1441,102 @@ def execute_task(task_data, user_notification_config):
              logging.warning(f"任务 {uuid}: 按 disc/track number 排序时出错: {sort_e}，将按原始顺序处理。")
         # --- 排序逻辑结束 --- #
 
-        # 获取最大并行任务数 (保持不变)
-        max_workers = config_data.get('MAX_PARALLEL_TASKS', 10)
-        
-        # 创建线程池 (保持不变)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # --- 提交所有音轨的下载任务 (传递 track 字典) --- #
-            future_to_track = {
-                executor.submit(
-                    execute_single_track,
-                    task_data, # 整个任务数据
-                    track,     # 单个音轨字典 (包含 song_id)
-                    user_notification_config,
-                    max_retries,
-                    retry_delay,
-                    go_main_bin_path
-                    # track_lookup_map 不再传递
-                ): track # value 仍然是 track 字典，用于日志
-                for track in tracks if isinstance(track, dict) # 确保 track 是字典
-            }
-            # --- 提交结束 --- #
-
-            # 收集结果 (保持不变)
-            success_count = 0
-            failure_count = 0
-            final_error_log = ""
-            final_error_reason = ""
-
-            for future in concurrent.futures.as_completed(future_to_track):
-                track = future_to_track[future]
-                log_track_num = track.get('track_number', '?')
-                log_song_id = track.get('song_id', 'N/A')
-                try:
-                    track_success, error_reason, error_log = future.result()
-                    if track_success:
-                        success_count += 1
-                    else:
-                        failure_count += 1
-                        # 记录第一个遇到的错误原因和日志
-                        if not final_error_reason and error_reason:
-                            final_error_reason = f"音轨 {log_track_num} (ID: {log_song_id}) 失败: {error_reason}"
-                        if not final_error_log and error_log:
-                            final_error_log = f"--- 音轨 {log_track_num} (ID: {log_song_id}) 错误日志 ---\n{error_log}"
-                except Exception as e:
-                    failure_count += 1
-                    err_msg = f"音轨 {log_track_num} (ID: {log_song_id}) 执行失败: {e}"
-                    logging.error(f"任务 {uuid}, {err_msg}", exc_info=True)
-                    if not final_error_reason:
-                         final_error_reason = err_msg
-                    if not final_error_log:
-                         final_error_log = traceback.format_exc()
+        tracks = [track for track in tracks if isinstance(track, dict)] # 确保 track 是字典
+    else:
+        # 处理单个音轨/MV的情况
+        # --- 创建一个简化的 track 字典，不包含 song_id --- #
+        # 因为对于非专辑/播放列表，我们不期望有 song_id 或进行精细状态更新
+        tracks = [{
+            "track_number": 1, # 虚拟音轨号
+            "url": link,
+            "name": task_data.get('metadata', {}).get('name', "单项任务"), # 尝试用元数据名
+            "song_id": None # 明确标记无 song_id
+        }]
+
+    if is_album_or_playlist:
+        # 已完成的音轨 (检查点见 is_track_done) 不再重新执行：调度器重启后恢复的任务、只重试失败音轨的任务
+        unfinished_tracks = [track for track in tracks if not is_track_done(track)]
+        if len(unfinished_tracks) < len(tracks):
+            logging.info(f"任务 {uuid}: 跳过 {len(tracks) - len(unfinished_tracks)} 个已完成的音轨，剩余 {len(unfinished_tracks)} 个。")
+        tracks = unfinished_tracks
+        if not task_data.get("skip_check", False):
+            # skip_check 表示强制重新下载，此时不查询本地音乐库索引
+            tracks = mark_library_tracks(uuid, user, tracks)
+
+    def run_track(track):
+        outcome = {}
+        result = execute_single_track(task_data, track, user_notification_config, max_retries, retry_delay, go_main_bin_path, outcome)
+        if track.get("song_id"):
+            # 音轨级检查点：记录完成 (下载成功或本地已存在) 或失败，重试失败音轨时据此跳过已完成的音轨
+            track_success, error_reason, _ = result
+            checkpoint = {"completion": "exists" if outcome.get("exists") else "success", "completed_at": datetime.now(timezone.utc).isoformat(), "error_reason": None} if track_success \
+                else {"completion": "failed", "error_reason": error_reason}
+            update_track_progress_in_file(uuid, track["song_id"], checkpoint)
+        return result
+
+    def on_tracks_done(results):
+        try:
+            complete_task(task_data, user_notification_config, results)
+        except Exception as e:
+            logging.error(f"任务 {uuid}: 完成处理时发生意外错误: {e}", exc_info=True)
+        finally:
+            # 清理运行集合并唤醒调度器填补空出的槽位
+            release_running_task(uuid)
+
+    priority = task_data.get("priority", DEFAULT_TASK_PRIORITY)
+    track_pool.submit_task(
+        uuid, user, tracks, run_track, on_tracks_done,
+        priority_rank=TASK_PRIORITIES.index(priority) if priority in TASK_PRIORITIES else 1
+    )
+    logging.info(f"任务 {uuid}: {len(tracks)} 个音轨已提交到全局音轨工作池。")
+
+def complete_task(task_data, user_notification_config, results):
+    """任务的全部音轨结束后 (在独立线程中) 汇总结果、执行专辑校验，并触发 Bark、Emby 和前端通知。
+
+    results 为 [(track, (success, error_reason, error_log)), ...]。
+    """
+    uuid = task_data.get("uuid", "未知UUID")
+    user = task_data.get("user", "未知用户")
+    link = task_data.get("link", "未知链接")
+
+    # 获取通知配置
+    emby_url = user_notification_config.get('emby_url')
+    # bark_urls 现在是一个对象列表，每个对象包含 server 和 click_url_template
+    bark_configs = user_notification_config.get('bark_urls', []) 
+    # bark_config = config_data.get('bark_notification', {}) # 不再需要全局 Bark 配置
+
+    # 构建完整的 Bark URLs - 这部分逻辑需要大改，因为现在每个 bark_config 都有自己的 click_url_template
+    # complete_bark_urls = [] # 不再构建这个列表，直接在发送时处理
+    # for base_url in bark_urls:
+    #     if base_url:
+    #         # 构建完整的 URL，包含路径、图标和跳转链接
+    #         complete_url = f"{base_url}{bark_config.get(\'path\', \'\')}?icon={bark_config.get(\'icon\', \'\')}&url={bark_config.get(\'url\', \'\')}"
+    #         complete_bark_urls.append(complete_url)
+
+    max_retries = config_data.get('MAX_RETRIES', DEFAULT_MAX_RETRIES)
+    retry_delay = config_data.get('RETRY_DELAY', DEFAULT_RETRY_DELAY)
+    go_main_bin_path = file_paths.get('go_main_bin')
+    task_type = task_data.get('link_info', {}).get('type', '')
+    is_album_or_playlist = task_type in ['album', 'playlist']
+
+    if is_album_or_playlist:
+        # 收集结果 (工作池已把执行异常转换为失败结果)
+        success_count = 0
+        failure_count = 0
+        final_error_log = ""
+        final_error_reason = ""
+        for track, (track_success, error_reason, error_log) in results:
+            log_track_num = track.get('track_number', '?')
+            log_song_id = track.get('song_id', 'N/A')
+            if track_success:
+                success_count += 1
+            else:
+                failure_count += 1
+                # 记录第一个遇到的错误原因和日志
+                if not final_error_reason and error_reason:
+                    final_error_reason = f"音轨 {log_track_num} (ID: {log_song_id}) 失败: {error_reason}"
+                if not final_error_log and error_log:
+                    final_error_log = f"--- 音轨 {log_track_num} (ID: {log_song_id}) 错误日志 ---\n{error_log}"
 
         # 根据结果更新任务状态 (修改：添加专辑校验步骤)
         if failure_count == 0:
@@ -1197,38 +1544,31 @@ def execute_task(task_data, user_notification_config):
             if task_type == 'album':
                 # --- NEW: Check if all tracks exist locally ---
                 all_tracks_exist_locally = False # Default to false, proceed with check
-                task_queue_path_check = file_paths.get('task_queue')
-                task_queue_lock_obj_check = file_locks.get('task_queue')
-
-                if task_queue_path_check and task_queue_lock_obj_check:
+                if task_store is not None:
                     try:
-                        current_tasks_for_check = read_json_with_lock(task_queue_path_check, task_queue_lock_obj_check, default=None)
-                        if current_tasks_for_check and isinstance(current_tasks_for_check, list):
-                            current_task_data_for_check = next((t for t in current_tasks_for_check if t.get("uuid") == uuid), None)
-                            if current_task_data_for_check:
-                                album_tracks = current_task_data_for_check.get('metadata', {}).get('tracks', [])
-                                # Ensure album_tracks is a non-empty list of dicts
-                                if album_tracks and isinstance(album_tracks, list) and all(isinstance(track_item, dict) for track_item in album_tracks):
-                                    all_tracks_exist_locally = True # Assume true until a track doesn't meet criteria
-                                    for track_item in album_tracks:
-                                        if not (track_item.get('download_status') == 'exists' and \
-                                                track_item.get('decryption_status') == 'exists'):
-                                            all_tracks_exist_locally = False
-                                            logging.debug(f"任务 {uuid}: 音轨 {track_item.get('track_number', '未知')} (ID: {track_item.get('song_id', '未知')}) 不满足 'exists' 状态。专辑校验将执行。")
-                                            break
-                                    if all_tracks_exist_locally:
-                                        logging.info(f"任务 {uuid}: 所有音轨均已存在本地，将跳过专辑校验步骤。")
-                                else: # album_tracks is empty or not a list of dicts
-                                    logging.info(f"任务 {uuid}: 专辑元数据中无有效音轨信息或音轨列表为空，将执行专辑校验。")
-                                    all_tracks_exist_locally = False # Ensure check runs
-                            else:
-                                logging.warning(f"任务 {uuid}: 在队列中未找到任务数据，无法检查音轨状态以跳过校验。将执行专辑校验。")
+                        current_task_data_for_check = task_store.get_task(uuid)
+                        if current_task_data_for_check:
+                            album_tracks = current_task_data_for_check.get('metadata', {}).get('tracks', [])
+                            # Ensure album_tracks is a non-empty list of dicts
+                            if album_tracks and isinstance(album_tracks, list) and all(isinstance(track_item, dict) for track_item in album_tracks):
+                                all_tracks_exist_locally = True # Assume true until a track doesn't meet criteria
+                                for track_item in album_tracks:
+                                    if not (track_item.get('download_status') == 'exists' and \
+                                            track_item.get('decryption_status') == 'exists'):
+                                        all_tracks_exist_locally = False
+                                        logging.debug(f"任务 {uuid}: 音轨 {track_item.get('track_number', '未知')} (ID: {track_item.get('song_id', '未知')}) 不满足 'exists' 状态。专辑校验将执行。")
+                                        break
+                                if all_tracks_exist_locally:
+                                    logging.info(f"任务 {uuid}: 所有音轨均已存在本地，将跳过专辑校验步骤。")
+                            else: # album_tracks is empty or not a list of dicts
+                                logging.info(f"任务 {uuid}: 专辑元数据中无有效音轨信息或音轨列表为空，将执行专辑校验。")
+                                all_tracks_exist_locally = False # Ensure check runs
                         else:
-                            logging.warning(f"任务 {uuid}: 读取任务队列失败或格式无效，无法检查音轨状态以跳过校验。将执行专辑校验。")
+                            logging.warning(f"任务 {uuid}: 在队列中未找到任务数据，无法检查音轨状态以跳过校验。将执行专辑校验。")
                     except Exception as e_read_q_check:
                         logging.error(f"任务 {uuid}: 检查音轨状态以跳过校验时读取任务队列异常: {e_read_q_check}，将执行专辑校验。", exc_info=True)
                 else:
-                    logging.error(f"任务 {uuid}: 任务队列路径或锁未配置，无法检查音轨状态以跳过校验。将执行专辑校验。")
+                    logging.error(f"任务 {uuid}: 任务存储未初始化，无法检查音轨状态以跳过校验。将执行专辑校验。")
                 # --- END NEW CHECK ---
 
                 if all_tracks_exist_locally:
@@ -1283,15 +1623,15 @@ def execute_task(task_data, user_notification_config):
                         "name": task_data.get('metadata', {}).get('name', "专辑校验"),
                         "song_id": None
                     }
-                    # 执行校验
-                    check_success, check_reason, check_log = execute_single_track(
+                    # 执行校验 (占用工作池的 Go 槽位，计入全局、自适应与用户的 Go 进程上限)
+                    check_success, check_reason, check_log = track_pool.run_with_slot(uuid, user, lambda: execute_single_track(
                         task_data,
                         album_check_track,
                         user_notification_config,
                         max_retries,
                         retry_delay,
                         go_main_bin_path
-                    )
+                    ))
                     # 校验结束，移除checking
                     update_task_status_in_file(uuid, "running", checking=False)
                     if check_success:
@@ -1459,24 +1799,7 @@ def execute_task(task_data, user_notification_config):
             send_notice_to_clients(notice_data)
     
     else:
-        # 处理单个音轨/MV的情况
-        # --- 创建一个简化的 track 字典，不包含 song_id --- #
-        # 因为对于非专辑/播放列表，我们不期望有 song_id 或进行精细状态更新
-        single_item_track_dict = {
-            "track_number": 1, # 虚拟音轨号
-            "url": link,
-            "name": task_data.get('metadata', {}).get('name', "单项任务"), # 尝试用元数据名
-            "song_id": None # 明确标记无 song_id
-        }
-        track_success, error_reason, error_log = execute_single_track(
-            task_data,
-            single_item_track_dict, # 传递简化字典
-            user_notification_config,
-            max_retries,
-            retry_delay,
-            go_main_bin_path
-        )
-        # --- 修改结束 --- #
+        _, (track_success, error_reason, error_log) = results[0]
 
         # 更新整体任务状态 (逻辑不变)
         if track_success:
@@ -1527,1092 +1850,65 @@ def execute_task(task_data, user_notification_config):
                 "timestamp": process_complete_time_iso
             }
             send_notice_to_clients(notice_data)
-    
-    # 清理运行集合 (保持不变)
-    with running_set_lock:
-        if uuid in running_task_uuids:
-            running_task_uuids.remove(uuid)
 
 
-# --- 更新任务整体状态函数 ---
-def update_task_status_in_file(uuid, status, error_reason=None, error_log=None, process_complete_time_iso=None, process_start_time_iso=None, checking=None):
-    """使用 filelock 更新 task_queue.json 中的任务整体状态。"""
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    if not task_queue_path or not task_queue_lock_obj:
-        logging.error(f"任务 {uuid}: 无法更新状态，任务队列文件路径或锁未配置。")
-        return
-    try:
-        logging.info(f"[{threading.current_thread().name}] 尝试获取锁: {task_queue_lock_obj.lock_file}")
-        with task_queue_lock_obj:
-            logging.info(f"[{threading.current_thread().name}] 成功获取锁: {task_queue_lock_obj.lock_file}")
-            current_tasks = []
-            try:
-                with open(task_queue_path, 'r', encoding='utf-8') as f_read:
-                    content = f_read.read()
-                    if content.strip():
-                        data = json.loads(content)
-                        if isinstance(data, list): current_tasks = data
-                        else: logging.error(f"读取任务队列更新状态时，发现内容不是列表: {task_queue_path}"); return
-            except FileNotFoundError: logging.error(f"任务 {uuid}: 更新状态时 task_queue.json 未找到。"); return
-            except json.JSONDecodeError: logging.error(f"任务 {uuid}: 更新状态时解码 task_queue.json 失败。"); return
-
-            task_found = None
-            task_index = -1
-            for i, task in enumerate(current_tasks):
-                if task.get("uuid") == uuid: task_found = task; task_index = i; break
-            if not task_found: logging.warning(f"任务 {uuid}: 在 task_queue.json 中未找到，无法更新状态。"); return
-
-            # 更新任务状态
-            task_found["status"] = status
-            if error_reason: task_found["error_reason"] = error_reason
-            if error_log: task_found["error_log"] = error_log
-            if process_complete_time_iso: task_found["process_complete_time"] = process_complete_time_iso
-            if process_start_time_iso: task_found["process_start_time"] = process_start_time_iso
-            if checking is not None:
-                task_found["checking"] = checking
-            elif "checking" in task_found:
-                del task_found["checking"]
+# --- 加载配置和文件路径 ---
+def load_config_and_paths():
+    """加载配置(config/users)，路径，锁，日志，检查 users.yaml。"""
+    global config_data, users_data, file_paths, file_locks
+    global max_global_go_processes, track_pool, adaptive_controller
 
-            try:
-                with open(task_queue_path, 'w', encoding='utf-8') as f_write:
-                    json.dump(current_tasks, f_write, indent=4, ensure_ascii=False)
-                    f_write.flush()
-                    os.fsync(f_write.fileno())
-            except Exception as write_e: logging.error(f"任务 {uuid}: 将更新后的任务列表写回 {task_queue_path} 时出错: {write_e}")
-            logging.info(f"[{threading.current_thread().name}] 释放锁: {task_queue_lock_obj.lock_file}")
-    except filelock.Timeout: logging.error(f"任务 {uuid}: 更新状态时获取文件锁超时: {task_queue_lock_obj.lock_file}")
-    except Exception as e: logging.error(f"任务 {uuid}: 更新 task_queue.json 状态时发生意外错误: {e}", exc_info=True)
+    # 1. 读取 config.yaml (使用 utils 函数)
+    config_path = os.path.join(PROJECT_ROOT, "config", "config.yaml")
+    config_lock_obj = filelock.FileLock(f"{config_path}.lock")
+    config_data_local = read_yaml_with_lock(config_path, config_lock_obj)
 
-def update_track_progress_in_file(uuid, song_id, update_data):
-    """使用 filelock 和 song_id 更新 task_queue.json 中特定任务特定音轨的状态。"""
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    if not task_queue_path or not task_queue_lock_obj:
-        logging.error(f"任务 {uuid}, Song ID {song_id}: 无法更新状态，任务队列文件路径或锁未配置。")
-        return
-    if not song_id:
-        logging.warning(f"任务 {uuid}: 尝试更新音轨状态但 song_id 无效，跳过。")
-        return
+    # 检查 config.yaml 是否成功读取且是字典
+    if not isinstance(config_data_local, dict) or not config_data_local:
+        # read_yaml_with_lock 内部会记录错误，这里直接退出
+        logging.critical(f"无法加载有效的配置文件: {config_path}。请检查文件是否存在、格式是否正确以及 utils.py 中的错误日志。")
+        sys.exit(1)
 
-    # --- 发送进度更新到SSE客户端 --- #
-    if "download_progress" in update_data:
-        progress_data = update_data["download_progress"]
-        with task_progress_lock:
-            if uuid not in task_progress: task_progress[uuid] = {}
-            task_progress[uuid][song_id] = progress_data
-        message = json.dumps({"song_id": song_id, "progress": progress_data})
-        with sse_clients_lock:
-            if uuid in sse_clients:
-                for _, client_q in sse_clients[uuid]:
-                    try: client_q.put(message)
-                    except: pass 
+    config_data.update(config_data_local)
+    # --- 调用 utils.setup_logging --- #
+    # 需要在任何 logging 调用之前，并且在 config_data 加载之后
+    setup_logging(config_data, script_chinese_name="任务调度器")
+    configure_json_codec(config_data)
+    configure_durability(config_data)
 
-    # --- 文件操作和日志记录 --- #
-    try:
-        with task_queue_lock_obj.acquire(timeout=10): 
-            current_tasks = read_json_with_lock(task_queue_path, task_queue_lock_obj, default=None)
-            if current_tasks is None: logging.error(f"更新任务 {uuid} (Song ID: {song_id}) 状态失败：无法读取任务队列 {task_queue_path}。"); return
-            if not isinstance(current_tasks, list): logging.error(f"任务队列文件 {task_queue_path} 内容不是列表，无法更新任务 {uuid} (Song ID: {song_id})。"); return
-
-            task_found = None
-            track_to_update = None # Initialize track_to_update to None
-
-            for task_in_queue in current_tasks: # Renamed task to task_in_queue
-                if task_in_queue.get("uuid") == uuid:
-                    task_found = task_in_queue
-                    metadata = task_found.get("metadata", {})
-                    tracks = metadata.get("tracks", [])
-                    if not isinstance(tracks, list):
-                        logging.warning(f"任务 {uuid}: metadata.tracks 不是列表格式，无法更新 Song ID {song_id}。"); return
-                    
-                    for track_item in tracks: 
-                        if isinstance(track_item, dict) and track_item.get('song_id') == song_id:
-                            track_to_update = track_item
-                            break # Found the track, no need to search further in this task
-                    break # Found the task, no need to search further in current_tasks
-            
-            if not task_found:
-                logging.warning(f"任务 {uuid}: 在 task_queue.json 中未找到，无法更新 Song ID {song_id} 的状态。"); return
-
-            # --- 日志记录移到找到 track_to_update 之后 --- #
-            if track_to_update: # Check if track_to_update was found and assigned
-                log_track_num_local = track_to_update.get('track_number', '?') 
-                log_disc_num_local = track_to_update.get('disc_number') 
-                log_disc_info_local = f" (光盘 {log_disc_num_local})" if log_disc_num_local else "" 
-                log_update_data_local = {k: v for k, v in update_data.items()} 
-
-                if "download_progress" in log_update_data_local:
-                    dp_local = log_update_data_local["download_progress"] 
-                    logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 下载进度 {dp_local.get('current')}/{dp_local.get('total')}")
-                else:
-                    logging.info(f"任务 {uuid}, 音轨 {log_track_num_local}{log_disc_info_local} (ID: {song_id}): 正在更新音轨状态 {log_update_data_local}")
-                
-                track_to_update.update(update_data) # Update the actual track data
-            else:
-                # This case should ideally not be reached if song_id is valid and present, 
-                # but as a safeguard:
-                logging.warning(f"任务 {uuid}: 在元数据中未找到 Song ID {song_id} 对应的音轨，无法更新或记录其状态。")
-                return # Do not proceed to write if track was not found
+    # 现在可以安全地使用 logging 了
+    logging.info(f"成功加载配置文件: {config_path}")
 
-            if not write_json_with_lock(task_queue_path, task_queue_lock_obj, current_tasks):
-                logging.error(f"将更新后的任务列表写回 {task_queue_path} 时失败 (UUID: {uuid}, Song ID: {song_id})。")
+    max_global_go_processes = config_data.get('MAX_GLOBAL_GO_PROCESSES', 10)
+    logging.info(f"全局最大 Go 进程数限制: {max_global_go_processes}")
+    scheduling_section = config_data.get('scheduling', {}) or {}
+    for key, default_value in DEFAULT_SCHEDULING_CONFIG.items():
+        try:
+            scheduling_config[key] = max(0, type(default_value)(scheduling_section.get(key, default_value)))
+        except (TypeError, ValueError):
+            logging.warning(f"scheduling.{key} 配置无效，使用默认值 {default_value}。")
+            scheduling_config[key] = default_value
+    scheduling_config["aging_seconds"] = max(1, scheduling_config["aging_seconds"])
+    logging.info(f"任务调度策略: {scheduling_config}")
+    if track_pool is None:
+        # 启用自适应并发时按上限创建工作线程，实际并发数由控制器在 [min_limit, max_limit] 内调整
+        adaptive_controller = create_adaptive_controller(config_data, max_global_go_processes, lambda limit: track_pool.set_limit(limit))
+        track_pool = TrackWorkPool(
+            adaptive_controller.max_limit if adaptive_controller is not None else max_global_go_processes,
+            lambda user: user_weight(users_data, user),
+            lambda user: user_limit(users_data, user, "max_go_processes"),
+            per_task_limit=config_data.get('MAX_PARALLEL_TASKS'),
+            limit=adaptive_controller.limit if adaptive_controller is not None else None
+        )
 
-    except Timeout: logging.error(f"任务 {uuid}, Song ID {song_id}: 更新状态时获取文件锁超时: {task_queue_lock_obj.lock_file}")
-    except Exception as e: logging.error(f"任务 {uuid}, Song ID {song_id}: 更新 task_queue.json 状态时发生意外错误: {e}", exc_info=True)
+    # --- 移除旧的日志级别更新逻辑，因为 setup_logging 已处理 ---
+    # log_level_str = config_data.get("LOG_LEVEL", "INFO").upper()
+    # ... (相关的 logger.setLevel 和 handler.setLevel 调用已移除)
 
-
-# --- 分析 Go 输出和日志函数 ---
-# (基本保持不变)
-def analyze_go_output(return_code, total_output):
-    """分析 Go 进程的输出和返回码，判断整体是否成功，并给出失败原因。"""
-    warnings_detected = 0
-    errors_detected = 0
-    token_failure_detected = False
-    get_eof_failure_detected = False
-    for line in total_output.splitlines():
-        stripped_line = line.strip()
-        if not stripped_line: continue
-        if m := WARNING_PATTERN.search(stripped_line): warnings_detected = max(warnings_detected, int(m.group(1)))
-        if m := ERROR_PATTERN.search(stripped_line): errors_detected = max(errors_detected, int(m.group(1)))
-        if GO_TOKEN_FAILURE_STRING and GO_TOKEN_FAILURE_STRING in stripped_line: token_failure_detected = True
-        if GO_GET_EOF_PATTERN.search(stripped_line): get_eof_failure_detected = True
-    success = (return_code == 0 and errors_detected == 0 and not token_failure_detected and not get_eof_failure_detected)
-    failure_reasons = []
-    if return_code != 0: failure_reasons.append(f"返回码 {return_code} 非零")
-    if errors_detected > 0: failure_reasons.append(f"检测到 {errors_detected} 个错误 (E:{errors_detected})")
-    if token_failure_detected: failure_reasons.append(f"检测到令牌失败 ('{GO_TOKEN_FAILURE_STRING}')")
-    if get_eof_failure_detected: failure_reasons.append(f"检测到网络错误 (Get/EOF)")
-    reason = ', '.join(failure_reasons) if failure_reasons else "未知失败原因"
-    if not success and not failure_reasons: reason = f"Go 进程失败 (返回码 {return_code})，未检测到特定错误模式"
-    return success, reason
-
-def log_go_output_line(line, uuid):
-    """过滤 Go 进程的单行输出，并将未过滤的行记录到日志。"""
-    # DL_PROGRESS 信息由 read_stream 单独处理并更新，不在此处重复记录原始行
-    if line.strip().startswith("DL_PROGRESS:"):
-        return
-        
-    filtered = False
-    for pattern in GO_FILTER_PATTERNS:
-         is_empty_line_pattern = pattern.pattern == r'^\s*$'
-         line_is_empty = line.strip() == ''
-         matches_empty = is_empty_line_pattern and line_is_empty
-         matches_other = not is_empty_line_pattern and pattern.search(line)
-
-         if matches_empty or matches_other:
-            if matches_other:
-                is_downloading = pattern.pattern.lower() == r'downloading'
-                is_decrypting = pattern.pattern.lower() == r'decrypting'
-                is_completion = (is_downloading and DOWNLOADED_PATTERN.search(line)) or \
-                                (is_decrypting and DECRYPTED_PATTERN.search(line))
-                if is_completion:
-                    continue 
-            filtered = True
-            break
-    if not filtered:
-        # 所有的 Go 输出都通过 logging.info 记录，它会自动使用 utils.setup_logging 配置的格式
-        logging.info(f"[Go输出][{uuid}] {line.rstrip()}")
-
-def read_stream(stream, output_list, uuid, song_id_context, update_callback, retry_event=None):
-    """从流中读取行，记录日志，解析状态更新行，并使用 song_id_context 调用回调。支持Go重试信号检测。"""
-    stream_name = "stdout" if hasattr(stream, 'fileno') and stream.fileno() == sys.stdout.fileno() else "stderr"
-    try:
-        for line in iter(stream.readline, ''):
-            output_list.append(line)
-
-            # 检查Go重试信号
-            if retry_event is not None and "Error detected, press Enter to try again..." in line:
-                logging.warning(f"[Go_UUID='{uuid}'] 检测到Go重试信号，准备自动回车重试")
-                retry_event.set()
-                break
-
-            # 检查是否是进度信息
-            progress_match = DOWNLOAD_PROGRESS_PATTERN.match(line.strip())
-            if progress_match:
-                current_bytes = int(progress_match.group(1))
-                total_bytes = int(progress_match.group(2))
-                if update_callback is not None and song_id_context is not None:
-                    update_data = {
-                        "download_progress": {
-                            "current": current_bytes,
-                            "total": total_bytes,
-                            "percent": round(current_bytes*100/total_bytes, 2)
-                        }
-                    }
-                    update_callback(uuid, song_id_context, update_data)
-                continue
-            if "正在更新状态" in line and "download_progress" in line:
-                continue
-            log_go_output_line(line, uuid)
-            can_update_status = update_callback is not None and song_id_context is not None
-            if not can_update_status:
-                continue
-            stripped_line = line.strip()
-            update_data = {}
-            if GO_CONNECT_ERROR_PATTERN.search(stripped_line):
-                update_data = {"connection_status": "failed"}
-            # 新增：检测特定歌词获取失败标记
-            elif stripped_line.startswith("SPECIFIC_LYRICS_FAILURE:"): 
-                if song_id_context: # 确保 song_id_context 有效
-                    update_data = {"lyrics_status": "failed", "connection_status": "success"} # 假设连接本身是成功的
-                else:
-                    logging.warning(f"任务 {uuid}: 检测到歌词获取失败，但 song_id_context 无效，无法更新状态。")
-            elif "connected" in stripped_line.lower():
-                update_data = {"connection_status": "success"}
-            elif quality_match := AUDIO_QUALITY_PATTERN.match(stripped_line):
-                try:
-                    bit_depth = int(quality_match.group(1))
-                    sample_rate = int(quality_match.group(2))
-                    update_data = {"bit_depth": bit_depth, "sample_rate": sample_rate, "connection_status": "success"}
-                except (ValueError, IndexError):
-                    logging.warning(f"任务 {uuid}, Song ID {song_id_context}: 解析质量失败: {stripped_line}")
-            elif DOWNLOADED_PATTERN.match(stripped_line):
-                update_data = {"download_status": "success" ,"connection_status": "success"}
-            elif DECRYPTED_PATTERN.match(stripped_line):
-                update_data = {"decryption_status": "success" ,"connection_status": "success"}
-            elif TRACK_EXISTS_PATTERN.match(stripped_line):
-                update_data = {"download_status": "exists", "decryption_status": "exists", "connection_status": "success"}
-            elif LYRICS_FAILURE_PATTERN.match(stripped_line):
-                logging.warning(f"任务 {uuid}, Song ID {song_id_context}: Go 报告获取歌词失败。")
-                pass
-            if update_data:
-                update_callback(uuid, song_id_context, update_data)
-    except ValueError as ve:
-        logging.warning(f"任务 {uuid}: 读取 {stream_name} 流时遇到值错误: {ve}")
-    except Exception as e:
-        logging.error(f"任务 {uuid}: 读取 {stream_name} 输出流时发生意外错误: {e}", exc_info=True)
-    finally:
-        try:
-            stream.close()
-        except Exception: pass
-
-
-# --- 新增：通知相关函数 ---
-
-# 任务类型映射
-TASK_TYPE_MAP = {
-    "album": "专辑",
-    "playlist": "播放列表",
-    "music-video": "MV",
-    # 可以根据需要添加更多类型
-}
-
-def get_task_display_info(task_data):
-    """从任务数据中提取显示名称和中文类型。"""
-    name = "未知名称"
-    type_key = "未知类型"
-    type_zh = "未知类型"
-
-    try:
-        metadata = task_data.get("metadata", {})
-        link_info = task_data.get("link_info", {})
-
-        if isinstance(metadata, dict):
-            name = metadata.get("name", name)
-
-        if isinstance(link_info, dict):
-            type_key = link_info.get("type", type_key)
-            type_zh = TASK_TYPE_MAP.get(type_key, f"类型({type_key})" if type_key != "未知类型" else "未知类型")
-
-    except Exception as e:
-        logging.warning(f"任务 {task_data.get('uuid', '未知UUID')}: 提取显示信息时出错: {e}")
-
-    return name, type_zh, type_key # 返回 key 用于可能的逻辑判断
-
-# --- 添加全局变量用于轮询算法 ---
-decrypt_port_counter = 0
-get_port_counter = 0
-port_counter_lock = threading.Lock()
-
-def get_next_decryptor_port(source_data_dict):
-    """从 source.yaml 中获取下一个解密器端口，实现轮询负载均衡"""
-    global decrypt_port_counter, get_port_counter
-    
-    decrypt_m3u8_port = source_data_dict.get('decrypt-m3u8-port', '')
-    get_m3u8_port = source_data_dict.get('get-m3u8-port', '')
-    
-    # 检查是否为列表格式
-    if isinstance(decrypt_m3u8_port, list) and decrypt_m3u8_port:
-        with port_counter_lock:
-            decrypt_port_counter = (decrypt_port_counter + 1) % len(decrypt_m3u8_port)
-            decrypt_m3u8_port = decrypt_m3u8_port[decrypt_port_counter]
-    
-    if isinstance(get_m3u8_port, list) and get_m3u8_port:
-        with port_counter_lock:
-            get_port_counter = (get_port_counter + 1) % len(get_m3u8_port)
-            get_m3u8_port = get_m3u8_port[get_port_counter]
-    
-    return decrypt_m3u8_port, get_m3u8_port
-
-def execute_single_track(task_data, track, user_notification_config, max_retries, retry_delay, go_main_bin_path):
-    """执行单个音轨的下载任务"""
-    uuid = task_data.get("uuid")
-    skip_check = task_data.get("skip_check", False)  # 获取 skip_check 参数，默认为 False
-    
-    # 构建基本命令
-    cmd = [go_main_bin_path, "--uuid", uuid, "--song-id", track["song_id"]]
-    
-    # 如果是校验任务，永远不使用 skip_check
-    if task_data.get("status") == "checking":
-        skip_check = False
-    
-    # 如果 skip_check 为 True，添加 --skip-check 参数
-    if skip_check:
-        cmd.append("--skip-check")
-    
-    # 添加其他必要的参数
-    if user_notification_config:
-        # 获取第一个可用的通知URL
-        bark_urls = user_notification_config.get("bark_urls", [])
-        if bark_urls and isinstance(bark_urls, list) and len(bark_urls) > 0:
-            cmd.extend(["--notify-url", bark_urls[0]])
-            if user_notification_config.get("token"):
-                cmd.extend(["--notify-token", user_notification_config["token"]])
-    
-    user = task_data.get("user", "未知用户")
-    track_number = track.get('track_number')
-    track_url = track.get('url')
-    track_name = track.get('name', f"音轨 {track_number}")
-    song_id = track.get('song_id')
-    disc_number = track.get('disc_number')
-    log_disc_info = f" (光盘 {disc_number})" if disc_number else ""
-    if not track_url:
-        log_msg = f"任务 {uuid}, 音轨 {track_number}{log_disc_info}" + (f" (Song ID {song_id})" if song_id else "") + ": 缺少URL信息。"
-        logging.error(log_msg)
-        return False, f"音轨 {track_number} 缺少URL信息", ""
-    log_prefix = f"任务 {uuid}, 音轨 {track_number}{log_disc_info}" + (f" (Song ID {song_id})" if song_id else " (无 Song ID)")
-    logging.info(f"{log_prefix}: 开始处理: {track_name}")
-    track_success = False
-    final_error_log = ""
-    final_error_reason = ""
-    is_check_task = (track_number == 0)
-    for attempt in range(max_retries + 1):
-        logging.info(f"{log_prefix}: 开始尝试 {attempt + 1}/{max_retries + 1}")
-        process = None
-        attempt_total_output = ""
-        source_yaml_template_string = None
-        # 校验任务不计入全局Go进程数
-        if not is_check_task:
-            global current_global_go_processes, max_global_go_processes, global_go_processes_condition
-            with global_go_processes_condition:
-                while current_global_go_processes >= max_global_go_processes:
-                    logging.info(f"全局 Go 进程数已达上限({max_global_go_processes})，等待空闲...")
-                    global_go_processes_condition.wait()
-                current_global_go_processes += 1
-        try:
-            source_path = file_paths.get('source')
-            source_lock = file_locks.get('source')
-            if not source_path or not source_lock:
-                msg = f"{log_prefix}: Source.yaml 路径或锁未配置。"
-                logging.error(msg)
-                final_error_reason = msg; final_error_log = msg
-                break
-            
-            # --- 新增：从 backend.py 获取 API Token ---
-            api_token_from_backend = None
-            try:
-                logging.info(f"{log_prefix}: 正在从 http://localhost:5000/token 获取 API Token。")
-                token_response = requests.get("http://localhost:5000/token", timeout=5)
-                token_response.raise_for_status()
-                token_data = token_response.json()
-                if token_data and "token" in token_data:
-                    api_token_from_backend = token_data["token"]
-                    logging.info(f"{log_prefix}: 成功获取 API Token。")
-                else:
-                    logging.warning(f"{log_prefix}: 获取 API Token 失败，响应中缺少 token 字段或数据无效。")
-            except requests.exceptions.RequestException as req_err:
-                logging.warning(f"{log_prefix}: 请求 /token 接口失败: {req_err}")
-            except Exception as e_token:
-                logging.warning(f"{log_prefix}: 获取 API Token 时发生未知错误: {e_token}")
-            # --- API Token 获取结束 ---
-
-            source_data_dict = read_yaml_with_lock(source_path, source_lock)
-            if isinstance(source_data_dict, dict):
-                # --- 新增：将获取到的 API Token 添加到 source_data_dict ---
-                if api_token_from_backend:
-                    source_data_dict["api_token"] = api_token_from_backend
-                    logging.debug(f"{log_prefix}: 已将 API Token 添加到传递给 Go 的配置中。")
-                else:
-                    logging.warning(f"{log_prefix}: 未能获取 API Token，Go 程序将尝试自行获取。")
-                # --- API Token 添加结束 ---
-                try:
-                    decrypt_m3u8_port, get_m3u8_port = get_next_decryptor_port(source_data_dict)
-                    source_data_dict['decrypt-m3u8-port'] = decrypt_m3u8_port
-                    source_data_dict['get-m3u8-port'] = get_m3u8_port
-                    logging.info(f"{log_prefix}: 使用解密器端口 {decrypt_m3u8_port}, 获取端口 {get_m3u8_port}")
-                    source_yaml_template_string = yaml.dump(source_data_dict, default_flow_style=False, allow_unicode=True)
-                except Exception as e:
-                    logging.error(f"{log_prefix}: source_data 转 YAML 失败: {e}")
-                    source_yaml_template_string = ""
-            else:
-                logging.warning(f"{log_prefix}: {source_path} 内容无效")
-                source_yaml_template_string = ""
-            if not source_yaml_template_string:
-                msg = f"{log_prefix}: 无法获取 source.yaml 内容。"
-                logging.error(msg)
-                final_error_reason = msg; final_error_log = msg
-                break
-            try:
-                yaml_input_string = source_yaml_template_string.replace("{user}", user)
-            except Exception as e:
-                logging.error(f"{log_prefix}: 替换 {{user}} 失败: {e}")
-                final_error_reason = "source.yaml 替换错误"; final_error_log = f"替换错误: {e}"
-                break
-            go_command = [go_main_bin_path, track_url]
-            if track_number != 0:
-                go_command.append("--song")
-            # 修改这里：只有在非校验任务且 skip_check 为 True 时才添加 --skip-check
-            if not is_check_task and skip_check:
-                go_command.append("--skip-check")
-            process_cwd = PROJECT_ROOT
-            logging.info(f"{log_prefix}: 准备执行: {' '.join(go_command)}")
-            process = subprocess.Popen(go_command, cwd=process_cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding='utf-8', errors='replace')
-            stdout_lines = []
-            stderr_lines = []
-            import threading
-            retry_event = threading.Event()
-            # 校验任务用特殊的stream处理
-            if is_check_task:
-                # 获取tracks列表
-                tracks = task_data.get('metadata', {}).get('tracks', [])
-                def check_read_stream(stream, output_list, uuid, update_callback, retry_event, tracks):
-                    logging.info(f"check_read_stream已启动，等待Go输出...")
-                    last_global_track_number = None
-                    for line in iter(stream.readline, ''):
-                        output_list.append(line)
-                        m = re.search(r'Track (\d+) of', line)
-                        if m:
-                            last_global_track_number = int(m.group(1))
-                            logging.info(f"检测到全局音轨号: {last_global_track_number}")
-                            continue
-                        logging.info(f"[Go校验输出] {line.strip()}")
-                        if last_global_track_number:
-                            # 通过全局音轨号查找对应的音轨
-                            current = 0
-                            target_track = None
-                            for track in sorted(tracks, key=lambda t: (t.get('disc_number', 1), t.get('track_number', 1))):
-                                current += 1
-                                if current == last_global_track_number:
-                                    target_track = track
-                                    break
-                            
-                            if target_track:
-                                song_id = target_track.get('song_id')
-                                if song_id:
-                                    if "Track already exists locally." in line:
-                                        logging.info(f"即将写入: uuid={uuid}, global_track_number={last_global_track_number}, check_success=True")
-                                        check_write_queue.put({'uuid': uuid, 'global_track_number': last_global_track_number, 'update_data': {'check_success': True}})
-                                        # 推送SSE更新
-                                        update_data = {
-                                            "check_success": True,
-                                            "download_progress": {
-                                                "current": 1,
-                                                "total": 1,
-                                                "percent": 100
-                                            }
-                                        }
-                                        update_track_progress_in_file(uuid, song_id, update_data)
-                                        continue
-                                    if any(x in line for x in ["Decrypted", "Downloaded", "connected"]):
-                                        logging.info(f"即将写入: uuid={uuid}, global_track_number={last_global_track_number}, check_success=True, 100%")
-                                        check_write_queue.put({'uuid': uuid, 'global_track_number': last_global_track_number, 'update_data': {
-                                            'check_success': True,
-                                            'download_progress': {
-                                                'current': 1,
-                                                'total': 1,
-                                                'percent': 100
-                                            }
-                                        }})
-                                        # 推送SSE更新
-                                        update_data = {
-                                            "check_success": True,
-                                            "download_progress": {
-                                                "current": 1,
-                                                "total": 1,
-                                                "percent": 100
-                                            }
-                                        }
-                                        update_track_progress_in_file(uuid, song_id, update_data)
-                                        continue
-                        if retry_event is not None and "Error detected, press Enter to try again..." in line:
-                            logging.warning(f"[Go_UUID='{uuid}'] 检测到Go重试信号，准备自动回车重试")
-                            retry_event.set()
-                            break
-                stdout_thread = threading.Thread(target=check_read_stream, args=(process.stdout, stdout_lines, uuid, update_track_progress_in_file, retry_event, tracks), name=f"stdout-{uuid[:8]}")
-            else:
-                stdout_thread = threading.Thread(target=read_stream, args=(process.stdout, stdout_lines, uuid, song_id, update_track_progress_in_file, retry_event), name=f"stdout-{uuid[:8]}")
-            stderr_thread = threading.Thread(target=read_stream, args=(process.stderr, stderr_lines, uuid, None, None), name=f"stderr-{uuid[:8]}")
-            stdout_thread.start()
-            stderr_thread.start()
-            try:
-                process.stdin.write(yaml_input_string)
-                process.stdin.close()  # 必须关闭stdin，否则Go进程会卡住
-            except (IOError, BrokenPipeError) as e:
-                logging.warning(f"{log_prefix}: 写入 stdin 错误: {e}")
-            except Exception as e:
-                logging.error(f"{log_prefix}: 写入 stdin 未知错误: {e}")
-            go_retry_triggered = False
-            while process.poll() is None:
-                if retry_event.is_set():
-                    logging.warning(f"{log_prefix}: 检测到Go重试信号，终止本次Go进程，计入一次Python重试")
-                    go_retry_triggered = True
-                    process.kill()
-                    break
-                process_check_write_queue()
-                time.sleep(0.1)
-            stdout_thread.join(timeout=20)
-            stderr_thread.join(timeout=20)
-            process_check_write_queue()
-            if stdout_thread.is_alive() or stderr_thread.is_alive():
-                logging.warning(f"{log_prefix}: 输出读取线程超时未结束。")
-            return_code = process.returncode
-            attempt_total_output = "".join(stdout_lines + stderr_lines)
-            if go_retry_triggered:
-                logging.info(f"{log_prefix}: 本次Go进程因重试信号被终止，进入下一次Python重试。")
-                if attempt < max_retries:
-                    logging.info(f"{log_prefix}: {retry_delay} 秒后重试。")
-                    time.sleep(retry_delay)
-                    continue
-                else:
-                    logging.error(f"{log_prefix}: 达到最大次数尝试，任务失败。")
-                    break
-            attempt_success, attempt_reason = analyze_go_output(return_code, attempt_total_output)
-            if attempt_success:
-                logging.info(f"{log_prefix}: 尝试 {attempt + 1} 成功。")
-                track_success = True
-                break
-            else:
-                logging.warning(f"{log_prefix}: 尝试 {attempt + 1} 失败。原因: {attempt_reason}")
-                final_error_log = attempt_total_output
-                final_error_reason = attempt_reason
-                if attempt < max_retries:
-                    logging.info(f"{log_prefix}: {retry_delay} 秒后重试。")
-                    time.sleep(retry_delay)
-                else:
-                    logging.error(f"{log_prefix}: 达到最大次数尝试，任务失败。")
-                    break
-        except Exception as e:
-            msg = f"{log_prefix}: 执行尝试 {attempt + 1} 时发生意外错误: {e}"
-            logging.error(msg, exc_info=True)
-            track_success = False
-            final_error_reason = f"意外错误: {e}"
-            final_error_log = msg + "\n" + traceback.format_exc()
-            if attempt < max_retries:
-                logging.info(f"{log_prefix}: 因意外错误，{retry_delay} 秒后重试。")
-                time.sleep(retry_delay)
-            else:
-                logging.error(f"{log_prefix}: 因意外错误达到最大次数，任务失败。")
-                break
-        finally:
-            if process:
-                try:
-                    process.kill()
-                except Exception:
-                    pass
-            if not is_check_task:
-                with global_go_processes_condition:
-                    current_global_go_processes -= 1
-                    global_go_processes_condition.notify_all()
-    return track_success, final_error_reason, final_error_log
-
-def execute_task(task_data, user_notification_config):
-    """通过运行 Go 二进制执行任务，并在完成后触发 Bark 和 Emby 通知。"""
-    uuid = task_data.get("uuid", "未知UUID")
-    user = task_data.get("user", "未知用户")
-    link = task_data.get("link", "未知链接")
-    threading.current_thread().name = f"任务-{uuid[:8]}"
-    logging.info(f"任务开始执行。UUID: {uuid}, 用户: {user}")
-
-    # 获取通知配置
-    emby_url = user_notification_config.get('emby_url')
-    # bark_urls 现在是一个对象列表，每个对象包含 server 和 click_url_template
-    bark_configs = user_notification_config.get('bark_urls', []) 
-    # bark_config = config_data.get('bark_notification', {}) # 不再需要全局 Bark 配置
-
-    # 构建完整的 Bark URLs - 这部分逻辑需要大改，因为现在每个 bark_config 都有自己的 click_url_template
-    # complete_bark_urls = [] # 不再构建这个列表，直接在发送时处理
-    # for base_url in bark_urls:
-    #     if base_url:
-    #         # 构建完整的 URL，包含路径、图标和跳转链接
-    #         complete_url = f"{base_url}{bark_config.get(\'path\', \'\')}?icon={bark_config.get(\'icon\', \'\')}&url={bark_config.get(\'url\', \'\')}"
-    #         complete_bark_urls.append(complete_url)
-
-    # 获取重试参数等 (保持不变)
-    max_retries = config_data.get('MAX_RETRIES', DEFAULT_MAX_RETRIES)
-    retry_delay = config_data.get('RETRY_DELAY', DEFAULT_RETRY_DELAY)
-    go_main_bin_path = file_paths.get('go_main_bin')
-    if not go_main_bin_path or not os.path.exists(go_main_bin_path) or not os.access(go_main_bin_path, os.X_OK):
-        msg = f"任务 {uuid}: Go 二进制文件路径无效或不可执行: {go_main_bin_path}"
-        logging.error(msg)
-        update_task_status_in_file(uuid, "error", msg, msg)
-        with running_set_lock:
-            if uuid in running_task_uuids:
-                running_task_uuids.remove(uuid)
-        return
-    # 检查任务类型
-    task_type = task_data.get('link_info', {}).get('type', '')
-    is_album_or_playlist = task_type in ['album', 'playlist']
-    
-    if is_album_or_playlist:
-        tracks = task_data.get('metadata', {}).get('tracks', [])
-        if not tracks:
-            msg = f"任务 {uuid}: 专辑/播放列表任务没有音轨信息。"
-            logging.error(msg)
-            update_task_status_in_file(uuid, "error", msg, msg)
-            with running_set_lock:
-                if uuid in running_task_uuids:
-                    running_task_uuids.remove(uuid)
-            return
-        
-        # --- 移除按全局音轨号排序的逻辑 --- #
-        # 可以选择按原始顺序或 disc/track 排序，如果需要的话
-        # 简单的按 track_number (和 disc_number) 排序
-        def get_sort_key(track):
-            if not isinstance(track, dict): return (999, 999) # 无效 track 排最后
-            disc = track.get('disc_number')
-            track_num = track.get('track_number')
-            # 处理 None 的情况，给一个默认大值
-            disc = disc if disc is not None else 999
-            track_num = track_num if track_num is not None else 999
-            return (disc, track_num)
-        try:
-            tracks.sort(key=get_sort_key)
-            logging.debug(f"任务 {uuid}: 音轨已按 disc/track number 排序。")
-        except Exception as sort_e:
-             logging.warning(f"任务 {uuid}: 按 disc/track number 排序时出错: {sort_e}，将按原始顺序处理。")
-        # --- 排序逻辑结束 --- #
-
-        # 获取最大并行任务数 (保持不变)
-        max_workers = config_data.get('MAX_PARALLEL_TASKS', 10)
-        
-        # 创建线程池 (保持不变)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # --- 提交所有音轨的下载任务 (传递 track 字典) --- #
-            future_to_track = {
-                executor.submit(
-                    execute_single_track,
-                    task_data, # 整个任务数据
-                    track,     # 单个音轨字典 (包含 song_id)
-                    user_notification_config,
-                    max_retries,
-                    retry_delay,
-                    go_main_bin_path
-                    # track_lookup_map 不再传递
-                ): track # value 仍然是 track 字典，用于日志
-                for track in tracks if isinstance(track, dict) # 确保 track 是字典
-            }
-            # --- 提交结束 --- #
-
-            # 收集结果 (保持不变)
-            success_count = 0
-            failure_count = 0
-            final_error_log = ""
-            final_error_reason = ""
-
-            for future in concurrent.futures.as_completed(future_to_track):
-                track = future_to_track[future]
-                log_track_num = track.get('track_number', '?')
-                log_song_id = track.get('song_id', 'N/A')
-                try:
-                    track_success, error_reason, error_log = future.result()
-                    if track_success:
-                        success_count += 1
-                    else:
-                        failure_count += 1
-                        # 记录第一个遇到的错误原因和日志
-                        if not final_error_reason and error_reason:
-                            final_error_reason = f"音轨 {log_track_num} (ID: {log_song_id}) 失败: {error_reason}"
-                        if not final_error_log and error_log:
-                            final_error_log = f"--- 音轨 {log_track_num} (ID: {log_song_id}) 错误日志 ---\n{error_log}"
-                except Exception as e:
-                    failure_count += 1
-                    err_msg = f"音轨 {log_track_num} (ID: {log_song_id}) 执行失败: {e}"
-                    logging.error(f"任务 {uuid}, {err_msg}", exc_info=True)
-                    if not final_error_reason:
-                         final_error_reason = err_msg
-                    if not final_error_log:
-                         final_error_log = traceback.format_exc()
-
-        # 根据结果更新任务状态 (修改：添加专辑校验步骤)
-        if failure_count == 0:
-            # 如果是专辑类型，执行校验步骤
-            if task_type == 'album':
-                # --- NEW: Check if all tracks exist locally ---
-                all_tracks_exist_locally = False # Default to false, proceed with check
-                task_queue_path_check = file_paths.get('task_queue')
-                task_queue_lock_obj_check = file_locks.get('task_queue')
-
-                if task_queue_path_check and task_queue_lock_obj_check:
-                    try:
-                        current_tasks_for_check = read_json_with_lock(task_queue_path_check, task_queue_lock_obj_check, default=None)
-                        if current_tasks_for_check and isinstance(current_tasks_for_check, list):
-                            current_task_data_for_check = next((t for t in current_tasks_for_check if t.get("uuid") == uuid), None)
-                            if current_task_data_for_check:
-                                album_tracks = current_task_data_for_check.get('metadata', {}).get('tracks', [])
-                                # Ensure album_tracks is a non-empty list of dicts
-                                if album_tracks and isinstance(album_tracks, list) and all(isinstance(track_item, dict) for track_item in album_tracks):
-                                    all_tracks_exist_locally = True # Assume true until a track doesn't meet criteria
-                                    for track_item in album_tracks:
-                                        if not (track_item.get('download_status') == 'exists' and \
-                                                track_item.get('decryption_status') == 'exists'):
-                                            all_tracks_exist_locally = False
-                                            logging.debug(f"任务 {uuid}: 音轨 {track_item.get('track_number', '未知')} (ID: {track_item.get('song_id', '未知')}) 不满足 'exists' 状态。专辑校验将执行。")
-                                            break
-                                    if all_tracks_exist_locally:
-                                        logging.info(f"任务 {uuid}: 所有音轨均已存在本地，将跳过专辑校验步骤。")
-                                else: # album_tracks is empty or not a list of dicts
-                                    logging.info(f"任务 {uuid}: 专辑元数据中无有效音轨信息或音轨列表为空，将执行专辑校验。")
-                                    all_tracks_exist_locally = False # Ensure check runs
-                            else:
-                                logging.warning(f"任务 {uuid}: 在队列中未找到任务数据，无法检查音轨状态以跳过校验。将执行专辑校验。")
-                        else:
-                            logging.warning(f"任务 {uuid}: 读取任务队列失败或格式无效，无法检查音轨状态以跳过校验。将执行专辑校验。")
-                    except Exception as e_read_q_check:
-                        logging.error(f"任务 {uuid}: 检查音轨状态以跳过校验时读取任务队列异常: {e_read_q_check}，将执行专辑校验。", exc_info=True)
-                else:
-                    logging.error(f"任务 {uuid}: 任务队列路径或锁未配置，无法检查音轨状态以跳过校验。将执行专辑校验。")
-                # --- END NEW CHECK ---
-
-                if all_tracks_exist_locally:
-                    logging.info(f"任务 {uuid}: 所有音轨已存在，标记任务完成。")
-                    process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-                    update_task_status_in_file(uuid, "finish", None, None, process_complete_time_iso, checking=False)
-                    if emby_url:
-                        send_emby_refresh(user, uuid)
-                    
-                    emby_album_id_for_bark = None
-                    if bark_configs:
-                        task_name_for_emby_query, _, _ = get_task_display_info(task_data)
-                        emby_url_for_query = user_notification_config.get('emby_url')
-                        emby_api_key_for_query = user_notification_config.get('emby_api_key')
-                        if emby_url_for_query and emby_api_key_for_query and task_name_for_emby_query:
-                            from notifications import query_emby_album_id
-                            emby_album_id_for_bark = query_emby_album_id(emby_url_for_query, emby_api_key_for_query, task_name_for_emby_query)
-                            if emby_album_id_for_bark:
-                                logging.info(f"任务 {uuid}: (全部已存在) 成功为 Bark 获取 Emby Album ID: {emby_album_id_for_bark}")
-                            else:
-                                logging.warning(f"任务 {uuid}: (全部已存在) 未能为 Bark 获取 Emby Album ID (专辑: {task_name_for_emby_query})")
-                        else:
-                            logging.warning(f"任务 {uuid}: (全部已存在) 无法为 Bark 查询 Emby Album ID，缺少 Emby URL/API Key/专辑名。")
-
-                    for bark_config_item in bark_configs:
-                        bark_server = bark_config_item.get('server')
-                        click_template = bark_config_item.get('click_url_template')
-                        if bark_server:
-                            send_bark_notification(bark_server, click_template, user, task_data, True, emby_album_id=emby_album_id_for_bark)
-                    # --- 新增：发送任务完成通知到前端 ---
-                    task_name, task_type_zh, _ = get_task_display_info(task_data)
-                    notice_data = {
-                        "event": "task_completed",
-                        "type": "success",
-                        "uuid": uuid,
-                        "user": user,
-                        "task_name": task_name,
-                        "task_type": task_type_zh,
-                        "message": f"专辑《{task_name}》下载完成",
-                        "timestamp": process_complete_time_iso
-                    }
-                    send_notice_to_clients(notice_data)
-                else:
-                    # Original logic: proceed with album check
-                    logging.info(f"任务 {uuid}: 所有音轨下载完成，但并非所有音轨都已存在本地 (或无法确认)，开始执行专辑校验...")
-                    # 标记校验开始
-                    update_task_status_in_file(uuid, "running", checking=True)
-                    # 创建一个简化的 track 字典用于校验
-                    album_check_track = {
-                        "track_number": 0,  # 使用0表示这是专辑校验
-                        "url": link,
-                        "name": task_data.get('metadata', {}).get('name', "专辑校验"),
-                        "song_id": None
-                    }
-                    # 执行校验
-                    check_success, check_reason, check_log = execute_single_track(
-                        task_data,
-                        album_check_track,
-                        user_notification_config,
-                        max_retries,
-                        retry_delay,
-                        go_main_bin_path
-                    )
-                    # 校验结束，移除checking
-                    update_task_status_in_file(uuid, "running", checking=False)
-                    if check_success:
-                        logging.info(f"任务 {uuid}: 专辑校验成功，任务完成。")
-                        process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-                        update_task_status_in_file(uuid, "finish", None, None, process_complete_time_iso, checking=False)
-                        if emby_url:
-                            send_emby_refresh(user, uuid)
-                        
-                        # --- 在发送 Bark 通知前获取 Emby Album ID ---
-                        emby_album_id_for_bark = None
-                        if bark_configs:
-                            task_name_for_emby_query, _, _ = get_task_display_info(task_data) # 获取任务名
-                            emby_url_for_query = user_notification_config.get('emby_url')
-                            emby_api_key_for_query = user_notification_config.get('emby_api_key')
-                            if emby_url_for_query and emby_api_key_for_query and task_name_for_emby_query:
-                                logging.info(f"任务 {uuid}: 尝试为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query})...")
-                                # 需要从 notifications.py 导入 query_emby_album_id
-                                # (确保此函数在 notifications.py 中是可导入的)
-                                from notifications import query_emby_album_id 
-                                emby_album_id_for_bark = query_emby_album_id(emby_url_for_query, emby_api_key_for_query, task_name_for_emby_query)
-                                if emby_album_id_for_bark:
-                                    logging.info(f"任务 {uuid}: 成功获取 Emby Album ID for Bark: {emby_album_id_for_bark}")
-                                else:
-                                    logging.warning(f"任务 {uuid}: 未能为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query}).")
-                            else:
-                                logging.warning(f"任务 {uuid}: 无法为 Bark 通知查询 Emby Album ID，缺少 Emby URL, API Key 或专辑名。")
-                        else:
-                            logging.warning(f"任务 {uuid}: 无法为 Bark 通知查询 Emby Album ID，缺少 Emby URL, API Key 或专辑名。")
-
-                        # 发送到所有配置的 Bark URLs
-                        for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                            bark_server = bark_config_item.get('server')
-                            click_template = bark_config_item.get('click_url_template')
-                            if bark_server:
-                                send_bark_notification(bark_server, click_template, user, task_data, True, emby_album_id=emby_album_id_for_bark) # <--- 传递 emby_album_id
-                        
-                        # --- 新增：发送任务完成通知到前端 ---
-                        task_name, task_type_zh, _ = get_task_display_info(task_data)
-                        notice_data = {
-                            "event": "task_completed",
-                            "type": "success",
-                            "uuid": uuid,
-                            "user": user,
-                            "task_name": task_name,
-                            "task_type": task_type_zh,
-                            "message": f"专辑《{task_name}》下载完成",
-                            "timestamp": process_complete_time_iso
-                        }
-                        send_notice_to_clients(notice_data)
-                    else:
-                        logging.error(f"任务 {uuid}: 专辑校验失败。原因: {check_reason}")
-                        process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-                        error_msg = f"专辑校验失败: {check_reason}"
-                        update_task_status_in_file(uuid, "error", error_msg, check_log, process_complete_time_iso, checking=False)
-                        if emby_url:
-                            send_emby_refresh(user, uuid)
-                        # 发送到所有配置的 Bark URLs
-                        for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                            bark_server = bark_config_item.get('server')
-                            click_template = bark_config_item.get('click_url_template')
-                            if bark_server:
-                                send_bark_notification(bark_server, click_template, user, task_data, False)
-                        # --- 新增：发送任务失败通知到前端 ---
-                        task_name, task_type_zh, _ = get_task_display_info(task_data)
-                        notice_data = {
-                            "event": "task_completed",
-                            "type": "error",
-                            "uuid": uuid,
-                            "user": user,
-                            "task_name": task_name,
-                            "task_type": task_type_zh,
-                            "message": f"专辑《{task_name}》下载失败: {error_msg}",
-                            "timestamp": process_complete_time_iso
-                        }
-                        send_notice_to_clients(notice_data)
-            else:
-                # 播放列表直接完成
-                process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-                update_task_status_in_file(uuid, "finish", None, None, process_complete_time_iso)
-                if emby_url:
-                    send_emby_refresh(user, uuid)
-                
-                # --- 在发送 Bark 通知前获取 Emby Album ID (同上) ---
-                emby_album_id_for_bark_playlist = None
-                if bark_configs: # 仅当是专辑类型时才尝试获取，播放列表通常不直接对应单个Emby专辑ID
-                    task_name_for_emby_query_pl, _, _ = get_task_display_info(task_data)
-                    emby_url_for_query_pl = user_notification_config.get('emby_url')
-                    emby_api_key_for_query_pl = user_notification_config.get('emby_api_key')
-                    if emby_url_for_query_pl and emby_api_key_for_query_pl and task_name_for_emby_query_pl:
-                        logging.info(f"任务 {uuid}: (播放列表场景下，如果包含专辑) 尝试为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query_pl})...")
-                        from notifications import query_emby_album_id
-                        emby_album_id_for_bark_playlist = query_emby_album_id(emby_url_for_query_pl, emby_api_key_for_query_pl, task_name_for_emby_query_pl)
-                        if emby_album_id_for_bark_playlist:
-                            logging.info(f"任务 {uuid}: (播放列表场景) 成功获取 Emby Album ID for Bark: {emby_album_id_for_bark_playlist}")
-                        else:
-                            logging.warning(f"任务 {uuid}: (播放列表场景) 未能为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query_pl}).")
-                    else:
-                        logging.warning(f"任务 {uuid}: (播放列表场景) 无法为 Bark 通知查询 Emby Album ID，缺少 Emby URL, API Key 或专辑名。")
-                # --- 获取结束 ---
-
-                # 发送到所有配置的 Bark URLs
-                for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                    bark_server = bark_config_item.get('server')
-                    click_template = bark_config_item.get('click_url_template')
-                    if bark_server:
-                        # 播放列表任务成功时，如果之前获取了album_id (理论上仅针对专辑内单曲)，则传递，否则不传
-                        send_bark_notification(bark_server, click_template, user, task_data, True, emby_album_id=emby_album_id_for_bark_playlist if task_type == 'album' else None)
-                # --- 新增：发送任务完成通知到前端 ---
-                task_name, task_type_zh, _ = get_task_display_info(task_data)
-                notice_data = {
-                    "event": "task_completed",
-                    "type": "success",
-                    "uuid": uuid,
-                    "user": user,
-                    "task_name": task_name,
-                    "task_type": task_type_zh,
-                    "message": f"播放列表《{task_name}》下载完成",
-                    "timestamp": process_complete_time_iso
-                }
-                send_notice_to_clients(notice_data)
-        else:
-            process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-            error_msg = f"任务失败: {failure_count} 个音轨下载失败。首个错误: {final_error_reason}"
-            update_task_status_in_file(uuid, "error", error_msg, final_error_log, process_complete_time_iso)
-            if emby_url:
-                send_emby_refresh(user, uuid)
-            
-            # --- 失败情况下也尝试获取 Album ID (如果配置了Bark) ---
-            emby_album_id_for_bark_fail = None
-            if task_type == 'album' and bark_configs: # 仅专辑类型
-                task_name_for_emby_query_fail, _, _ = get_task_display_info(task_data)
-                emby_url_for_query_fail = user_notification_config.get('emby_url')
-                emby_api_key_for_query_fail = user_notification_config.get('emby_api_key')
-                if emby_url_for_query_fail and emby_api_key_for_query_fail and task_name_for_emby_query_fail:
-                    logging.info(f"任务 {uuid}: (失败情况) 尝试为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query_fail})...")
-                    from notifications import query_emby_album_id
-                    emby_album_id_for_bark_fail = query_emby_album_id(emby_url_for_query_fail, emby_api_key_for_query_fail, task_name_for_emby_query_fail)
-                    if emby_album_id_for_bark_fail:
-                        logging.info(f"任务 {uuid}: (失败情况) 成功获取 Emby Album ID for Bark: {emby_album_id_for_bark_fail}")
-                    else:
-                        logging.warning(f"任务 {uuid}: (失败情况) 未能为 Bark 通知获取 Emby Album ID (专辑: {task_name_for_emby_query_fail}).")
-                else:
-                    logging.warning(f"任务 {uuid}: (失败情况) 无法为 Bark 通知查询 Emby Album ID，缺少 Emby URL, API Key 或专辑名。")
-            # --- 获取结束 ---
-
-            # 发送到所有配置的 Bark URLs
-            for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                bark_server = bark_config_item.get('server')
-                click_template = bark_config_item.get('click_url_template')
-                if bark_server:
-                    send_bark_notification(bark_server, click_template, user, task_data, False, emby_album_id=emby_album_id_for_bark_fail) # <--- 传递 emby_album_id
-            # --- 新增：发送任务失败通知到前端 ---
-            task_name, task_type_zh, _ = get_task_display_info(task_data)
-            notice_data = {
-                "event": "task_completed",
-                "type": "error",
-                "uuid": uuid,
-                "user": user,
-                "task_name": task_name,
-                "task_type": task_type_zh,
-                "message": f"任务《{task_name}》下载失败: {error_msg}",
-                "timestamp": process_complete_time_iso
-            }
-            send_notice_to_clients(notice_data)
-    
-    else:
-        # 处理单个音轨/MV的情况
-        # --- 创建一个简化的 track 字典，不包含 song_id --- #
-        # 因为对于非专辑/播放列表，我们不期望有 song_id 或进行精细状态更新
-        single_item_track_dict = {
-            "track_number": 1, # 虚拟音轨号
-            "url": link,
-            "name": task_data.get('metadata', {}).get('name', "单项任务"), # 尝试用元数据名
-            "song_id": None # 明确标记无 song_id
-        }
-        track_success, error_reason, error_log = execute_single_track(
-            task_data,
-            single_item_track_dict, # 传递简化字典
-            user_notification_config,
-            max_retries,
-            retry_delay,
-            go_main_bin_path
-        )
-        # --- 修改结束 --- #
-
-        # 更新整体任务状态 (逻辑不变)
-        if track_success:
-            process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-            update_task_status_in_file(uuid, "finish", None, None, process_complete_time_iso)
-            if emby_url:
-                send_emby_refresh(user, uuid)
-            # 发送到所有配置的 Bark URLs
-            for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                bark_server = bark_config_item.get('server')
-                click_template = bark_config_item.get('click_url_template')
-                if bark_server:
-                    send_bark_notification(bark_server, click_template, user, task_data, True)
-            # --- 新增：发送任务完成通知到前端 ---
-            task_name, task_type_zh, _ = get_task_display_info(task_data)
-            notice_data = {
-                "event": "task_completed",
-                "type": "success",
-                "uuid": uuid,
-                "user": user,
-                "task_name": task_name,
-                "task_type": task_type_zh,
-                "message": f"任务《{task_name}》下载完成",
-                "timestamp": process_complete_time_iso
-            }
-            send_notice_to_clients(notice_data)
-        else:
-            process_complete_time_iso = datetime.now(timezone.utc).isoformat()
-            update_task_status_in_file(uuid, "error", error_reason, error_log, process_complete_time_iso)
-            if emby_url:
-                send_emby_refresh(user, uuid)
-            # 发送到所有配置的 Bark URLs
-            for bark_config_item in bark_configs: # <--- 迭代新的 bark_configs
-                bark_server = bark_config_item.get('server')
-                click_template = bark_config_item.get('click_url_template')
-                if bark_server:
-                    send_bark_notification(bark_server, click_template, user, task_data, False)
-            # --- 新增：发送任务失败通知到前端 ---
-            task_name, task_type_zh, _ = get_task_display_info(task_data)
-            notice_data = {
-                "event": "task_completed",
-                "type": "error",
-                "uuid": uuid,
-                "user": user,
-                "task_name": task_name,
-                "task_type": task_type_zh,
-                "message": f"任务《{task_name}》下载失败: {error_reason}",
-                "timestamp": process_complete_time_iso
-            }
-            send_notice_to_clients(notice_data)
-    
-    # 清理运行集合 (保持不变)
-    with running_set_lock:
-        if uuid in running_task_uuids:
-            running_task_uuids.remove(uuid)
-
-
-# --- 加载配置和文件路径 ---
-def load_config_and_paths():
-    """加载配置(config/users)，路径，锁，日志，检查 users.yaml。"""
-    global config_data, users_data, file_paths, file_locks
-    global max_global_go_processes
-
-    # 1. 读取 config.yaml (使用 utils 函数)
-    config_path = os.path.join(PROJECT_ROOT, "config", "config.yaml")
-    config_lock_obj = filelock.FileLock(f"{config_path}.lock")
-    config_data_local = read_yaml_with_lock(config_path, config_lock_obj)
-
-    # 检查 config.yaml 是否成功读取且是字典
-    if not isinstance(config_data_local, dict) or not config_data_local:
-        # read_yaml_with_lock 内部会记录错误，这里直接退出
-        logging.critical(f"无法加载有效的配置文件: {config_path}。请检查文件是否存在、格式是否正确以及 utils.py 中的错误日志。")
-        sys.exit(1)
-
-    config_data.update(config_data_local)
-    # --- 调用 utils.setup_logging --- #
-    # 需要在任何 logging 调用之前，并且在 config_data 加载之后
-    setup_logging(config_data, script_chinese_name="任务调度器")
-
-    # 现在可以安全地使用 logging 了
-    logging.info(f"成功加载配置文件: {config_path}")
-
-    max_global_go_processes = config_data.get('MAX_GLOBAL_GO_PROCESSES', 10)
-    logging.info(f"全局最大 Go 进程数限制: {max_global_go_processes}")
-
-    # --- 移除旧的日志级别更新逻辑，因为 setup_logging 已处理 ---
-    # log_level_str = config_data.get("LOG_LEVEL", "INFO").upper()
-    # ... (相关的 logger.setLevel 和 handler.setLevel 调用已移除)
-
-    # 2. 确定文件路径 (使用 utils 函数)
-    loaded_paths_config = config_data.get('PATHS', {})
-    # 使用 utils 解析路径
-    resolved_file_paths = resolve_paths(PROJECT_ROOT, loaded_paths_config, DEFAULT_PATHS_RELATIVE_TO_ROOT)
+    # 2. 确定文件路径 (使用 utils 函数)
+    loaded_paths_config = config_data.get('PATHS', {})
+    # 使用 utils 解析路径
+    resolved_file_paths = resolve_paths(PROJECT_ROOT, loaded_paths_config, DEFAULT_PATHS_RELATIVE_TO_ROOT)
 
     # --- 动态计算 Go 二进制路径 --- #
     go_bin_parent_dir = os.path.join(PROJECT_ROOT, 'bin') # 假设在 bin 目录下
@@ -2646,6 +1942,80 @@ def load_config_and_paths():
                 sys.exit(1)
     file_locks.update(locks_to_create)
 
+    # 3.1 创建任务存储 (json / sqlite，见 config.yaml 的 task_store 配置)
+    global task_store
+    try:
+        task_store = create_task_store(config_data, file_paths.get('task_queue'), file_locks.get('task_queue'))
+        logging.info(f"任务存储后端: {task_store.name}")
+    except Exception as e:
+        logging.critical(f"初始化任务存储失败: {e}", exc_info=True)
+        sys.exit(1)
+    change_feed_socket = resolve_socket_path(config_data)
+    if change_feed_socket:
+        task_store.set_publisher(ChangeFeedPublisher(change_feed_socket))  # 提交后通知 backend.py 唤醒长轮询
+        logging.info(f"任务队列变更将发布到: {change_feed_socket}")
+
+    # 3.2 任务队列单写入线程：所有变更经此线程成批提交
+    global task_writer
+    writer_config = config_data.get('task_writer', {}) or {}
+    task_writer = TaskQueueWriter(
+        task_store,
+        max_batch=writer_config.get('max_batch', DEFAULT_WRITER_MAX_BATCH),
+        linger_seconds=writer_config.get('linger_ms', 0) / 1000.0
+    )
+    logging.info(f"任务队列写入线程已启动 (单批最多 {task_writer.max_batch} 条变更)。")
+
+    # 3.3 下载进度合并写入
+    global progress_coalescer
+    progress_config = config_data.get('progress_persist', {}) or {}
+    if progress_config.get('enabled', True):
+        progress_interval = progress_config.get('interval_seconds', DEFAULT_PROGRESS_PERSIST_INTERVAL)
+        progress_coalescer = ProgressCoalescer(_persist_track_update, progress_interval)
+        logging.info(f"下载进度合并写入已启用，写入间隔 {progress_interval} 秒。")
+    else:
+        logging.info("下载进度合并写入已禁用，每条进度将立即写入。")
+
+    # 3.4 任务历史存储 (替代 errors.json 归档，首次启动导入旧归档)
+    global history_store
+    try:
+        history_store = create_history_store(config_data)
+        history_store.import_json_archive(file_paths.get('errors'), file_locks.get('errors'))
+    except Exception as e:
+        logging.error(f"初始化任务历史存储失败: {e}，已完成任务将不会归档。", exc_info=True)
+        history_store = None
+
+    # 3.5 已完成任务退役：完成后经过宽限期即归档并移出队列 (依赖历史存储)
+    global task_retirer
+    retirement_config = config_data.get('task_retirement', {}) or {}
+    if retirement_config.get('enabled', True) and history_store is not None:
+        task_retirer = TaskRetirer(retirement_config.get('grace_seconds', DEFAULT_RETIREMENT_GRACE_SECONDS))
+        logging.info(f"已完成任务退役已启用，宽限期 {task_retirer.grace_seconds} 秒。")
+    else:
+        logging.info("已完成任务退役未启用，已完成任务将在队列空闲时清理。")
+
+    # 3.6 常驻 Go worker：复用 Go 进程执行音轨，二进制不支持 --worker 时自动回退
+    global go_worker_pool
+    if go_worker_pool is None:
+        go_worker_pool = create_go_worker_pool(config_data, file_paths['go_main_bin'], PROJECT_ROOT, track_pool.workers)
+
+    # 3.7 解密器端点均衡 (在途最少 + 健康评分 + 熔断)
+    global decryptor_balancer
+    decryptor_balancer = create_decryptor_balancer(config_data)
+
+    # 3.75 按失败类别的重试策略 (退避、刷新 token、更换解密器端点、不可重试时立即放弃)
+    global retry_policy
+    retry_policy = create_retry_policy(config_data, config_data.get('MAX_RETRIES', DEFAULT_MAX_RETRIES), config_data.get('RETRY_DELAY', DEFAULT_RETRY_DELAY))
+
+    # 3.8 source.yaml 解析与渲染缓存 (传给 Go 的配置按用户、端口、token 版本和文件 mtime 复用)
+    global source_renderer
+    if file_paths.get('source') and file_locks.get('source'):
+        source_renderer = SourceConfigRenderer(file_paths['source'], file_locks['source'], token_client)
+
+    # 3.9 本地音乐库索引 (派发前跳过已存在的音轨；按 source.yaml 的保存目录增量扫描)
+    global library_index
+    if library_index is None and source_renderer is not None:
+        library_index = create_library_index(config_data, source_renderer.load_source)
+
     # 4. 读取 users.yaml (使用 utils 函数)
     users_path = file_paths.get('users')
     users_lock_obj = file_locks.get('users')
@@ -2685,53 +2055,427 @@ def load_config_and_paths():
     # --- 旧的 FileHandler 配置代码段已被移除 (correct_file_handler_exists 等) ---
 
 
-# --- 主调度循环 (修改) ---
-def main_scheduler_loop():
-    """主循环，调度任务，并在队列空闲时发送邮件汇总。"""
-    threading.current_thread().name = "队列处理器"
-    logging.info("任务调度器主循环启动。")
+# --- 调度器唤醒 (事件驱动) ---
+scheduler_wakeup = threading.Event()
 
-    max_parallel = config_data.get('MAX_PARALLEL', DEFAULT_MAX_PARALLEL)
-    # 使用新的长轮询间隔，并提供默认值
-    long_poll_interval = config_data.get('SCHEDULER_LONG_POLL_INTERVAL', DEFAULT_SCHEDULER_LONG_POLL_INTERVAL)
-    fast_poll_interval = config_data.get('SCHEDULER_FAST_POLL_INTERVAL', 3)  # 默认3秒
-    signal_port = config_data.get('SCHEDULER_SIGNAL_PORT', DEFAULT_SCHEDULER_SIGNAL_PORT)
-    task_queue_path = file_paths.get('task_queue')
-    task_queue_lock_obj = file_locks.get('task_queue')
-    errors_path = file_paths.get('errors')
-    errors_lock_obj = file_locks.get('errors')
 
-    # 初始化轮询间隔
-    global current_poll_interval, fast_poll_mode
-    with poll_interval_lock:
-        current_poll_interval = long_poll_interval
-        fast_poll_mode = False
+def wake_scheduler():
+    """唤醒主调度循环：后端提交 (UDP 信号)、任务完成或被移出运行集合时调用。"""
+    scheduler_wakeup.set()
 
-    logging.info(f"调度器配置: 最大并行={max_parallel}, 长轮询间隔={long_poll_interval}s, 快速轮询间隔={fast_poll_interval}s, 信号端口={signal_port}")
-    logging.info(f"监控任务队列: {task_queue_path}")
 
-    # --- 设置 UDP 监听套接字 ---
-    udp_socket = None
+def release_running_task(uuid):
+    """从运行集合移除任务并唤醒调度器，使空出的并行槽位立即被填补。"""
+    with running_set_lock:
+        running_task_uuids.discard(uuid)
+        running_task_users.pop(uuid, None)
+        running_task_lanes.pop(uuid, None)
+    wake_scheduler()
+
+
+def start_signal_listener(signal_port):
+    """在后台线程中监听后端的 UDP 唤醒信号，收到后唤醒调度器。绑定失败时返回 False。"""
     try:
         udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # 允许端口重用，以防上次未正常关闭
         udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         udp_socket.bind(("localhost", signal_port))
-        udp_socket.setblocking(False) # 设置为非阻塞
-        logging.info(f"已在 localhost:{signal_port} 启动 UDP 信号监听。")
     except OSError as e:
         logging.critical(f"无法绑定 UDP 监听端口 localhost:{signal_port}。错误: {e}。请检查端口是否被占用或权限问题。调度器将无法接收即时唤醒信号。")
-        # 不退出，但记录严重错误，调度器将仅依赖长轮询
-    except Exception as e:
-        logging.error(f"设置 UDP 监听时发生未知错误: {e}", exc_info=True)
-        # 同样不退出
+        return False
+
+    def listen():
+        while True:
+            try:
+                udp_socket.recvfrom(1024)  # 内容无关紧要
+                logging.debug("收到 UDP 信号，唤醒调度器。")
+                wake_scheduler()
+            except OSError as e:
+                logging.error(f"UDP 信号监听出错，停止监听: {e}")
+                return
+
+    threading.Thread(target=listen, name="调度唤醒信号", daemon=True).start()
+    logging.info(f"已在 localhost:{signal_port} 启动 UDP 信号监听。")
+    return True
+
+
+class QueueSnapshot:
+    """调度器持有的任务队列快照：存储的版本号与签名未变化时复用内存中的列表，不重复读取和解析。"""
+
+    def __init__(self, store):
+        self.store = store
+        self.signature = None
+        self.tasks = None
+
+    def load(self):
+        signature = self.store.data_signature()  # 先取签名再读取，期间的变更会在下次唤醒时重新读取
+        if self.tasks is not None and signature == self.signature:
+            return self.tasks
+        tasks = self.store.load_tasks()
+        if isinstance(tasks, list):
+            self.signature, self.tasks = signature, tasks
+        return tasks
+
+
+# --- 任务优先级与短作业通道 ---
+def estimate_job_size(task):
+    """以音轨数估计任务大小 (metadata.trackCount，缺失时用 tracks 数量；MV 计为 1)。"""
+    metadata = task.get("metadata") if isinstance(task.get("metadata"), dict) else {}
+    track_count = metadata.get("trackCount")
+    if not isinstance(track_count, int) or track_count <= 0:
+        tracks = metadata.get("tracks")
+        track_count = len(tracks) if isinstance(tracks, list) and tracks else 1
+    return track_count
+
+
+def task_scheduling_class(task):
+    """high 优先级或短作业为 interactive，其余 (含 low 优先级) 为 batch。"""
+    priority = task.get("priority", DEFAULT_TASK_PRIORITY)
+    if priority == "high":
+        return "interactive"
+    if priority == "low":
+        return "batch"
+    return "interactive" if estimate_job_size(task) <= scheduling_config["small_job_max_tracks"] else "batch"
+
+
+def task_wait_seconds(task, now=None):
+    """任务自提交以来的等待时间 (秒)，提交时间无法解析时返回 0。"""
+    try:
+        submitted = datetime.fromisoformat(task.get("submit_time")).timestamp()
+    except (TypeError, ValueError):
+        return 0
+    return max(0.0, (now or time.time()) - submitted)
+
+
+def sjf_sort_key(task, now):
+    """同一用户内的启动顺序：优先级 > 老化后的任务大小 (短作业优先，等待越久有效大小越小，避免大任务饿死) > 提交顺序。"""
+    aged_size = estimate_job_size(task) / (1 + task_wait_seconds(task, now) / scheduling_config["aging_seconds"])
+    return (TASK_PRIORITIES.index(task.get("priority", DEFAULT_TASK_PRIORITY)) if task.get("priority") in TASK_PRIORITIES else 1,
+            aged_size, task.get("submit_time") or "", task.get("order_index", 0))
+
+
+class QueueWaitStats:
+    """按调度类别 (interactive / batch) 统计任务从提交到开始执行的等待时间。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, scheduling_class, wait_seconds):
+        with self.lock:
+            histogram = self.histograms.get(scheduling_class)
+            if histogram is None:
+                histogram = self.histograms[scheduling_class] = Histogram(QUEUE_WAIT_BUCKETS_SECONDS)
+            histogram.observe(wait_seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {scheduling_class: histogram.snapshot() for scheduling_class, histogram in self.histograms.items()}
+
+
+queue_wait_stats = QueueWaitStats()
+
+
+def select_fair_share(ready_tasks, free_slots, running_by_user):
+    """按用户公平份额 (DRR，权重与 max_concurrent_tasks 来自 users.yaml) 从 ready 任务中选出最多 free_slots 个。
+    同一用户的任务按 sjf_sort_key 排序。"""
+    now = time.time()
+    queues = {}
+    for task in sorted(ready_tasks, key=lambda t: sjf_sort_key(t, now)):
+        queues.setdefault(task.get("user"), deque()).append(task)
+    running_by_user = dict(running_by_user)
+    selected = []
+    while len(selected) < free_slots:
+        candidates = set()
+        for task_user, queue_for_user in queues.items():
+            limit = user_limit(users_data, task_user, "max_concurrent_tasks")
+            if queue_for_user and (limit is None or running_by_user.get(task_user, 0) < limit):
+                candidates.add(task_user)
+        task_user = task_dispatch_drr.next_user(candidates)
+        if task_user is None:
+            break
+        selected.append(queues[task_user].popleft())
+        running_by_user[task_user] = running_by_user.get(task_user, 0) + 1
+    return selected
+
+
+def dispatch_ready_tasks(ready_tasks, max_parallel):
+    """一次性启动所有可运行的任务：先全部提交 running 状态再统一等待 (写入线程合并为一次提交)，再启动执行线程。
+
+    普通槽位 (MAX_PARALLEL) 用尽后，interactive 类任务还可使用 scheduling.express_slots 个快速通道槽位。
+    """
+    with running_set_lock:
+        running_uuids = set(running_task_uuids)
+        running_by_user = {}
+        for task_user in running_task_users.values():
+            running_by_user[task_user] = running_by_user.get(task_user, 0) + 1
+        express_running = sum(1 for lane in running_task_lanes.values() if lane == "express")
+    free_slots = max_parallel - (len(running_uuids) - express_running)
+    free_express_slots = scheduling_config["express_slots"] - express_running
+    startable = []
+    for task in ready_tasks:
+        task_uuid = task.get("uuid")
+        if task_uuid in running_uuids:
+            logging.warning(f"任务 {task_uuid}: 文件状态 'ready' 但内存记录运行中。尝试修正文件状态为 'running'。")
+            update_task_status_in_file(task_uuid, "running")
+            continue
+        if not task.get("user"):
+            logging.error(f"任务 {task_uuid} 状态为 'ready' 但缺少 'user' 字段，无法启动。标记为错误。")
+            update_task_status_in_file(task_uuid, "error", "任务缺少 user 字段", "")
+            continue
+        startable.append(task)
+    to_start = []  # [(任务, 通道)]
+    if free_slots > 0:
+        to_start = [(task, "normal") for task in select_fair_share(startable, free_slots, running_by_user)]
+    if free_express_slots > 0:
+        chosen = {task.get("uuid") for task, _ in to_start}
+        for task, _ in to_start:
+            running_by_user[task.get("user")] = running_by_user.get(task.get("user"), 0) + 1
+        interactive = [task for task in startable if task.get("uuid") not in chosen and task_scheduling_class(task) == "interactive"]
+        to_start += [(task, "express") for task in select_fair_share(interactive, free_express_slots, running_by_user)]
+    to_start = [(task.copy(), lane) for task, lane in to_start]
+    if not to_start:
+        if ready_tasks and free_slots <= 0:
+            logging.debug(f"无法启动新任务，已达最大并行数 ({len(running_uuids)}/{max_parallel})。")
+        return 0
+
+    process_start_time_iso = datetime.now(timezone.utc).isoformat()
+    pendings = [
+        task_writer.submit(build_status_op(task.get("uuid"), "running", process_start_time_iso=process_start_time_iso), site="dispatch_ready_tasks")
+        for task, _ in to_start
+    ]
+    started = 0
+    now = time.time()
+    for (task_to_run, lane), pending in zip(to_start, pendings):
+        task_uuid = task_to_run.get("uuid")
+        if not pending.wait(DEFAULT_WRITE_WAIT_TIMEOUT):
+            logging.warning(f"任务 {task_uuid}: 更新状态 'running' 未写入任务存储，本次不启动。")
+            continue
+        task_user = task_to_run.get("user")
+
+        # --- 获取用户通知配置 ---
+        user_config_from_yaml = users_data.get(task_user, {})
+        if not user_config_from_yaml:
+             logging.warning(f"任务 {task_uuid}: 在 users.yaml 中未找到用户 '{task_user}' 的配置，将无法发送通知。")
+
+        # 准备传递给线程的配置
+        user_notification_config_for_thread = {
+            'emby_url': user_config_from_yaml.get('emby_url'),
+            'emby_api_key': user_config_from_yaml.get('emby_api_key'),
+            'bark_urls': user_config_from_yaml.get('bark_urls', [])  # 获取 Bark URLs 列表
+            # 注意：邮箱地址不需要传递给 execute_task
+        }
+
+        with running_set_lock:
+            running_task_uuids.add(task_uuid)
+            running_task_users[task_uuid] = task_user
+            running_task_lanes[task_uuid] = lane
+        scheduling_class = task_scheduling_class(task_to_run)
+        queue_wait_stats.observe(scheduling_class, task_wait_seconds(task_to_run, now))
+
+        logging.info(f"任务 {task_uuid} (用户: {task_user}, {scheduling_class}, 音轨数 {estimate_job_size(task_to_run)}"
+                     f"{', 快速通道' if lane == 'express' else ''}): 文件状态更新为 'running'。提交音轨到工作池。")
+        try:
+            execute_task(task_to_run, user_notification_config_for_thread) # 不阻塞，音轨由全局工作池执行
+        except Exception as e:
+            # 音轨尚未提交到工作池，不会再有 complete_task 释放运行槽位
+            msg = f"任务 {task_uuid}: 启动时发生意外错误: {e}"
+            logging.error(msg, exc_info=True)
+            update_task_status_in_file(task_uuid, "error", msg, traceback.format_exc())
+            release_running_task(task_uuid)
+            continue
+        started += 1
+
+    if started:
+        logging.info(f"本次唤醒启动了 {started} 个任务。当前运行数: {len(running_uuids) + started}/{max_parallel}。")
+    return started
+
+
+def send_completion_summaries(current_tasks):
+    """队列空闲时按用户发送邮件汇总 (来源为历史存储中尚未通知的任务)。"""
+    # 1. 识别所有完成的任务 (状态为 finish 或 error)
+    completed_tasks = [task for task in current_tasks if task.get("status") in ["finish", "error"]]
+    if history_store is not None:
+        # 邮件汇总来自历史存储中尚未通知的任务 (多数已由退役线程归档并移出队列)；
+        # 仍在宽限期内的任务先行归档 (已归档的 uuid 会被跳过)
+        if completed_tasks and history_store.archive(completed_tasks) < 0:
+            logging.error(f"归档任务到历史存储失败，以下任务暂不进入邮件汇总: {[task.get('uuid') for task in completed_tasks]}")
+        try:
+            completed_tasks = history_store.pending_notifications()
+        except Exception as e:
+            logging.error(f"读取待汇总任务失败: {e}", exc_info=True)
+            completed_tasks = []
+
+    if completed_tasks:
+        logging.info(f"发现 {len(completed_tasks)} 个已完成的任务，准备处理邮件汇总。")
+
+        # 2. 按用户分组并准备邮件内容
+        user_email_summaries = {} # { user: {'success': [name1,...], 'failure': [name1,...]} }
+
+        for task in completed_tasks:
+            user = task.get("user")
+            status = task.get("status")
+            uuid = task.get("uuid", "未知")
+            if not user:
+                logging.warning(f"任务 {uuid} 状态为 {status} 但缺少 'user' 字段，无法进行邮件汇总。")
+                continue
+
+            task_name, _, _ = get_task_display_info(task) # 获取任务名
+
+            if user not in user_email_summaries:
+                user_email_summaries[user] = {'success': [], 'failure': []}
+
+            if status == "finish":
+                user_email_summaries[user]['success'].append(task_name)
+            elif status == "error":
+                user_email_summaries[user]['failure'].append(task_name)
+
+        # 3. 发送汇总邮件给每个相关用户
+        logging.info(f"准备为 {len(user_email_summaries)} 个用户发送邮件汇总...")
+        for user, summary in user_email_summaries.items():
+            user_config = users_data.get(user, {})
+            emails = user_config.get('email', [])
+            if not emails or not isinstance(emails, list) or not emails[0]:
+                logging.warning(f"用户 {user} 没有配置有效的邮箱地址，无法发送邮件汇总。")
+                continue
+
+            recipient_email = emails[0] # 使用第一个邮箱
+            email_subject = "下载完成通知"
+            email_body_lines = []
+            email_body_lines.append(f"你好 {user},")
+            email_body_lines.append("本次任务处理结果如下：")
+            email_body_lines.append("-" * 20)
+
+            if summary['success']:
+                email_body_lines.append("成功任务:")
+                for i, name in enumerate(summary['success']):
+                    # 找到对应的任务，添加更严格的空值检查
+                    task = next((t for t in completed_tasks if isinstance(t, dict) and 
+                               isinstance(t.get('metadata'), dict) and 
+                               t.get('metadata', {}).get('name') == name), None)
+                    if task and isinstance(task, dict):
+                        task_name, task_type_zh, _ = get_task_display_info(task)
+                        # 添加时间戳检查
+                        process_start_time_str = task.get('process_start_time')
+                        process_complete_time_str = task.get('process_complete_time')
+                        if process_start_time_str and process_complete_time_str:
+                            try:
+                                process_start_time = datetime.fromisoformat(process_start_time_str)
+                                process_complete_time = datetime.fromisoformat(process_complete_time_str)
+                                processing_duration = process_complete_time - process_start_time
+                                # 格式化处理时间
+                                hours = processing_duration.seconds // 3600
+                                minutes = (processing_duration.seconds % 3600) // 60
+                                seconds = processing_duration.seconds % 60
+                                if hours > 0:
+                                    duration_str = f"{hours}小时{minutes}分{seconds}秒"
+                                else:
+                                    duration_str = f"{minutes}分{seconds}秒"
+                                email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                                email_body_lines.append(f"     处理时间: {duration_str}")
+                            except (ValueError, TypeError) as e:
+                                logging.warning(f"处理任务 {task.get('uuid', '未知')} 的时间戳时出错: {e}")
+                                email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                        else:
+                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                    else:
+                        logging.warning(f"无法找到或处理任务信息，使用原始名称: {name}")
+                        email_body_lines.append(f"  {i+1}. {name}")
+            else:
+                email_body_lines.append("成功任务: 无")
+
+            email_body_lines.append("-" * 20)
+
+            if summary['failure']:
+                email_body_lines.append("失败任务:")
+                for i, name in enumerate(summary['failure']):
+                    # 找到对应的任务，添加更严格的空值检查
+                    task = next((t for t in completed_tasks if isinstance(t, dict) and 
+                               isinstance(t.get('metadata'), dict) and 
+                               t.get('metadata', {}).get('name') == name), None)
+                    if task and isinstance(task, dict):
+                        task_name, task_type_zh, _ = get_task_display_info(task)
+                        # 添加时间戳检查
+                        process_start_time_str = task.get('process_start_time')
+                        process_complete_time_str = task.get('process_complete_time')
+                        if process_start_time_str and process_complete_time_str:
+                            try:
+                                process_start_time = datetime.fromisoformat(process_start_time_str)
+                                process_complete_time = datetime.fromisoformat(process_complete_time_str)
+                                processing_duration = process_complete_time - process_start_time
+                                # 格式化处理时间
+                                hours = processing_duration.seconds // 3600
+                                minutes = (processing_duration.seconds % 3600) // 60
+                                seconds = processing_duration.seconds % 60
+                                if hours > 0:
+                                    duration_str = f"{hours}小时{minutes}分{seconds}秒"
+                                else:
+                                    duration_str = f"{minutes}分{seconds}秒"
+                                email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                                email_body_lines.append(f"     处理时间: {duration_str}")
+                            except (ValueError, TypeError) as e:
+                                logging.warning(f"处理任务 {task.get('uuid', '未知')} 的时间戳时出错: {e}")
+                                email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                        else:
+                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
+                    else:
+                        logging.warning(f"无法找到或处理任务信息，使用原始名称: {name}")
+                        email_body_lines.append(f"  {i+1}. {name}")
+
+            email_body_lines.append("-" * 20)
+            email_body = "\n".join(email_body_lines)
+
+            # 调用邮件发送函数
+            send_summary_email(recipient_email, email_subject, email_body, user_config, config_data.get('email_checker', {}))
+
+        logging.info("邮件汇总发送尝试完成。")
+
+        uuids_summarized = [task.get("uuid") for task in completed_tasks]
+        if history_store is not None:
+            # 4. 标记为已通知；移出队列由退役线程在宽限期后完成
+            try:
+                history_store.mark_notified(uuids_summarized)
+            except Exception as e:
+                logging.error(f"标记任务邮件已通知失败: {e}", exc_info=True)
+        if task_retirer is None:
+            # 5. 未启用退役时，汇总后直接从任务队列移除这些任务
+            tasks_removed_count = task_writer.submit({"op": "remove", "uuids": uuids_summarized}).wait(DEFAULT_WRITE_WAIT_TIMEOUT)
+            if tasks_removed_count > 0:
+                logging.info(f"队列空闲，从任务队列中移除了 {tasks_removed_count} 个已完成或错误的任务。")
+            elif tasks_removed_count < 0:
+                logging.error(f"清理任务队列时发生错误。")
+            else:
+                logging.debug("任务队列无需清理。")
+
+
+# --- 主调度循环 (事件驱动) ---
+def main_scheduler_loop():
+    """主循环：每次被唤醒 (后端提交 / 任务完成) 时一次性启动全部可运行任务，队列空闲时发送邮件汇总。
+
+    定时轮询 (SCHEDULER_LONG_POLL_INTERVAL) 只作为漏掉唤醒信号时的兜底。已完成任务的移出由 TaskRetirer 负责。
+    """
+    threading.current_thread().name = "队列处理器"
+    logging.info("任务调度器主循环启动。")
+
+    max_parallel = config_data.get('MAX_PARALLEL', DEFAULT_MAX_PARALLEL)
+    # 兜底轮询间隔：正常情况下由唤醒事件驱动
+    long_poll_interval = config_data.get('SCHEDULER_LONG_POLL_INTERVAL', DEFAULT_SCHEDULER_LONG_POLL_INTERVAL)
+    signal_port = config_data.get('SCHEDULER_SIGNAL_PORT', DEFAULT_SCHEDULER_SIGNAL_PORT)
+    task_queue_path = file_paths.get('task_queue')
+
+    logging.info(f"调度器配置: 最大并行={max_parallel}, 兜底轮询间隔={long_poll_interval}s, 信号端口={signal_port}")
+    logging.info(f"监控任务队列: {task_queue_path}")
+
+    # 不退出，UDP 监听失败时调度器仅依赖任务完成事件和兜底轮询
+    start_signal_listener(signal_port)
+    queue_snapshot = QueueSnapshot(task_store)
 
     while True:
-        ready_to_read = []
+        # 先清除事件再检查队列，处理期间到达的唤醒会让下一次等待立即返回
+        scheduler_wakeup.clear()
         try:
             # --- 检查任务队列和运行状态 ---
-            # 读取任务队列 (使用 utils 函数)
-            current_tasks = read_json_with_lock(task_queue_path, task_queue_lock_obj, default=None)
+            current_tasks = queue_snapshot.load()
             if current_tasks is None:
                  logging.error("主循环无法读取任务队列，跳过本次检查。")
                  time.sleep(long_poll_interval) # 发生错误时等待长间隔
@@ -2744,15 +2488,17 @@ def main_scheduler_loop():
 
             # === 新增：检测并处理 metadata 为 null 的任务 ===
             tasks_to_resend = []
-            tasks_to_keep = []
+            uuids_to_resend = []
             for task in current_tasks:
                 if task.get("metadata") is None and task.get("status") != "pending_meta":
-                    tasks_to_resend.append({"user": task.get("user"), "link": task.get("link")})
-                else:
-                    tasks_to_keep.append(task)
+                    tasks_to_resend.append({"user": task.get("user"), "link": task.get("link"), "priority": task.get("priority", DEFAULT_TASK_PRIORITY)})
+                    uuids_to_resend.append(task.get("uuid"))
             if len(tasks_to_resend) > 0:
-                # 写回移除后的队列
-                if write_json_with_lock(task_queue_path, task_queue_lock_obj, tasks_to_keep):
+                queue_index = TaskQueueIndex(current_tasks)
+                queue_index.remove(uuids_to_resend)
+                current_tasks = queue_index.tasks
+                # 仅从存储中移除这些任务，不覆盖期间新提交的任务
+                if task_writer.submit({"op": "remove", "uuids": uuids_to_resend}).wait(DEFAULT_WRITE_WAIT_TIMEOUT) >= 0:
                     logging.info(f"检测到 {len(tasks_to_resend)} 个 metadata=null 且状态不为pending_meta的任务，已从队列移除并准备重发。")
                     # 重新POST到backend
                     try:
@@ -2764,369 +2510,87 @@ def main_scheduler_loop():
                     logging.error("写回移除metadata=null任务后的队列失败！")
             # === 新增逻辑结束 ===
 
-            # 检查运行和就绪状态 (不变)
+            # 补登记已完成但尚未进入退役计划的任务 (调度器重启前完成等情况)
+            if task_retirer is not None:
+                task_retirer.schedule_completed(current_tasks)
+
+            # 检查运行和就绪状态
             with running_set_lock: is_any_running = len(running_task_uuids) > 0
-            is_any_ready = any(task.get("status") == "ready" for task in current_tasks)
+            ready_tasks = [task for task in current_tasks if task.get("status") == "ready"]
 
-            # --- 队列空闲时的处理 (逻辑保持不变) ---
-            if not is_any_running and not is_any_ready:
+            if not is_any_running and not ready_tasks:
+                # --- 队列空闲：发送邮件汇总 ---
                 logging.debug("检测到任务队列空闲 (无 running 或 ready 任务)。")
-                
-                # 如果处于快速轮询模式，切换回长轮询
-                with poll_interval_lock:
-                    if fast_poll_mode:
-                        logging.info("队列空闲，从快速轮询模式切换回长轮询模式。")
-                        current_poll_interval = long_poll_interval
-                        fast_poll_mode = False
-
-                # 1. 识别所有完成的任务 (状态为 finish 或 error)
-                completed_tasks = [task for task in current_tasks if task.get("status") in ["finish", "error"]]
-
-                if completed_tasks:
-                    logging.info(f"发现 {len(completed_tasks)} 个已完成的任务，准备处理邮件汇总和清理。")
-
-                    # 2. 按用户分组并准备邮件内容
-                    user_email_summaries = {} # { user: {'success': [name1,...], 'failure': [name1,...]} }
-
-                    for task in completed_tasks:
-                        user = task.get("user")
-                        status = task.get("status")
-                        uuid = task.get("uuid", "未知")
-                        if not user:
-                            logging.warning(f"任务 {uuid} 状态为 {status} 但缺少 'user' 字段，无法进行邮件汇总。")
-                            continue
-
-                        task_name, _, _ = get_task_display_info(task) # 获取任务名
-
-                        if user not in user_email_summaries:
-                            user_email_summaries[user] = {'success': [], 'failure': []}
-
-                        if status == "finish":
-                            user_email_summaries[user]['success'].append(task_name)
-                        elif status == "error":
-                            user_email_summaries[user]['failure'].append(task_name)
-
-                    # 3. 发送汇总邮件给每个相关用户
-                    logging.info(f"准备为 {len(user_email_summaries)} 个用户发送邮件汇总...")
-                    for user, summary in user_email_summaries.items():
-                        user_config = users_data.get(user, {})
-                        emails = user_config.get('email', [])
-                        if not emails or not isinstance(emails, list) or not emails[0]:
-                            logging.warning(f"用户 {user} 没有配置有效的邮箱地址，无法发送邮件汇总。")
-                            continue
-
-                        recipient_email = emails[0] # 使用第一个邮箱
-                        email_subject = "下载完成通知"
-                        email_body_lines = []
-                        email_body_lines.append(f"你好 {user},")
-                        email_body_lines.append("本次任务处理结果如下：")
-                        email_body_lines.append("-" * 20)
-
-                        if summary['success']:
-                            email_body_lines.append("成功任务:")
-                            for i, name in enumerate(summary['success']):
-                                # 找到对应的任务，添加更严格的空值检查
-                                task = next((t for t in completed_tasks if isinstance(t, dict) and 
-                                           isinstance(t.get('metadata'), dict) and 
-                                           t.get('metadata', {}).get('name') == name), None)
-                                if task and isinstance(task, dict):
-                                    task_name, task_type_zh, _ = get_task_display_info(task)
-                                    # 添加时间戳检查
-                                    process_start_time_str = task.get('process_start_time')
-                                    process_complete_time_str = task.get('process_complete_time')
-                                    if process_start_time_str and process_complete_time_str:
-                                        try:
-                                            process_start_time = datetime.fromisoformat(process_start_time_str)
-                                            process_complete_time = datetime.fromisoformat(process_complete_time_str)
-                                            processing_duration = process_complete_time - process_start_time
-                                            # 格式化处理时间
-                                            hours = processing_duration.seconds // 3600
-                                            minutes = (processing_duration.seconds % 3600) // 60
-                                            seconds = processing_duration.seconds % 60
-                                            if hours > 0:
-                                                duration_str = f"{hours}小时{minutes}分{seconds}秒"
-                                            else:
-                                                duration_str = f"{minutes}分{seconds}秒"
-                                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                            email_body_lines.append(f"     处理时间: {duration_str}")
-                                        except (ValueError, TypeError) as e:
-                                            logging.warning(f"处理任务 {task.get('uuid', '未知')} 的时间戳时出错: {e}")
-                                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                    else:
-                                        email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                else:
-                                    logging.warning(f"无法找到或处理任务信息，使用原始名称: {name}")
-                                    email_body_lines.append(f"  {i+1}. {name}")
-                        else:
-                            email_body_lines.append("成功任务: 无")
-
-                        email_body_lines.append("-" * 20)
-
-                        if summary['failure']:
-                            email_body_lines.append("失败任务:")
-                            for i, name in enumerate(summary['failure']):
-                                # 找到对应的任务，添加更严格的空值检查
-                                task = next((t for t in completed_tasks if isinstance(t, dict) and 
-                                           isinstance(t.get('metadata'), dict) and 
-                                           t.get('metadata', {}).get('name') == name), None)
-                                if task and isinstance(task, dict):
-                                    task_name, task_type_zh, _ = get_task_display_info(task)
-                                    # 添加时间戳检查
-                                    process_start_time_str = task.get('process_start_time')
-                                    process_complete_time_str = task.get('process_complete_time')
-                                    if process_start_time_str and process_complete_time_str:
-                                        try:
-                                            process_start_time = datetime.fromisoformat(process_start_time_str)
-                                            process_complete_time = datetime.fromisoformat(process_complete_time_str)
-                                            processing_duration = process_complete_time - process_start_time
-                                            # 格式化处理时间
-                                            hours = processing_duration.seconds // 3600
-                                            minutes = (processing_duration.seconds % 3600) // 60
-                                            seconds = processing_duration.seconds % 60
-                                            if hours > 0:
-                                                duration_str = f"{hours}小时{minutes}分{seconds}秒"
-                                            else:
-                                                duration_str = f"{minutes}分{seconds}秒"
-                                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                            email_body_lines.append(f"     处理时间: {duration_str}")
-                                        except (ValueError, TypeError) as e:
-                                            logging.warning(f"处理任务 {task.get('uuid', '未知')} 的时间戳时出错: {e}")
-                                            email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                    else:
-                                        email_body_lines.append(f"  {i+1}. [{task_type_zh}] {name}")
-                                else:
-                                    logging.warning(f"无法找到或处理任务信息，使用原始名称: {name}")
-                                    email_body_lines.append(f"  {i+1}. {name}")
-
-                        email_body_lines.append("-" * 20)
-                        email_body = "\n".join(email_body_lines)
-
-                        # 调用邮件发送函数
-                        send_summary_email(recipient_email, email_subject, email_body, user_config, config_data.get('email_checker', {}))
-
-                    logging.info("邮件汇总发送尝试完成。")
-
-                    # 4. 归档错误任务
-                    error_tasks_to_archive = [task for task in completed_tasks if task.get("status") == "error"]
-                    if error_tasks_to_archive:
-                        logging.info(f"准备归档 {len(error_tasks_to_archive)} 个 'error' 状态的任务到 {errors_path}。")
-                        # 使用 utils 函数读写
-                        existing_errors = read_json_with_lock(errors_path, errors_lock_obj, default=[])
-                        if not isinstance(existing_errors, list):
-                             logging.error(f"错误归档文件 {errors_path} 不是列表，无法归档。")
-                        else:
-                            existing_error_uuids = {err.get("uuid") for err in existing_errors if isinstance(err, dict) and "uuid" in err}
-                            new_errors_to_add = [task for task in error_tasks_to_archive if task.get("uuid") not in existing_error_uuids]
-                            if new_errors_to_add:
-                                existing_errors.extend(new_errors_to_add)
-                                # 使用 utils 函数写入
-                                if write_json_with_lock(errors_path, errors_lock_obj, existing_errors):
-                                     logging.info(f"{len(new_errors_to_add)} 个新的错误任务已归档。")
-                                else:
-                                     logging.error(f"归档错误任务到 {errors_path} 失败。")
-                            else:
-                                logging.info("没有新的错误任务需要归档。")
-
-                    # 5. 清理任务队列：移除所有 'finish' 和 'error' 状态的任务
-                    # 在清理前等待2秒
-                    logging.info("等待2秒后清理任务队列...")
-                    time.sleep(2)
-                    
-                    tasks_to_keep = [task for task in current_tasks if task.get("status") not in ["finish", "error"]]
-                    tasks_removed_count = len(current_tasks) - len(tasks_to_keep)
-
-                    if tasks_removed_count > 0:
-                        logging.info(f"队列空闲，从 task_queue.json 中移除 {tasks_removed_count} 个已完成或错误的任务。")
-                        # 使用 utils 函数写入
-                        if write_json_with_lock(task_queue_path, task_queue_lock_obj, tasks_to_keep):
-                             logging.info("task_queue.json 清理完毕。")
-                        else:
-                             logging.error(f"清理 task_queue.json 时发生错误。")
-                    else:
-                        logging.debug("task_queue.json 无需清理。")
-
-                    # 邮件和清理完成后，进入等待
-                    if udp_socket:
-                        logging.debug(f"队列空闲处理完毕，等待 UDP 信号或 {current_poll_interval} 秒超时...")
-                        ready_to_read, _, _ = select.select([udp_socket], [], [], current_poll_interval)
-                    else: # 如果 socket 创建失败，则使用 time.sleep
-                        logging.debug(f"队列空闲处理完毕 (无 UDP 监听)，休眠 {current_poll_interval} 秒。")
-                        time.sleep(current_poll_interval)
-
-                else:
-                    # 队列空闲，但没有找到 finish/error 任务
-                    logging.debug("队列空闲，且无已完成任务待处理。")
-                    # 进入等待
-                    if udp_socket:
-                        logging.debug(f"队列空闲，等待 UDP 信号或 {current_poll_interval} 秒超时...")
-                        ready_to_read, _, _ = select.select([udp_socket], [], [], current_poll_interval)
-                    else:
-                        logging.debug(f"队列空闲 (无 UDP 监听)，休眠 {current_poll_interval} 秒。")
-                        time.sleep(current_poll_interval)
-
-                # 如果收到信号，清空缓冲区并立即开始下一次循环检查
-                if ready_to_read:
-                    try:
-                        logging.debug("收到 UDP 信号，立即检查队列。")
-                        # 读取数据以清空缓冲区，但不关心内容
-                        udp_socket.recvfrom(1024)
-                        
-                        # 切换到快速轮询模式
-                        with poll_interval_lock:
-                            if not fast_poll_mode:
-                                logging.info("收到后端启动信号，切换到快速轮询模式。")
-                                current_poll_interval = fast_poll_interval
-                                fast_poll_mode = True
-                    except socket.error as sock_err:
-                        # 在非阻塞模式下，如果没有数据可读，可能会引发错误 (尽管 select 应该避免这种情况)
-                        logging.warning(f"读取 UDP 信号时出错 (可能无数据): {sock_err}")
-                    except Exception as e:
-                        logging.error(f"处理 UDP 信号时发生未知错误: {e}", exc_info=True)
-                else:
-                    logging.debug("等待超时，按计划检查队列。")
-
-                continue # 不论是收到信号还是超时，都开始下一次循环
-
-            # --- 如果队列不空闲，则尝试启动新任务 (逻辑保持不变) ---
-
-            # 查找 ready 任务 (不变)
-            next_ready_task = None
-            for task in current_tasks:
-                if task.get("status") == "ready":
-                    task_uuid_check = task.get("uuid")
-                    with running_set_lock:
-                        if task_uuid_check in running_task_uuids:
-                            logging.warning(f"任务 {task_uuid_check}: 文件状态 'ready' 但内存记录运行中。尝试修正文件状态为 'running'。")
-                            update_task_status_in_file(task_uuid_check, "running")
-                            continue
-                        else:
-                            next_ready_task = task
-                            break
-
-            # 检查是否可启动 (不变)
-            with running_set_lock: current_running_count = len(running_task_uuids)
-
-            if next_ready_task and current_running_count < max_parallel:
-                task_to_run = next_ready_task.copy()
-                task_uuid = task_to_run.get("uuid")
-                task_user = task_to_run.get("user")
-
-                if not task_user:
-                     logging.error(f"任务 {task_uuid} 状态为 'ready' 但缺少 'user' 字段，无法启动。标记为错误。")
-                     update_task_status_in_file(task_uuid, "error", "任务缺少 user 字段", "")
-                     continue # 处理下一个任务
-
-                logging.info(f"找到可执行任务 {task_uuid} (用户: {task_user})。当前运行数: {current_running_count}/{max_parallel}。")
-
-                # --- 新增：获取用户通知配置 ---
-                user_config_from_yaml = users_data.get(task_user, {})
-                if not user_config_from_yaml:
-                     logging.warning(f"任务 {task_uuid}: 在 users.yaml 中未找到用户 '{task_user}' 的配置，将无法发送通知。")
-
-                # 准备传递给线程的配置
-                user_notification_config_for_thread = {
-                    'emby_url': user_config_from_yaml.get('emby_url'),
-                    'emby_api_key': user_config_from_yaml.get('emby_api_key'),
-                    'bark_urls': user_config_from_yaml.get('bark_urls', [])  # 获取 Bark URLs 列表
-                    # 注意：邮箱地址不需要传递给 execute_task
-                }
-                # --- 获取配置结束 ---
-
-                # 更新状态为 running (使用 utils 函数)
-                process_start_time_iso = datetime.now(timezone.utc).isoformat()
-                update_task_status_in_file(task_uuid, "running", process_start_time_iso=process_start_time_iso)
-
-                # 加入运行集合 (不变)
-                with running_set_lock: running_task_uuids.add(task_uuid)
-
-                # 启动线程 (修改：传递 user_notification_config_for_thread)
-                logging.info(f"任务 {task_uuid}: 文件状态更新为 'running'。启动执行线程。")
-                thread = threading.Thread(
-                    target=execute_task,
-                    args=(task_to_run, user_notification_config_for_thread), # 传递配置
-                    name=f"任务-{task_uuid[:8]}"
-                )
-                thread.daemon = True
-                thread.start()
-
-                # 成功启动任务后，不需要等待，立即检查下一个
-                continue
+                send_completion_summaries(current_tasks)
             else:
-                # 没有任务可启动 或 达到并行上限
-                wait_needed = True
-                if next_ready_task:
-                     logging.debug(f"无法启动新任务，已达最大并行数 ({current_running_count}/{max_parallel})。")
-                else:
-                     logging.debug("当前无 'ready' 状态的任务可启动。")
+                # --- 一次性启动全部可运行任务 ---
+                dispatch_ready_tasks(ready_tasks, max_parallel)
 
-                # 进入等待
-                if wait_needed:
-                    if udp_socket:
-                        logging.debug(f"无任务启动或已达上限，等待 UDP 信号或 {current_poll_interval} 秒超时...")
-                        ready_to_read, _, _ = select.select([udp_socket], [], [], current_poll_interval)
-                    else:
-                        logging.debug(f"无任务启动或已达上限 (无 UDP 监听)，休眠 {current_poll_interval} 秒。")
-                        time.sleep(current_poll_interval)
-
-                    # 处理等待结果
-                    if ready_to_read:
-                        try:
-                            logging.debug("收到 UDP 信号，立即检查队列。")
-                            udp_socket.recvfrom(1024) # 清空缓冲区
-                            
-                            # 切换到快速轮询模式
-                            with poll_interval_lock:
-                                if not fast_poll_mode:
-                                    logging.info("收到后端启动信号，切换到快速轮询模式。")
-                                    current_poll_interval = fast_poll_interval
-                                    fast_poll_mode = True
-                        except socket.error as sock_err:
-                             logging.warning(f"读取 UDP 信号时出错 (可能无数据): {sock_err}")
-                        except Exception as e:
-                            logging.error(f"处理 UDP 信号时发生未知错误: {e}", exc_info=True)
-                    else:
-                         logging.debug("等待超时，按计划检查队列。")
+            # --- 等待唤醒事件，超时即兜底检查 ---
+            if scheduler_wakeup.wait(long_poll_interval):
+                logging.debug("调度器被唤醒，检查队列。")
+            else:
+                logging.debug("等待超时，按计划检查队列。")
 
         except Exception as e:
             logging.error(f"主调度循环发生意外错误: {e}", exc_info=True)
             # 发生错误时，也等待一段时间再重试
-            time.sleep(current_poll_interval) # 使用长轮询间隔作为错误后的等待时间
-        finally:
-             # 在循环的最后，确保即使有异常，也能继续下一次迭代或退出
-             pass
-
-    # --- 程序退出前关闭套接字 ---
-    if udp_socket:
-        try:
-            udp_socket.close()
-            logging.info("UDP 监听套接字已关闭。")
-        except Exception as e:
-            logging.error(f"关闭 UDP 套接字时出错: {e}")
+            time.sleep(long_poll_interval)
 
 
 # --- 主程序入口 (修改) ---
+def resume_task_queue():
+    """保留上次运行遗留的任务队列：中断时仍在运行的任务恢复为 ready (标记 resumed_at)，
+    音轨的 download_status / decryption_status 保持不变，重新调度时只执行未完成的音轨。返回是否成功。"""
+    tasks = task_store.load_tasks()
+    if not isinstance(tasks, list):
+        logging.error("读取任务队列失败，无法恢复任务。")
+        return False
+    resumed_at = datetime.now(timezone.utc).isoformat()
+    ops = []
+    for task in tasks:
+        if not isinstance(task, dict) or task.get("status") != "running":
+            continue
+        ops.append({
+            "op": "task", "uuid": task.get("uuid"),
+            "fields": {"status": "ready", "resumed_at": resumed_at, "resume_count": task.get("resume_count", 0) + 1},
+            "remove_keys": ("checking",),
+        })
+    results = task_store.apply_batch(ops)
+    resumed = sum(1 for result in results if result is True)
+    if resumed < len(ops):
+        logging.error(f"恢复中断的任务时有 {len(ops) - resumed} 个未能写入任务存储。")
+    counts = {}
+    for task in tasks:
+        if isinstance(task, dict):
+            counts[task.get("status")] = counts.get(task.get("status"), 0) + 1
+    logging.info(f"已恢复任务队列 (存储后端: {task_store.name})：共 {len(tasks)} 个任务 {counts}，其中 {resumed} 个中断的任务重新排队。")
+    return resumed == len(ops)
+
 if __name__ == "__main__":
     try:
         # 步骤 1, 2, 3: 加载配置，设置路径/锁/日志 (已包含 users.yaml 加载)
         load_config_and_paths()
 
-        # 清除任务队列文件
-        task_queue_path_init = file_paths.get('task_queue') # Renamed
-        task_queue_lock_obj_init = file_locks.get('task_queue') # Renamed
-        if task_queue_path_init and task_queue_lock_obj_init:
+        # 启动时恢复或清除任务队列 (任务存储及其 JSON 导出)
+        if task_store is not None:
+            startup_queue_mode = str(config_data.get('STARTUP_QUEUE_MODE', DEFAULT_STARTUP_QUEUE_MODE)).lower()
             try:
-                with task_queue_lock_obj_init:
-                    if os.path.exists(task_queue_path_init):
-                        logging.info(f"正在清除任务队列文件: {task_queue_path_init}")
-                        write_json_with_lock(task_queue_path_init, task_queue_lock_obj_init, []) # Corrected arg order
-                        logging.info("任务队列文件已清除")
+                if startup_queue_mode == "resume":
+                    resume_task_queue()
+                else:
+                    if startup_queue_mode != "clear":
+                        logging.warning(f"STARTUP_QUEUE_MODE 配置无效: {startup_queue_mode}，按 clear 处理。")
+                    logging.info(f"正在清除任务队列 (存储后端: {task_store.name})")
+                    if task_store.replace_tasks([]):
+                        logging.info("任务队列已清除")
                     else:
-                        logging.info(f"任务队列文件不存在，无需清除: {task_queue_path_init}")
+                        logging.error("清除任务队列失败")
             except Exception as e_clear:
-                logging.error(f"清除任务队列文件时发生错误: {e_clear}", exc_info=True)
+                logging.error(f"{'恢复' if startup_queue_mode == 'resume' else '清除'}任务队列时发生错误: {e_clear}", exc_info=True)
                 sys.exit(1)
         else:
-            logging.critical("任务队列文件路径或锁未配置")
+            logging.critical("任务存储未初始化")
             sys.exit(1)
 
         # 步骤 4: 确保初始数据文件存在
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# retry_policy.py - 按失败类别决定是否重试、等待多久以及重试前的动作
+#
+# 失败类别来自 main.analyze_go_output (token / network / connect / errors / exit_code / not_found)，
+# 另有 exception (Python 侧意外错误)。多个类别同时出现时按 CLASS_PRECEDENCE 取最具体的一个。
+# 每个类别可配置: max_retries、指数退避 (base_delay * multiplier^n，不超过 max_delay) 与抖动、
+# refresh_token (重试前丢弃缓存的 API Token，并让 backend 强制刷新)、switch_endpoint (重试时换用其他解密器端点)、retryable (false 时立即放弃)。
+
+import random
+import logging
+import threading
+
+# --- 默认配置 ---
+CLASS_PRECEDENCE = ("not_found", "token", "connect", "network", "errors", "exit_code", "exception")
+DEFAULT_CLASS = "default"
+
+# 各类别在 default 基础上的默认覆盖项 (config.yaml 的 retry_policy.classes 可再覆盖)
+DEFAULT_CLASS_OVERRIDES = {
+    "token": {"max_retries": 3, "base_delay": 1, "refresh_token": True},
+    "connect": {"switch_endpoint": True},
+    "network": {"switch_endpoint": True},
+    "exception": {"max_retries": 2},
+    "not_found": {"retryable": False},
+}
+POLICY_KEYS = ("retryable", "max_retries", "base_delay", "multiplier", "max_delay", "jitter", "refresh_token", "switch_endpoint")
+
+
+class RetryDecision:
+    def __init__(self, failure_class, retry, delay=0.0, refresh_token=False, switch_endpoint=False, reason=""):
+        self.failure_class = failure_class
+        self.retry = retry
+        self.delay = delay
+        self.refresh_token = refresh_token
+        self.switch_endpoint = switch_endpoint
+        self.reason = reason
+
+
+class RetryPolicy:
+    """按失败类别的重试策略，并统计各类别的失败 / 重试 / 放弃 / 重试后成功次数 (线程安全)。"""
+
+    def __init__(self, default_policy, class_policies=None):
+        self.default_policy = dict(default_policy)
+        self.class_policies = {}
+        for failure_class, overrides in (class_policies or {}).items():
+            policy = dict(self.default_policy)
+            policy.update({key: value for key, value in (overrides or {}).items() if key in POLICY_KEYS})
+            self.class_policies[failure_class] = policy
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    @property
+    def max_attempts(self):
+        """单个音轨的最大执行次数 (所有类别中最大的 max_retries + 1)。"""
+        policies = [self.default_policy] + list(self.class_policies.values())
+        return max(int(policy.get("max_retries", 0)) for policy in policies) + 1
+
+    def policy_for(self, failure_class):
+        return self.class_policies.get(failure_class, self.default_policy)
+
+    @staticmethod
+    def classify(failure_classes):
+        """从失败类别集合中取优先级最高的一个，没有已知类别时返回 default。"""
+        for failure_class in CLASS_PRECEDENCE:
+            if failure_class in failure_classes:
+                return failure_class
+        return DEFAULT_CLASS
+
+    def decide(self, failure_classes, retries_by_class):
+        """根据本次失败类别和该音轨各类别已重试的次数 (retries_by_class，会被更新) 给出决策。"""
+        failure_class = self.classify(set(failure_classes or ()))
+        policy = self.policy_for(failure_class)
+        retries = retries_by_class.get(failure_class, 0)
+        if not policy.get("retryable", True):
+            decision = RetryDecision(failure_class, False, reason="不可重试")
+        elif retries >= int(policy.get("max_retries", 0)):
+            decision = RetryDecision(failure_class, False, reason=f"该类别已重试 {retries} 次")
+        elif sum(retries_by_class.values()) + 1 >= self.max_attempts:
+            decision = RetryDecision(failure_class, False, reason=f"已达到最大尝试次数 {self.max_attempts}")
+        else:
+            ceiling = min(float(policy.get("max_delay", 60)), float(policy.get("base_delay", 0)) * float(policy.get("multiplier", 2)) ** retries)
+            jitter = min(1.0, max(0.0, float(policy.get("jitter", 0))))
+            delay = ceiling * (1 - jitter * random.random())
+            retries_by_class[failure_class] = retries + 1
+            decision = RetryDecision(failure_class, True, delay, bool(policy.get("refresh_token")), bool(policy.get("switch_endpoint")))
+        self._count(failure_class, "failures")
+        self._count(failure_class, "retries" if decision.retry else "give_ups")
+        return decision
+
+    def record_success(self, retries_by_class):
+        """音轨在重试后成功时，为此前触发重试的类别记录一次恢复。"""
+        for failure_class in retries_by_class:
+            self._count(failure_class, "recovered")
+
+    def _count(self, failure_class, counter):
+        with self.lock:
+            counters = self.counters.setdefault(failure_class, {"failures": 0, "retries": 0, "give_ups": 0, "recovered": 0})
+            counters[counter] += 1
+
+    def snapshot(self):
+        with self.lock:
+            counters = {failure_class: dict(values) for failure_class, values in self.counters.items()}
+        return {
+            "default": self.default_policy,
+            "classes": self.class_policies,
+            "counters": counters,
+        }
+
+
+def create_retry_policy(config, max_retries, retry_delay):
+    """根据 config.yaml 中的 retry_policy 配置创建策略；default 未配置的项取 MAX_RETRIES / RETRY_DELAY。"""
+    section = config.get("retry_policy", {}) or {}
+    default_policy = {
+        "retryable": True, "max_retries": max_retries, "base_delay": retry_delay,
+        "multiplier": 2, "max_delay": 60, "jitter": 0.5, "refresh_token": False, "switch_endpoint": False,
+    }
+    default_policy.update({key: value for key, value in (section.get("default") or {}).items() if key in POLICY_KEYS})
+    class_policies = {failure_class: dict(overrides) for failure_class, overrides in DEFAULT_CLASS_OVERRIDES.items()}
+    for failure_class, overrides in (section.get("classes") or {}).items():
+        if not isinstance(overrides, dict):
+            logging.warning(f"retry_policy.classes.{failure_class} 配置无效，已忽略。")
+            continue
+        class_policies.setdefault(failure_class, {}).update(overrides)
+    policy = RetryPolicy(default_policy, class_policies)
+    logging.info(f"重试策略: 默认 {policy.default_policy}，按类别覆盖 {list(class_policies)}")
+    return policy
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# source_config.py - 调度器侧的 API Token 缓存与 source.yaml 渲染缓存
+#
+# ApiTokenClient: 缓存 backend /token 返回的 token 及其到期时间，临近到期时在后台刷新 (同一时刻只有一个请求)，
+#                 所有音轨线程共享结果，不再每次尝试都请求 backend；invalidate() 后的下一次请求带 refresh=1，
+#                 让 backend 丢弃其缓存的 token 并重新获取。
+# SourceConfigRenderer: 按 (用户, 解密器端口, token 版本, source.yaml mtime) 缓存传给 Go 的 YAML 文本，
+#                       任一输入变化前直接复用，避免每次尝试都加锁读取、解析和序列化 source.yaml。
+
+import os
+import time
+import logging
+import threading
+
+import yaml
+import requests
+
+from utils import read_yaml_with_lock
+
+# --- 默认配置 ---
+DEFAULT_TOKEN_URL = "http://localhost:5000/token"
+DEFAULT_TOKEN_TTL_SECONDS = 600        # 响应中没有有效期时的缓存时间
+TOKEN_REFRESH_AHEAD_SECONDS = 300      # 距到期少于该时间时后台刷新
+TOKEN_FAILURE_BACKOFF_SECONDS = 10     # 获取失败后，该时间内不再同步请求 backend
+TOKEN_REQUEST_TIMEOUT = 5
+TOKEN_FORCE_REFRESH_MIN_INTERVAL = 60  # 两次强制刷新之间的最短间隔(秒)，避免多个音轨同时报告令牌失败时反复刷新
+MAX_RENDER_CACHE_ENTRIES = 256
+
+
+class ApiTokenClient:
+    """backend /token 的进程内缓存客户端 (线程安全)。"""
+
+    def __init__(self, url=DEFAULT_TOKEN_URL, refresh_ahead_seconds=TOKEN_REFRESH_AHEAD_SECONDS):
+        self.url = url
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires_at = 0.0
+        self.version = 0            # token 每次变化时递增，用作渲染缓存键
+        self.inflight = None        # 正在进行的刷新 (threading.Event)，保证同一时刻只有一个请求
+        self.last_failure = 0.0
+        self.force_refresh = False  # 下一次请求要求 backend 强制刷新
+        self.last_forced = 0.0
+        self.stats = {"hits": 0, "fetches": 0, "failures": 0, "background_refreshes": 0, "forced_refreshes": 0}
+
+    def get(self):
+        """返回 (token, version)；无法获取时 token 为 None (Go 程序将自行获取)。"""
+        now = time.time()
+        with self.lock:
+            if self.token and now < self.expires_at:
+                self.stats["hits"] += 1
+                if self.expires_at - now < self.refresh_ahead_seconds and self.inflight is None:
+                    self.stats["background_refreshes"] += 1
+                    self.inflight = threading.Event()
+                    threading.Thread(target=self._refresh, args=(self.inflight,), name="token-refresh", daemon=True).start()
+                return self.token, self.version
+            if self.inflight is None and now - self.last_failure < TOKEN_FAILURE_BACKOFF_SECONDS:
+                return None, self.version
+            inflight = self.inflight
+            owner = inflight is None
+            if owner:
+                inflight = self.inflight = threading.Event()
+        if owner:
+            self._refresh(inflight)
+        else:
+            inflight.wait(TOKEN_REQUEST_TIMEOUT + 1)
+        with self.lock:
+            if self.token and time.time() < self.expires_at:
+                return self.token, self.version
+            return None, self.version
+
+    def invalidate(self):
+        """丢弃缓存的 token (例如 Go 报告令牌失败)，下次 get() 要求 backend 强制刷新后重新获取。"""
+        with self.lock:
+            if self.token:
+                self.token = None
+                self.expires_at = 0.0
+                self.version += 1
+            self.last_failure = 0.0
+            if time.time() - self.last_forced >= TOKEN_FORCE_REFRESH_MIN_INTERVAL:
+                self.force_refresh = True
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "version": self.version, "expires_in": max(0, round(self.expires_at - time.time())) if self.token else 0}
+
+    def _refresh(self, event):
+        token, expires_in = None, None
+        with self.lock:
+            force, self.force_refresh = self.force_refresh, False
+            if force:
+                self.last_forced = time.time()
+                self.stats["forced_refreshes"] += 1
+        try:
+            response = requests.get(self.url, params={"refresh": 1} if force else None, timeout=TOKEN_REQUEST_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            if data and data.get("token"):
+                token = data["token"]
+                expires_in = data.get("expires_in")
+            else:
+                logging.warning("获取 API Token 失败，响应中缺少 token 字段或数据无效。")
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"请求 {self.url} 失败: {e}")
+        except Exception as e:
+            logging.warning(f"获取 API Token 时发生未知错误: {e}")
+        with self.lock:
+            self.stats["fetches"] += 1
+            if token:
+                try:
+                    ttl = float(expires_in) if expires_in is not None else DEFAULT_TOKEN_TTL_SECONDS
+                except (TypeError, ValueError):
+                    ttl = DEFAULT_TOKEN_TTL_SECONDS
+                if token != self.token:
+                    self.version += 1
+                    logging.info(f"已获取 API Token ({token[:10]}...)，剩余有效期 {ttl:.0f} 秒。")
+                self.token = token
+                self.expires_at = time.time() + max(0.0, ttl)
+            else:
+                self.stats["failures"] += 1
+                self.last_failure = time.time()
+            self.inflight = None
+        event.set()
+
+
+class SourceConfigRenderer:
+    """source.yaml 的解析缓存与按用户渲染缓存。"""
+
+    def __init__(self, source_path, source_lock, token_client=None):
+        self.source_path = source_path
+        self.source_lock = source_lock
+        self.token_client = token_client
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.source = None   # 当前 mtime 下解析得到的字典 (只读)
+        self.rendered = {}   # (user, decrypt_port, get_port, token_version, mtime) -> YAML 文本
+        self.stats = {"loads": 0, "renders": 0, "hits": 0}
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.source_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load_source(self):
+        """返回解析后的 source.yaml (调用方不得修改)，文件无效时返回 None。文件 mtime 变化后重新读取。"""
+        mtime = self._current_mtime()
+        with self.lock:
+            if self.source is not None and mtime == self.mtime:
+                return self.source
+        data = read_yaml_with_lock(self.source_path, self.source_lock)
+        if not isinstance(data, dict) or not data:
+            logging.warning(f"{self.source_path} 内容无效")
+            return None
+        with self.lock:
+            self.stats["loads"] += 1
+            if mtime != self.mtime:
+                self.rendered.clear()
+            self.mtime = mtime
+            self.source = data
+        return data
+
+    def render(self, user, decrypt_m3u8_port, get_m3u8_port):
+        """返回传给 Go 的 YAML 文本 (已写入 api_token、解密器端口并替换 {user})，source.yaml 无效时返回 None。"""
+        source = self.load_source()
+        if source is None:
+            return None
+        token, token_version = self.token_client.get() if self.token_client is not None else (None, 0)
+        with self.lock:
+            key = (user, str(decrypt_m3u8_port), str(get_m3u8_port), token_version if token else None, self.mtime)
+            cached = self.rendered.get(key)
+            if cached is not None:
+                self.stats["hits"] += 1
+                return cached
+        source_data_dict = dict(source)
+        if token:
+            source_data_dict["api_token"] = token
+        else:
+            logging.warning("未能获取 API Token，Go 程序将尝试自行获取。")
+        source_data_dict['decrypt-m3u8-port'] = decrypt_m3u8_port
+        source_data_dict['get-m3u8-port'] = get_m3u8_port
+        rendered = yaml.dump(source_data_dict, default_flow_style=False, allow_unicode=True).replace("{user}", user)
+        with self.lock:
+            self.stats["renders"] += 1
+            if key[-1] == self.mtime:
+                if len(self.rendered) >= MAX_RENDER_CACHE_ENTRIES:
+                    self.rendered.clear()
+                self.rendered[key] = rendered
+        return rendered
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, "cached": len(self.rendered)}
@@ -0,0 +1,690 @@
+# -*- coding: utf-8 -*-
+# task_store.py - 任务队列存储后端 (JSON 文件 / SQLite WAL)
+
+import os
+import copy
+import time
+import sqlite3
+import logging
+import threading
+from filelock import Timeout
+
+from utils import (
+    PROJECT_ROOT,
+    read_json_with_lock, write_json_with_lock, json_dumps, json_loads,
+    atomic_write_bytes, durability_mode, fsync_interval_seconds, exclusive_file_lock,
+    IO_STATS, io_call_site, current_io_site,
+    TaskQueueIndex, build_global_track_map
+)
+from change_feed import CHANGE_ADD, CHANGE_TASK, CHANGE_TRACK, CHANGE_REMOVE, CHANGE_RESET
+
+# --- 默认配置 ---
+DEFAULT_TASK_STORE_BACKEND = "json"
+DEFAULT_SQLITE_PATH = "info/task_queue.db"
+DEFAULT_JSON_EXPORT_INTERVAL_SECONDS = 2
+SQLITE_SYNCHRONOUS_BY_DURABILITY = {"none": "OFF", "interval": "NORMAL", "always": "FULL"}
+
+
+class TaskStore:
+    """任务队列存储接口。main.py 与 backend.py 只通过这些方法访问队列。"""
+
+    name = "base"
+    publisher = None  # change_feed.ChangeFeedPublisher，每次提交后发布变更
+
+    def set_publisher(self, publisher):
+        self.publisher = publisher
+
+    def get_version(self):
+        """返回队列版本号，每次成功提交递增 1 (跨进程单调)。"""
+        raise NotImplementedError
+
+    def data_signature(self):
+        """返回 (版本号, 附加签名)，两者都不变时队列内容未变，供读取方缓存快照。"""
+        return self.get_version(), None
+
+    def _publish(self, version, changes):
+        if self.publisher is not None and version is not None and changes:
+            self.publisher.publish(version, changes)
+
+    def load_tasks(self):
+        """返回按提交顺序排列的完整任务列表，读取失败时返回 None。"""
+        raise NotImplementedError
+
+    def get_task(self, uuid):
+        """返回单个任务 (含 metadata.tracks)，不存在时返回 None。"""
+        raise NotImplementedError
+
+    def add_tasks(self, new_tasks, unique_fields=None):
+        """追加任务。unique_fields 非空时跳过与队列中已有任务字段值相同的任务。
+        返回 (已添加的任务列表, 重复的任务列表)，失败时返回 None。"""
+        raise NotImplementedError
+
+    def apply_batch(self, ops):
+        """在一次提交中依次应用多条变更 (group commit)，返回与 ops 一一对应的结果列表。
+
+        变更格式:
+          {"op": "task", "uuid", "fields", "remove_keys"}           -> bool
+          {"op": "track", "uuid", "song_id", "fields"}               -> 更新后的音轨 / None
+          {"op": "track_global", "uuid", "global_number", "fields"}  -> 更新后的音轨 / None
+          {"op": "remove", "uuids"}                                  -> 移除数量 / -1
+        音轨变更的 fields 可以是 callable(track) -> dict，用于依赖当前音轨值的更新。
+        """
+        raise NotImplementedError
+
+    def update_task(self, uuid, fields, remove_keys=()):
+        """更新任务的顶层字段 (row 级)。返回是否找到并写入。"""
+        return self.apply_batch([{"op": "task", "uuid": uuid, "fields": fields, "remove_keys": remove_keys}])[0]
+
+    def update_track(self, uuid, song_id, fields):
+        """按 song_id 更新任务中的单个音轨。返回更新后的音轨字典，未找到返回 None。"""
+        return self.apply_batch([{"op": "track", "uuid": uuid, "song_id": song_id, "fields": fields}])[0]
+
+    def update_track_by_global_number(self, uuid, global_number, fields):
+        """按全局音轨号 (按光盘、音轨号排序后的序号) 更新音轨。"""
+        return self.apply_batch([{"op": "track_global", "uuid": uuid, "global_number": global_number, "fields": fields}])[0]
+
+    def remove_tasks(self, uuids):
+        """移除指定 UUID 的任务，返回实际移除的数量 (失败返回 -1)。"""
+        if not uuids:
+            return 0
+        return self.apply_batch([{"op": "remove", "uuids": list(uuids)}])[0]
+
+    def replace_tasks(self, tasks):
+        """用给定列表整体替换队列 (用于启动清空与迁移)。"""
+        raise NotImplementedError
+
+    def export_json(self, force=False):
+        """导出兼容的 task_queue.json。JSON 后端本身即是该文件，无需导出。"""
+        return True
+
+
+def rollback_open_transaction(conn):
+    """结束连接上仍未结束的事务 (COMMIT 失败后)，回滚本身失败时只记录日志。"""
+    if conn.in_transaction:
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.Error as e:
+            logging.error(f"SQLite 回滚失败: {e}")
+
+
+def failed_result(op):
+    """变更失败时的返回值。"""
+    return {"task": False, "remove": -1}.get(op.get("op"))
+
+
+def describe_changes(ops, results):
+    """把一批变更及其结果转换为变更通知条目 [{"uuid", "kind", "song_id"}]，跳过未生效的变更。"""
+    changes = []
+    for op, result in zip(ops, results):
+        kind = op.get("op")
+        if kind == "remove":
+            if result and result > 0:
+                changes.extend({"uuid": uuid, "kind": CHANGE_REMOVE, "song_id": None} for uuid in op.get("uuids") or ())
+        elif kind == "task":
+            if result:
+                changes.append({"uuid": op.get("uuid"), "kind": CHANGE_TASK, "song_id": None})
+        elif isinstance(result, dict):
+            changes.append({"uuid": op.get("uuid"), "kind": CHANGE_TRACK, "song_id": result.get("song_id")})
+    return changes
+
+
+def added_changes(tasks):
+    return [{"uuid": t.get("uuid"), "kind": CHANGE_ADD, "song_id": None} for t in tasks]
+
+
+RESET_CHANGES = [{"uuid": None, "kind": CHANGE_RESET, "song_id": None}]
+
+
+def is_critical_batch(ops):
+    """批次中包含任务级状态变更或移除时需要立即落盘 (interval 持久化模式下进度类音轨更新可延迟 fsync)。"""
+    return any(op.get("op") in ("task", "remove") for op in ops)
+
+
+def apply_track_fields(track, fields):
+    """更新音轨字段，fields 可为 callable(track)。"""
+    if callable(fields):
+        fields = fields(track)
+    track.update(fields)
+    return track
+
+
+class JsonTaskStore(TaskStore):
+    """基于 task_queue.json 整文件读写的存储 (原有行为)。"""
+
+    name = "json"
+
+    def __init__(self, filepath, lock):
+        self.filepath = filepath
+        self.lock = lock
+        self._cached = None  # (最近一次由本进程写入的 TaskQueueIndex, 写入后文件的 (inode, mtime_ns, size))
+        self._memory_lock = threading.RLock()  # 保护内存索引，避免读取时与批量写入交错
+        self.version_path = filepath + ".version"  # 队列版本号旁路文件，在持有文件锁时递增
+
+    def get_version(self):
+        try:
+            with open(self.version_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def data_signature(self):
+        # 版本号之外再比较文件签名，文件被外部直接修改时快照同样失效
+        return self.get_version(), self._file_sig()
+
+    def _bump_version(self):
+        """在持有文件锁时递增版本号并返回新值。"""
+        version = self.get_version() + 1
+        try:
+            atomic_write_bytes(self.version_path, str(version).encode("utf-8"))
+        except OSError as e:
+            logging.error(f"写入任务队列版本号失败: {e}")
+            return None
+        return version
+
+    def _read_list(self):
+        tasks = read_json_with_lock(self.filepath, self.lock, default=[])
+        if tasks is None:
+            logging.error(f"读取任务队列失败: {self.filepath}")
+            return None
+        if not isinstance(tasks, list):
+            logging.error(f"任务队列文件 {self.filepath} 内容不是列表。")
+            return None
+        return tasks
+
+    def load_tasks(self):
+        with io_call_site("task_store.load_tasks"):
+            return self._read_list()
+
+    def _file_sig(self):
+        try:
+            st = os.stat(self.filepath)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _fresh_cache(self):
+        """文件自本进程上次写入后未变化时返回内存索引，否则返回 None。"""
+        cached = self._cached
+        if cached is not None and cached[1] == self._file_sig():
+            return cached[0]
+        return None
+
+    def get_task(self, uuid):
+        with self._memory_lock:
+            index = self._fresh_cache()
+            if index is not None:
+                task = index.get(uuid)
+                return copy.deepcopy(task) if task is not None else None
+        tasks = self._read_list()
+        if not tasks:
+            return None
+        return next((t for t in tasks if isinstance(t, dict) and t.get("uuid") == uuid), None)
+
+    def add_tasks(self, new_tasks, unique_fields=None):
+        try:
+            with io_call_site("task_store.add_tasks"), exclusive_file_lock(self.lock):
+                tasks = self._read_list()
+                if tasks is None:
+                    return None
+                existing_keys = set()
+                if unique_fields:
+                    existing_keys = {tuple(t.get(f) for f in unique_fields) for t in tasks if isinstance(t, dict)}
+                added, duplicates = [], []
+                for task in new_tasks:
+                    key = tuple(task.get(f) for f in unique_fields) if unique_fields else None
+                    if key is not None and key in existing_keys:
+                        duplicates.append(task)
+                        continue
+                    tasks.append(task)
+                    added.append(task)
+                    if key is not None:
+                        existing_keys.add(key)
+                if added:
+                    if not write_json_with_lock(self.filepath, self.lock, tasks, critical=True):
+                        return None
+                    self._publish(self._bump_version(), added_changes(added))
+                return added, duplicates
+        except Timeout:
+            logging.error(f"添加任务时获取文件锁超时: {self.lock.lock_file}")
+            return None
+
+    def _load_for_write(self):
+        """在持有文件锁时取得可修改的任务索引：文件自上次写入后未被外部修改时直接复用内存索引。"""
+        index = self._fresh_cache()
+        if index is not None:
+            return index
+        self._cached = None
+        tasks = self._read_list()
+        return TaskQueueIndex(tasks) if tasks is not None else None
+
+    def _write_index(self, index, critical=False):
+        if not write_json_with_lock(self.filepath, self.lock, index.tasks, critical=critical):
+            self._cached = None
+            return False
+        file_sig = self._file_sig()
+        self._cached = (index, file_sig) if file_sig is not None else None
+        return True
+
+    @staticmethod
+    def _apply_op(index, op):
+        kind = op.get("op")
+        if kind == "remove":
+            return index.remove(op.get("uuids") or ())
+        uuid = op.get("uuid")
+        if kind == "task":
+            if not index.update_task(uuid, op.get("fields") or {}, op.get("remove_keys") or ()):
+                logging.warning(f"任务 {uuid}: 在 task_queue.json 中未找到，无法更新。")
+                return False
+            return True
+        if kind == "track":
+            track = index.get_track(uuid, op.get("song_id"))
+            missing = f"Song ID {op.get('song_id')}"
+        else:
+            track = index.get_track_by_global_number(uuid, op.get("global_number"))
+            missing = f"全局音轨号 {op.get('global_number')}"
+        if track is None:
+            logging.warning(f"任务 {uuid}: 在任务队列中未找到 {missing} 对应的音轨。")
+            return None
+        return apply_track_fields(track, op.get("fields") or {})
+
+    def apply_batch(self, ops):
+        if not ops:
+            return []
+        try:
+            with io_call_site("task_store.apply_batch"), self._memory_lock, exclusive_file_lock(self.lock):
+                index = self._load_for_write()
+                if index is None:
+                    return [failed_result(op) for op in ops]
+                results = [self._apply_op(index, op) for op in ops]
+                changed = any(r for r in results if r is not None and r is not False and r != -1)
+                if changed:
+                    if not self._write_index(index, critical=is_critical_batch(ops)):
+                        return [failed_result(op) for op in ops]
+                    self._publish(self._bump_version(), describe_changes(ops, results))
+                return results
+        except Timeout:
+            logging.error(f"批量更新任务时获取文件锁超时: {self.lock.lock_file}")
+            return [failed_result(op) for op in ops]
+
+    def replace_tasks(self, tasks):
+        try:
+            with io_call_site("task_store.replace_tasks"), self._memory_lock, exclusive_file_lock(self.lock):
+                self._cached = None
+                if not write_json_with_lock(self.filepath, self.lock, tasks, critical=True):
+                    return False
+                self._publish(self._bump_version(), RESET_CHANGES)
+                return True
+        except Timeout:
+            logging.error(f"替换任务队列时获取文件锁超时: {self.lock.lock_file}")
+            return False
+
+
+class SqliteTaskStore(TaskStore):
+    """SQLite (WAL 模式) 存储：任务表按 uuid、音轨表按 (uuid, song_id) 做行级更新。
+
+    读者与写者互不阻塞；task_queue.json 作为兼容导出按间隔刷新。
+    """
+
+    name = "sqlite"
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS tasks ("
+        " uuid TEXT PRIMARY KEY,"
+        " seq INTEGER NOT NULL,"
+        " user TEXT,"
+        " status TEXT,"
+        " has_tracks INTEGER NOT NULL DEFAULT 0,"
+        " data TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_seq ON tasks(seq)",
+        "CREATE TABLE IF NOT EXISTS tracks ("
+        " uuid TEXT NOT NULL,"
+        " idx INTEGER NOT NULL,"
+        " song_id TEXT,"
+        " global_number INTEGER,"
+        " data TEXT NOT NULL,"
+        " PRIMARY KEY (uuid, idx))",
+        "CREATE INDEX IF NOT EXISTS idx_tracks_song ON tracks(uuid, song_id)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)",
+    )
+
+    def __init__(self, db_path, json_export_path=None, json_lock=None, export_interval=DEFAULT_JSON_EXPORT_INTERVAL_SECONDS):
+        self.db_path = db_path
+        self.json_export_path = json_export_path
+        self.json_lock = json_lock
+        self.export_interval = export_interval
+        self._local = threading.local()
+        self._export_lock = threading.Lock()
+        self._last_export = 0.0
+        self._pending_export = None
+        self._last_sync = 0.0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+        self._upgrade_schema(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tracks_global ON tracks(uuid, global_number)")
+        logging.info(f"SQLite 任务存储已就绪 (WAL): {db_path}")
+
+    def _upgrade_schema(self, conn):
+        """旧库的 tracks 表缺少 global_number 列时补齐并回填。"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(tracks)")}
+        if "global_number" in columns:
+            return
+        conn.execute("ALTER TABLE tracks ADD COLUMN global_number INTEGER")
+        for (uuid,) in conn.execute("SELECT DISTINCT uuid FROM tracks").fetchall():
+            tracks = [json_loads(data) for (data,) in conn.execute("SELECT data FROM tracks WHERE uuid = ? ORDER BY idx", (uuid,))]
+            self._write_tracks(conn, uuid, tracks)
+        logging.info("SQLite 任务存储: 已为 tracks 表补充全局音轨号索引。")
+
+    # --- 连接管理 ---
+    def _conn(self):
+        """每个线程一个连接，WAL 模式下读者不阻塞写者。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS_BY_DURABILITY[durability_mode()]}")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get_version(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def _write_txn(self, fn, describe=None, critical=False):
+        """在 BEGIN IMMEDIATE 事务中执行写操作并递增版本号，成功后按间隔导出 JSON 并发布变更。
+
+        describe(result) 返回本次提交的变更通知条目；为空时不递增版本号。
+        interval 持久化模式下 (synchronous=NORMAL)，critical 提交或距上次同步超过间隔的提交
+        临时使用 synchronous=FULL，使 WAL 连同之前的提交一起落盘。
+        """
+        conn = self._conn()
+        site = current_io_site("task_store.write")
+        version = None
+        sync_now = durability_mode() == "interval" and (critical or time.monotonic() - self._last_sync >= fsync_interval_seconds())
+        if sync_now:
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            start = time.monotonic()
+            conn.execute("BEGIN IMMEDIATE")
+            acquired = time.monotonic()
+            IO_STATS.observe(site, "lock_wait_ms", (acquired - start) * 1000)  # 等待其他进程的写事务
+            try:
+                result = fn(conn)
+                changes = describe(result) if describe else []
+                if changes:
+                    conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+                    version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                conn.execute("COMMIT")
+            except Exception:
+                # COMMIT 失败 (SQLITE_BUSY / I/O 错误) 时事务仍未结束，必须回滚，否则该线程之后的 BEGIN 全部失败
+                rollback_open_transaction(conn)
+                raise
+            IO_STATS.observe(site, "lock_hold_ms", (time.monotonic() - acquired) * 1000)
+        except sqlite3.Error as e:
+            IO_STATS.increment(site, "lock_timeouts" if "locked" in str(e) else "write_errors")
+            logging.error(f"SQLite 任务存储写入失败: {e}", exc_info=True)
+            raise
+        finally:
+            if sync_now:
+                conn.execute("PRAGMA synchronous=NORMAL")
+        if sync_now:
+            self._last_sync = time.monotonic()
+        self.export_json()
+        self._publish(version, changes)
+        return result
+
+    # --- 行 <-> 任务字典 ---
+    @staticmethod
+    def _split_task(task):
+        """拆分任务：metadata.tracks 单独存入 tracks 表。"""
+        data = dict(task)
+        tracks = None
+        metadata = data.get("metadata")
+        if isinstance(metadata, dict) and isinstance(metadata.get("tracks"), list):
+            tracks = metadata["tracks"]
+            data["metadata"] = {k: v for k, v in metadata.items() if k != "tracks"}
+        return data, tracks
+
+    def _insert_task(self, conn, task, seq):
+        data, tracks = self._split_task(task)
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks (uuid, seq, user, status, has_tracks, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (task.get("uuid"), seq, task.get("user"), task.get("status"), 1 if tracks is not None else 0,
+             json_dumps(data)))
+        self._write_tracks(conn, task.get("uuid"), tracks)
+
+    @staticmethod
+    def _write_tracks(conn, uuid, tracks):
+        """写入音轨行，全局音轨号在 metadata 附加时计算一次并随行保存。"""
+        conn.execute("DELETE FROM tracks WHERE uuid = ?", (uuid,))
+        if tracks:
+            global_numbers = {id(t): n for n, t in build_global_track_map(tracks).items()}
+            conn.executemany(
+                "INSERT INTO tracks (uuid, idx, song_id, global_number, data) VALUES (?, ?, ?, ?, ?)",
+                [(uuid, i, t.get("song_id") if isinstance(t, dict) else None, global_numbers.get(id(t)),
+                  json_dumps(t))
+                 for i, t in enumerate(tracks)])
+
+    @staticmethod
+    def _assemble(row, track_rows):
+        task = json_loads(row[1])
+        if row[0]:
+            metadata = task.get("metadata")
+            if not isinstance(metadata, dict):
+                metadata = {}
+                task["metadata"] = metadata
+            metadata["tracks"] = [json_loads(t) for t in track_rows]
+        return task
+
+    # --- 读操作 ---
+    def load_tasks(self):
+        conn = self._conn()
+        try:
+            # 单个读事务保证 tasks 与 tracks 来自同一快照
+            conn.execute("BEGIN")
+            try:
+                task_rows = conn.execute("SELECT uuid, has_tracks, data FROM tasks ORDER BY seq").fetchall()
+                tracks_by_uuid = {}
+                for uuid, data in conn.execute("SELECT uuid, data FROM tracks ORDER BY uuid, idx"):
+                    tracks_by_uuid.setdefault(uuid, []).append(data)
+            finally:
+                conn.execute("COMMIT")
+            return [self._assemble((has_tracks, data), tracks_by_uuid.get(uuid, [])) for uuid, has_tracks, data in task_rows]
+        except (sqlite3.Error, ValueError) as e:
+            rollback_open_transaction(conn)
+            logging.error(f"从 SQLite 读取任务队列失败: {e}", exc_info=True)
+            return None
+
+    def get_task(self, uuid):
+        conn = self._conn()
+        try:
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute("SELECT has_tracks, data FROM tasks WHERE uuid = ?", (uuid,)).fetchone()
+                track_rows = [r[0] for r in conn.execute("SELECT data FROM tracks WHERE uuid = ? ORDER BY idx", (uuid,))] if row else []
+            finally:
+                conn.execute("COMMIT")
+            return self._assemble(row, track_rows) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            rollback_open_transaction(conn)
+            logging.error(f"任务 {uuid}: 从 SQLite 读取任务失败: {e}", exc_info=True)
+            return None
+
+    # --- 写操作 ---
+    def add_tasks(self, new_tasks, unique_fields=None):
+        def txn(conn):
+            added, duplicates = [], []
+            next_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks").fetchone()[0]
+            existing_keys = set()
+            if unique_fields:
+                for (data,) in conn.execute("SELECT data FROM tasks"):
+                    task = json_loads(data)
+                    existing_keys.add(tuple(task.get(f) for f in unique_fields))
+            for task in new_tasks:
+                key = tuple(task.get(f) for f in unique_fields) if unique_fields else None
+                if key is not None and key in existing_keys:
+                    duplicates.append(task)
+                    continue
+                self._insert_task(conn, task, next_seq)
+                next_seq += 1
+                added.append(task)
+                if key is not None:
+                    existing_keys.add(key)
+            return added, duplicates
+        try:
+            return self._write_txn(txn, lambda result: added_changes(result[0]), critical=True)
+        except sqlite3.Error:
+            return None
+
+    # --- 单条变更 (在批量事务内执行) ---
+    def _apply_task_op(self, conn, uuid, fields, remove_keys):
+        row = conn.execute("SELECT data FROM tasks WHERE uuid = ?", (uuid,)).fetchone()
+        if row is None:
+            logging.warning(f"任务 {uuid}: 在 SQLite 任务存储中未找到，无法更新。")
+            return False
+        task = json_loads(row[0])
+        task.update(fields)
+        for key in remove_keys:
+            task.pop(key, None)
+        data, tracks = self._split_task(task)
+        if "metadata" in fields:
+            # metadata 整体替换时同步重写该任务的音轨行
+            self._write_tracks(conn, uuid, tracks)
+            conn.execute("UPDATE tasks SET has_tracks = ? WHERE uuid = ?", (1 if tracks is not None else 0, uuid))
+        conn.execute("UPDATE tasks SET user = ?, status = ?, data = ? WHERE uuid = ?",
+                     (task.get("user"), task.get("status"), json_dumps(data), uuid))
+        return True
+
+    def _apply_track_op(self, conn, op):
+        uuid = op.get("uuid")
+        if op.get("op") == "track":
+            song_id = op.get("song_id")
+            row = conn.execute("SELECT idx, data FROM tracks WHERE uuid = ? AND song_id = ? LIMIT 1", (uuid, song_id)).fetchone()
+            missing = f"Song ID {song_id}"
+            track = json_loads(row[1]) if row else None
+        else:
+            global_number = op.get("global_number")
+            row = conn.execute("SELECT idx, data FROM tracks WHERE uuid = ? AND global_number = ?", (uuid, global_number)).fetchone()
+            missing = f"全局音轨号 {global_number}"
+            track = json_loads(row[1]) if row else None
+        if track is None:
+            logging.warning(f"任务 {uuid}: 在 SQLite 任务存储中未找到 {missing} 对应的音轨。")
+            return None
+        apply_track_fields(track, op.get("fields") or {})
+        conn.execute("UPDATE tracks SET data = ? WHERE uuid = ? AND idx = ?",
+                     (json_dumps(track), uuid, row[0]))
+        return track
+
+    @staticmethod
+    def _apply_remove_op(conn, uuids):
+        removed = 0
+        for uuid in set(uuids or ()):
+            removed += conn.execute("DELETE FROM tasks WHERE uuid = ?", (uuid,)).rowcount
+            conn.execute("DELETE FROM tracks WHERE uuid = ?", (uuid,))
+        return removed
+
+    def apply_batch(self, ops):
+        if not ops:
+            return []
+        def txn(conn):
+            results = []
+            for op in ops:
+                kind = op.get("op")
+                if kind == "task":
+                    results.append(self._apply_task_op(conn, op.get("uuid"), op.get("fields") or {}, op.get("remove_keys") or ()))
+                elif kind in ("track", "track_global"):
+                    results.append(self._apply_track_op(conn, op))
+                elif kind == "remove":
+                    results.append(self._apply_remove_op(conn, op.get("uuids")))
+                else:
+                    logging.warning(f"未知的任务存储变更类型: {kind}")
+                    results.append(None)
+            return results
+        try:
+            return self._write_txn(txn, lambda results: describe_changes(ops, results), critical=is_critical_batch(ops))
+        except sqlite3.Error:
+            return [failed_result(op) for op in ops]
+
+    def replace_tasks(self, tasks):
+        def txn(conn):
+            conn.execute("DELETE FROM tasks")
+            conn.execute("DELETE FROM tracks")
+            for seq, task in enumerate(tasks, start=1):
+                self._insert_task(conn, task, seq)
+            return True
+        try:
+            result = self._write_txn(txn, lambda result: RESET_CHANGES, critical=True)
+        except sqlite3.Error:
+            return False
+        self.export_json(force=True)
+        return result
+
+    def is_empty(self):
+        return self._conn().execute("SELECT COUNT(*) FROM tasks").fetchone()[0] == 0
+
+    # --- JSON 兼容导出 ---
+    def export_json(self, force=False):
+        if not self.json_export_path or not self.json_lock:
+            return True
+        now = time.monotonic()
+        with self._export_lock:
+            if not force and now - self._last_export < self.export_interval:
+                # 间隔内的写入由一次延迟导出补齐，保证最终一致
+                if self._pending_export is None:
+                    delay = self.export_interval - (now - self._last_export)
+                    self._pending_export = threading.Timer(delay, self._run_pending_export)
+                    self._pending_export.daemon = True
+                    self._pending_export.start()
+                return True
+            self._last_export = now
+        tasks = self.load_tasks()
+        if tasks is None:
+            return False
+        return write_json_with_lock(self.json_export_path, self.json_lock, tasks)
+
+    def _run_pending_export(self):
+        with self._export_lock:
+            self._pending_export = None
+        self.export_json(force=True)
+
+
+def migrate_json_to_sqlite(json_path, json_lock, sqlite_store):
+    """将旧版 task_queue.json 中的任务导入空的 SQLite 存储。返回导入的任务数。"""
+    if not sqlite_store.is_empty():
+        return 0
+    tasks = read_json_with_lock(json_path, json_lock, default=[])
+    if not isinstance(tasks, list) or not tasks:
+        return 0
+    tasks = [t for t in tasks if isinstance(t, dict) and t.get("uuid")]
+    if sqlite_store.replace_tasks(tasks):
+        logging.info(f"已将 {len(tasks)} 个任务从 {json_path} 迁移到 SQLite 存储 {sqlite_store.db_path}")
+        return len(tasks)
+    logging.error(f"从 {json_path} 迁移任务到 SQLite 失败。")
+    return 0
+
+
+def create_task_store(config, task_queue_path, task_queue_lock):
+    """根据 config.yaml 中的 task_store 配置创建存储后端 (默认 json)。"""
+    store_config = config.get("task_store", {}) or {}
+    backend = str(store_config.get("backend", DEFAULT_TASK_STORE_BACKEND)).lower()
+    if backend == "sqlite":
+        sqlite_path = store_config.get("sqlite_path", DEFAULT_SQLITE_PATH)
+        if not os.path.isabs(sqlite_path):
+            sqlite_path = os.path.normpath(os.path.join(PROJECT_ROOT, sqlite_path))
+        json_export = store_config.get("json_export", True)
+        store = SqliteTaskStore(
+            sqlite_path,
+            json_export_path=task_queue_path if json_export else None,
+            json_lock=task_queue_lock if json_export else None,
+            export_interval=store_config.get("json_export_interval_seconds", DEFAULT_JSON_EXPORT_INTERVAL_SECONDS)
+        )
+        migrate_json_to_sqlite(task_queue_path, task_queue_lock, store)
+        return store
+    if backend != "json":
+        logging.warning(f"未知的任务存储后端 '{backend}'，将使用 json。")
+    return JsonTaskStore(task_queue_path, task_queue_lock)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# track_pool.py - 全局音轨工作池 (取代每个专辑各自创建的 ThreadPoolExecutor)
+#
+# 所有运行中任务的音轨进入同一个队列，由固定数量 (= Go 进程预算) 的常驻工作线程拉取执行:
+#   用户之间按 DRR 公平轮转 (fair_share)，并受 users.yaml 中 max_go_processes 限制；
+#   同一用户的多个任务之间优先选择在途音轨最少的任务，避免一个专辑占满全部槽位；
+#   单个任务的在途音轨数不超过 per_task_limit (MAX_PARALLEL_TASKS)；
+#   同时执行的音轨总数不超过 limit (可由自适应并发控制在运行中调整，最大为 Go 进程预算 workers)。
+# 音轨重试退避 (backoff) 期间让出槽位，由额外的工作线程接替执行其他音轨；退避结束后优先于新音轨取回槽位。
+# 任务的全部音轨结束后，在独立线程中调用该任务的完成回调 (校验与通知)；其中的专辑校验通过 run_with_slot 同样占用 Go 槽位。
+
+import time
+import logging
+import threading
+import traceback
+import itertools
+from collections import deque
+
+from fair_share import DeficitRoundRobin
+
+
+class TaskTrackBatch:
+    """一个任务提交到工作池的全部音轨及其执行结果。"""
+
+    def __init__(self, task_uuid, user, tracks, run_track, on_complete, priority_rank, seq):
+        self.task_uuid = task_uuid
+        self.user = user
+        self.pending = deque(tracks)
+        self.run_track = run_track      # run_track(track) -> (success, error_reason, error_log)
+        self.on_complete = on_complete  # on_complete([(track, (success, error_reason, error_log)), ...])
+        self.priority_rank = priority_rank
+        self.seq = seq
+        self.in_flight = 0
+        self.remaining = len(tracks)
+        self.results = []
+
+
+class TrackWorkPool:
+    """固定大小的全局音轨工作池。workers 为 Go 进程预算，工作线程数为其两倍 (多出的线程只在有音轨退避时执行)。"""
+
+    def __init__(self, workers, weight_of, limit_of=None, per_task_limit=None, limit=None):
+        self.workers = max(1, int(workers))
+        self.threads = self.workers * 2
+        self.limit = self.workers if limit is None else min(self.workers, max(1, int(limit)))
+        self.busy = 0
+        self.limit_of = limit_of  # limit_of(user) -> 该用户同时执行的音轨上限 / None
+        self.per_task_limit = per_task_limit if per_task_limit and per_task_limit > 0 else None
+        self.condition = threading.Condition()
+        self.drr = DeficitRoundRobin(weight_of)
+        self.batches = {}  # task_uuid -> TaskTrackBatch
+        self.busy_by_user = {}
+        self.seq = itertools.count()
+        self.backing_off = 0  # 正在退避 (已让出槽位) 的音轨数
+        self.resuming = 0     # 退避结束、等待取回槽位的音轨数
+        self.reserving = 0    # 在工作线程之外等待槽位的调用方数 (run_with_slot)
+        self.local = threading.local()
+        self.stats = {"tracks_completed": 0, "tasks_completed": 0, "backoffs": 0}
+        for index in range(self.threads):
+            threading.Thread(target=self._worker, name=f"音轨工作-{index + 1}", daemon=True).start()
+        logging.info(f"全局音轨工作池已启动: {self.threads} 个工作线程，并发上限 {self.limit}" + (f"，单任务最多 {self.per_task_limit} 个并行音轨" if self.per_task_limit else ""))
+
+    def submit_task(self, task_uuid, user, tracks, run_track, on_complete, priority_rank=1):
+        """提交一个任务的全部音轨。没有音轨时直接调用完成回调。"""
+        tracks = list(tracks)
+        if not tracks:
+            self._complete(TaskTrackBatch(task_uuid, user, [], run_track, on_complete, priority_rank, 0))
+            return
+        with self.condition:
+            self.batches[task_uuid] = TaskTrackBatch(task_uuid, user, tracks, run_track, on_complete, priority_rank, next(self.seq))
+            self.condition.notify_all()
+
+    def set_limit(self, limit):
+        """调整同时执行的音轨数上限 (不超过 Go 进程预算)。降低时已在执行的音轨不受影响。"""
+        with self.condition:
+            self.limit = min(self.workers, max(1, int(limit)))
+            self.condition.notify_all()
+
+    def backoff(self, delay):
+        """重试前等待 delay 秒。在工作线程中调用时先让出槽位，等待结束后再取回 (取回优先于新音轨)；其他线程中直接 sleep。"""
+        batch = getattr(self.local, "batch", None)
+        if batch is None:
+            time.sleep(delay)
+            return
+        with self.condition:
+            self._release_slot(batch.user)
+            self.backing_off += 1
+            self.stats["backoffs"] += 1
+            self.condition.notify_all()
+        try:
+            time.sleep(delay)
+        finally:
+            with self.condition:
+                self.backing_off -= 1
+                self.resuming += 1
+                while not self._slot_free(batch.user):
+                    self.condition.wait()
+                self.resuming -= 1
+                self._take_slot(batch.user)
+
+    def run_with_slot(self, task_uuid, user, func):
+        """在调用线程中占用一个 Go 槽位执行 func() 并返回其结果 (用于完成回调中的专辑校验)。
+        与退避结束的音轨一样优先于新音轨取得槽位；func 中的 backoff 同样会让出槽位。"""
+        with self.condition:
+            self.reserving += 1
+            try:
+                while not self._slot_free(user):
+                    self.condition.wait()
+            finally:
+                self.reserving -= 1
+            self._take_slot(user)
+        self.local.batch = TaskTrackBatch(task_uuid, user, [], None, None, 0, 0)
+        try:
+            return func()
+        finally:
+            self.local.batch = None
+            with self.condition:
+                self._release_slot(user)
+                self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            queued_by_user = {}
+            for batch in self.batches.values():
+                queued_by_user[batch.user] = queued_by_user.get(batch.user, 0) + len(batch.pending)
+            return {
+                "workers": self.workers,
+                "threads": self.threads,
+                "limit": self.limit,
+                "busy": self.busy,
+                "backing_off": self.backing_off,
+                "reserving": self.reserving,
+                "busy_by_user": dict(self.busy_by_user),
+                "queued_by_user": queued_by_user,
+                "tasks": len(self.batches),
+                "per_task_limit": self.per_task_limit,
+                **self.stats,
+            }
+
+    def _runnable(self, batch):
+        return batch.pending and (self.per_task_limit is None or batch.in_flight < self.per_task_limit)
+
+    def _slot_free(self, user):
+        """在持有 condition 时调用：全局和该用户均未达到上限。"""
+        limit = self.limit_of(user) if self.limit_of else None
+        return self.busy < self.limit and (limit is None or self.busy_by_user.get(user, 0) < limit)
+
+    def _take_slot(self, user):
+        self.busy_by_user[user] = self.busy_by_user.get(user, 0) + 1
+        self.busy += 1
+
+    def _release_slot(self, user):
+        self.busy -= 1
+        self.busy_by_user[user] -= 1
+        if not self.busy_by_user[user]:
+            del self.busy_by_user[user]
+
+    def _take_job(self):
+        """在持有 condition 时选出下一条音轨，没有可执行的音轨时返回 None。"""
+        if self.busy + self.resuming + self.reserving >= self.limit:
+            return None
+        by_user = {}
+        for batch in self.batches.values():
+            if self._runnable(batch):
+                by_user.setdefault(batch.user, []).append(batch)
+        candidates = {user for user in by_user if self._slot_free(user)}
+        user = self.drr.next_user(candidates)
+        if user is None:
+            return None
+        batch = min(by_user[user], key=lambda b: (b.in_flight, b.priority_rank, b.seq))
+        batch.in_flight += 1
+        self._take_slot(user)
+        return batch, batch.pending.popleft()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job = self._take_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._take_job()
+            batch, track = job
+            self.local.batch = batch
+            try:
+                result = batch.run_track(track)
+            except Exception as e:
+                logging.error(f"任务 {batch.task_uuid}: 音轨 {track.get('track_number', '?')} 执行失败: {e}", exc_info=True)
+                result = (False, f"执行失败: {e}", traceback.format_exc())
+            finally:
+                self.local.batch = None
+            self._finish(batch, track, result)
+
+    def _finish(self, batch, track, result):
+        with self.condition:
+            batch.in_flight -= 1
+            batch.remaining -= 1
+            batch.results.append((track, result))
+            self._release_slot(batch.user)
+            self.stats["tracks_completed"] += 1
+            done = batch.remaining == 0
+            if done:
+                self.batches.pop(batch.task_uuid, None)
+                self.stats["tasks_completed"] += 1
+            self.condition.notify_all()
+        if done:
+            self._complete(batch)
+
+    def _complete(self, batch):
+        # 完成回调可能执行专辑校验，放到独立线程，不占用音轨工作线程 (校验的 Go 进程经 run_with_slot 计入槽位)
+        threading.Thread(target=batch.on_complete, args=(batch.results,), name=f"任务-{batch.task_uuid[:8]}", daemon=True).start()
@@ -6,8 +6,15 @@ import json
 import yaml
 import logging
 import re
+import time
+import threading
+from contextlib import contextmanager
 from filelock import FileLock, Timeout
 import sys
+try:
+    import fcntl  # 共享读锁 (Windows 上不可用，退回排他锁)
+except ImportError:
+    fcntl = None
 
 # --- Constants ---
 # Define project root relative to this utils.py file
@@ -48,65 +55,516 @@ TASK_TYPE_MAP = {
     # 可以根据需要添加更多类型
 }
 
+# Task Priorities (POST /task 的可选字段 priority)
+TASK_PRIORITIES = ("high", "normal", "low")
+DEFAULT_TASK_PRIORITY = "normal"
+
+# --- JSON Codec (可选 orjson / msgspec 加速) ---
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+JSON_CODEC_BACKENDS = ("auto", "orjson", "msgspec", "stdlib")
+_json_codec = "stdlib"   # 当前使用的编解码库
+_json_pretty = False     # 调试模式：写入文件时缩进 2 格，默认紧凑输出
+
+
+def configure_json_codec(config):
+    """按 config.yaml 的 json_codec 配置选择编解码库。未安装的库自动回退到标准库 json。"""
+    global _json_codec, _json_pretty
+    codec_config = (config or {}).get("json_codec", {}) or {}
+    requested = str(codec_config.get("backend", "auto")).lower()
+    _json_pretty = bool(codec_config.get("pretty", False))
+    if requested not in JSON_CODEC_BACKENDS:
+        logging.warning(f"未知的 JSON 编解码库 '{requested}'，将自动选择。")
+        requested = "auto"
+    available = [name for name, module in (("orjson", orjson), ("msgspec", msgspec)) if module is not None]
+    if requested == "auto":
+        _json_codec = available[0] if available else "stdlib"
+    elif requested == "stdlib" or requested in available:
+        _json_codec = requested
+    else:
+        logging.warning(f"JSON 编解码库 {requested} 未安装，将使用标准库 json。")
+        _json_codec = "stdlib"
+    logging.info(f"JSON 编解码: {_json_codec} (缩进输出: {_json_pretty})")
+    return _json_codec
+
+
+def json_dumps_bytes(obj, pretty=None):
+    """编码为 UTF-8 字节 (不转义非 ASCII)。pretty 为 None 时跟随调试配置。"""
+    pretty = _json_pretty if pretty is None else pretty
+    try:
+        if _json_codec == "orjson":
+            # 日期时间不由 orjson 直接编码，保持与标准库一致 (交由调用方的 default 处理或报错)
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            return orjson.dumps(obj, option=option | (orjson.OPT_INDENT_2 if pretty else 0))
+        if _json_codec == "msgspec":
+            data = msgspec.json.encode(obj)
+            return msgspec.json.format(data, indent=2) if pretty else data
+    except TypeError:
+        pass  # 超出加速库支持范围的值 (如超大整数)，交给标准库处理
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_dumps(obj, pretty=None):
+    """编码为 str，用法同 json_dumps_bytes。"""
+    return json_dumps_bytes(obj, pretty).decode("utf-8")
+
+
+def json_loads(data):
+    """解码 str / bytes。解析失败统一抛出 json.JSONDecodeError。"""
+    if _json_codec == "orjson":
+        return orjson.loads(data)  # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+    if _json_codec == "msgspec":
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError as e:
+            raise json.JSONDecodeError(str(e), data if isinstance(data, str) else "", 0) from e
+    return json.loads(data)
+
+
+# --- Durability (写入持久化策略) ---
+DURABILITY_MODES = ("none", "interval", "always")
+DEFAULT_DURABILITY_MODE = "interval"
+DEFAULT_FSYNC_INTERVAL_MS = 1000
+_durability_mode = "none"       # configure_durability 之前保持原有行为 (不 fsync)
+_fsync_interval = DEFAULT_FSYNC_INTERVAL_MS / 1000.0
+_fsync_pending = set()          # interval 模式下等待批量 fsync 的文件
+_fsync_lock = threading.Lock()
+_fsync_thread = None
+
+
+def configure_durability(config):
+    """按 config.yaml 的 durability 配置设置 fsync 策略:
+    none (只做原子替换)、interval (最多每 interval_ms 批量 fsync 一次，状态变更立即 fsync)、always (每次写入都 fsync)。"""
+    global _durability_mode, _fsync_interval, _fsync_thread
+    durability_config = (config or {}).get("durability", {}) or {}
+    mode = str(durability_config.get("mode", DEFAULT_DURABILITY_MODE)).lower()
+    if mode not in DURABILITY_MODES:
+        logging.warning(f"未知的持久化模式 '{mode}'，将使用 {DEFAULT_DURABILITY_MODE}。")
+        mode = DEFAULT_DURABILITY_MODE
+    _durability_mode = mode
+    _fsync_interval = max(1, int(durability_config.get("interval_ms", DEFAULT_FSYNC_INTERVAL_MS))) / 1000.0
+    if mode == "interval" and _fsync_thread is None:
+        _fsync_thread = threading.Thread(target=_fsync_pending_loop, name="批量fsync", daemon=True)
+        _fsync_thread.start()
+    logging.info(f"写入持久化模式: {mode}" + (f" (批量 fsync 间隔 {int(_fsync_interval * 1000)}ms)" if mode == "interval" else ""))
+    return mode
+
+
+def durability_mode():
+    return _durability_mode
+
+
+def fsync_interval_seconds():
+    return _fsync_interval
+
+
+def _fsync_dir(dir_path):
+    """fsync 目录，保证 os.replace 的重命名落盘 (Windows 不支持时跳过)。"""
+    if os.name == "nt":
+        return
+    dir_fd = os.open(dir_path or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _fsync_path(path):
+    try:
+        with open(path, "rb") as f:
+            os.fsync(f.fileno())
+    except FileNotFoundError:
+        return
+    _fsync_dir(os.path.dirname(path))
+
+
+def _fsync_pending_loop():
+    while True:
+        time.sleep(_fsync_interval)
+        flush_pending_fsync()
+
+
+def flush_pending_fsync():
+    """立即 fsync interval 模式下积压的文件 (退出前调用可缩小丢失窗口)。"""
+    with _fsync_lock:
+        paths = list(_fsync_pending)
+        _fsync_pending.clear()
+    for path in paths:
+        try:
+            _fsync_path(path)
+        except OSError as e:
+            logging.warning(f"批量 fsync 失败: {path}, 错误: {e}")
+
+
+def atomic_write_bytes(filepath, data, critical=False):
+    """唯一的文件写入路径：写临时文件后 os.replace 原子替换，并按持久化模式 fsync。调用方负责持锁。
+
+    critical=True 表示状态变更等必须落盘的写入，interval 模式下也会立即 fsync。
+    """
+    temp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"  # 未持锁的并发写入者互不覆盖临时文件
+    dir_path = os.path.dirname(filepath)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    sync_now = _durability_mode == "always" or (_durability_mode == "interval" and critical)
+    try:
+        with open(temp_filepath, "wb") as f:
+            f.write(data)
+            if sync_now:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_filepath, filepath)
+    except Exception:
+        if os.path.exists(temp_filepath):
+            try:
+                os.remove(temp_filepath)
+            except OSError:
+                pass
+        raise
+    if sync_now:
+        _fsync_dir(dir_path)
+        with _fsync_lock:
+            _fsync_pending.discard(filepath)
+    elif _durability_mode == "interval":
+        with _fsync_lock:
+            _fsync_pending.add(filepath)
+
+
+# --- I/O Instrumentation (按调用点统计的直方图) ---
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SIZE_BUCKETS_BYTES = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20)
+IO_METRIC_BUCKETS = {
+    "lock_wait_ms": LATENCY_BUCKETS_MS,    # 等待文件锁 / SQLite 写事务
+    "lock_hold_ms": LATENCY_BUCKETS_MS,    # 持有文件锁 / SQLite 写事务
+    "parse_ms": LATENCY_BUCKETS_MS,        # JSON 解析
+    "serialize_ms": LATENCY_BUCKETS_MS,    # JSON 序列化
+    "write_ms": LATENCY_BUCKETS_MS,        # 临时文件写入 + 原子替换 (含 fsync)
+    "write_wait_ms": LATENCY_BUCKETS_MS,   # main.py: 从提交变更到写入线程完成
+    "bytes_read": SIZE_BUCKETS_BYTES,
+    "bytes_written": SIZE_BUCKETS_BYTES,
+}
+_io_site_local = threading.local()
+
+
+class Histogram:
+    """固定分桶直方图，分位数取所在桶的上界 (落在最后一个桶之外时取最大值)。"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.buckets[index] if index < len(self.buckets) else round(self.max, 3)
+        return round(self.max, 3)
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "avg": round(self.total / self.count, 3) if self.count else 0,
+            "max": round(self.max, 3),
+            "p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99),
+            "buckets": {label: n for label, n in zip(labels, self.counts) if n},
+        }
+
+
+class IOStats:
+    """按调用点 (site) 汇总 I/O 直方图与计数 (超时、失败)。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (site, metric) -> Histogram
+        self._counters = {}    # (site, counter) -> int
+
+    def observe(self, site, metric, value):
+        with self._lock:
+            histogram = self._histograms.get((site, metric))
+            if histogram is None:
+                histogram = self._histograms[(site, metric)] = Histogram(IO_METRIC_BUCKETS.get(metric, LATENCY_BUCKETS_MS))
+            histogram.observe(value)
+
+    def increment(self, site, counter, amount=1):
+        with self._lock:
+            self._counters[(site, counter)] = self._counters.get((site, counter), 0) + amount
+
+    def snapshot(self):
+        """返回 {调用点: {指标: 直方图快照, "counters": {...}}}。"""
+        with self._lock:
+            result = {}
+            for (site, metric), histogram in self._histograms.items():
+                result.setdefault(site, {})[metric] = histogram.snapshot()
+            for (site, counter), value in self._counters.items():
+                result.setdefault(site, {}).setdefault("counters", {})[counter] = value
+            return result
+
+
+IO_STATS = IOStats()
+
+
+@contextmanager
+def io_call_site(name):
+    """标记当前线程的 I/O 调用点；嵌套时以最外层为准 (例如写入线程内部的文件读写都记在写入线程名下)。"""
+    stack = getattr(_io_site_local, "stack", None)
+    if stack is None:
+        stack = _io_site_local.stack = []
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+def current_io_site(default="other"):
+    stack = getattr(_io_site_local, "stack", None)
+    return stack[0] if stack else default
+
+
+def get_io_stats():
+    return IO_STATS.snapshot()
+
+
+# --- Reader/Writer File Locks (共享读锁 / 排他写锁) ---
+DEFAULT_LOCK_TIMEOUT_SECONDS = 10
+LOCK_SLOW_WARN_SECONDS = 1.0   # 等待或持有超过该时间时记录警告
+
+
+class LockStats:
+    """按锁文件与模式 (shared / exclusive) 统计获取次数、等待与持有时间、超时次数。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, lock_file, mode, wait_seconds, hold_seconds=None, timed_out=False, site=None):
+        if site is not None:
+            IO_STATS.observe(site, "lock_wait_ms", wait_seconds * 1000)
+            if timed_out:
+                IO_STATS.increment(site, "lock_timeouts")
+            if hold_seconds is not None:
+                IO_STATS.observe(site, "lock_hold_ms", hold_seconds * 1000)
+        with self._lock:
+            entry = self._stats.setdefault((lock_file, mode), {
+                "acquired": 0, "timeouts": 0,
+                "wait_total_ms": 0.0, "wait_max_ms": 0.0,
+                "hold_total_ms": 0.0, "hold_max_ms": 0.0,
+            })
+            wait_ms = wait_seconds * 1000
+            entry["wait_total_ms"] += wait_ms
+            entry["wait_max_ms"] = max(entry["wait_max_ms"], wait_ms)
+            if timed_out:
+                entry["timeouts"] += 1
+            else:
+                entry["acquired"] += 1
+            if hold_seconds is not None:
+                hold_ms = hold_seconds * 1000
+                entry["hold_total_ms"] += hold_ms
+                entry["hold_max_ms"] = max(entry["hold_max_ms"], hold_ms)
+        if wait_seconds >= LOCK_SLOW_WARN_SECONDS or (hold_seconds or 0) >= LOCK_SLOW_WARN_SECONDS:
+            logging.warning(f"文件锁 {os.path.basename(lock_file)} ({mode}) 等待 {wait_seconds:.2f}s，持有 {hold_seconds or 0:.2f}s" + (" (超时)" if timed_out else ""))
+
+    def snapshot(self):
+        """返回 {锁文件名: {模式: 统计}}，时间单位毫秒，附带平均值。"""
+        with self._lock:
+            result = {}
+            for (lock_file, mode), entry in self._stats.items():
+                stats = {k: round(v, 3) if isinstance(v, float) else v for k, v in entry.items()}
+                count = entry["acquired"] or 1
+                stats["wait_avg_ms"] = round(entry["wait_total_ms"] / (count + entry["timeouts"]), 3)
+                stats["hold_avg_ms"] = round(entry["hold_total_ms"] / count, 3)
+                result.setdefault(os.path.basename(lock_file), {})[mode] = stats
+            return result
+
+
+LOCK_STATS = LockStats()
+
+
+def get_lock_stats():
+    return LOCK_STATS.snapshot()
+
+
+def _flock_with_timeout(fd, operation, deadline):
+    """非阻塞轮询 flock，超过 deadline (monotonic) 返回 False。"""
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.002)
+
+
+def _open_lock_fd(path):
+    lock_dir = os.path.dirname(path)
+    if lock_dir:
+        os.makedirs(lock_dir, exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+@contextmanager
+def exclusive_file_lock(lock, timeout=DEFAULT_LOCK_TIMEOUT_SECONDS):
+    """排他 (写) 锁：FileLock.acquire 的包装，记录等待与持有时间。超时抛出 filelock.Timeout。
+
+    等待期间持有 <lock>.intent 的排他锁，新的读者会在入口处等待，避免持续的读请求饿死写者。
+    当前线程已持有该锁时只做重入计数，不计入统计。
+    """
+    if lock.is_locked:
+        with lock.acquire(timeout=timeout):
+            yield lock
+        return
+    start = time.monotonic()
+    site = current_io_site()
+    gate_fd = None
+    try:
+        if fcntl is not None:
+            try:
+                lock.acquire(timeout=0)  # 无竞争时直接获取，不经过入口
+            except Timeout:
+                gate_fd = _open_lock_fd(lock.lock_file + ".intent")
+                if not _flock_with_timeout(gate_fd, fcntl.LOCK_EX, start + timeout):
+                    raise
+                lock.acquire(timeout=max(0, timeout - (time.monotonic() - start)))
+        else:
+            lock.acquire(timeout=timeout)
+    except Timeout:
+        LOCK_STATS.record(lock.lock_file, "exclusive", time.monotonic() - start, timed_out=True, site=site)
+        raise
+    finally:
+        if gate_fd is not None:
+            os.close(gate_fd)  # 关闭即释放入口锁，已持有主锁后读者在主锁处等待
+    acquired = time.monotonic()
+    try:
+        yield lock
+    finally:
+        lock.release()
+        LOCK_STATS.record(lock.lock_file, "exclusive", acquired - start, time.monotonic() - acquired, site=site)
+
+
+@contextmanager
+def shared_file_lock(lock, timeout=DEFAULT_LOCK_TIMEOUT_SECONDS):
+    """共享 (读) 锁：与 FileLock 对同一个 .lock 文件加 flock，多个读者可同时持有，只与写者互斥。
+
+    当前线程已持有该 FileLock (读-改-写流程中) 时直接进入；不支持 fcntl 的平台退回排他锁。
+    """
+    if lock.is_locked:
+        yield lock
+        return
+    if fcntl is None:
+        with exclusive_file_lock(lock, timeout):
+            yield lock
+        return
+    start = time.monotonic()
+    site = current_io_site()
+    deadline = start + timeout
+    gate_fd = _open_lock_fd(lock.lock_file + ".intent")
+    try:
+        # 先通过写者入口：有写者在等待时让写者优先
+        acquired_gate = _flock_with_timeout(gate_fd, fcntl.LOCK_SH, deadline)
+    finally:
+        os.close(gate_fd)
+    fd = _open_lock_fd(lock.lock_file)
+    try:
+        if not acquired_gate or not _flock_with_timeout(fd, fcntl.LOCK_SH, deadline):
+            LOCK_STATS.record(lock.lock_file, "shared", time.monotonic() - start, timed_out=True, site=site)
+            raise Timeout(lock.lock_file)
+        acquired = time.monotonic()
+        try:
+            yield lock
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            LOCK_STATS.record(lock.lock_file, "shared", acquired - start, time.monotonic() - acquired, site=site)
+    finally:
+        os.close(fd)
+
+
 # --- Utility Functions ---
 
-def read_json_with_lock(filepath, lock, default=None):
-    """安全地读取 JSON 文件 (带锁)。源自 backend.py """
+def read_json_with_lock(filepath, lock, default=None, timeout=DEFAULT_LOCK_TIMEOUT_SECONDS, site=None):
+    """安全地读取 JSON 文件 (共享锁，多个读者可并发)。源自 backend.py
+
+    文件不存在或为空时返回 default；获取锁超时或读取/解析失败时返回 None，调用方不会把错误误当成空数据。
+    site 为统计用的调用点名称，缺省为调用方函数名。
+    """
+    site = current_io_site(site or sys._getframe(1).f_code.co_name)
     try:
-        # 使用非阻塞锁避免长时间等待，如果锁已被占用则快速失败或返回默认值
-        with lock.acquire(timeout=0.1): # 短暂尝试获取锁
+        with io_call_site(site), shared_file_lock(lock, timeout=timeout):
             if not os.path.exists(filepath):
                 return default
-            with open(filepath, "r", encoding="utf-8") as f:
+            with open(filepath, "rb") as f:
                 content = f.read().strip()
-                if not content:
-                    return default
-                return json.loads(content)
+            if not content:
+                return default
+            IO_STATS.observe(site, "bytes_read", len(content))
+            start = time.perf_counter()
+            data = json_loads(content)
+            IO_STATS.observe(site, "parse_ms", (time.perf_counter() - start) * 1000)
+            return data
     except Timeout:
-        logging.warning(f"获取文件锁超时 (非阻塞): {lock.lock_file}. 返回默认值或上次缓存值（如果适用）。")
-        return default # 或者根据策略返回 None 或上次的缓存
+        logging.error(f"获取共享文件锁超时 ({timeout}s): {lock.lock_file}，无法读取 {filepath}")
+        return None
     except json.JSONDecodeError as e:
+        IO_STATS.increment(site, "parse_errors")
         logging.error(f"解析 JSON 文件失败: {filepath}, 错误: {e}")
         return None # 返回 None 以区分空文件和错误
     except Exception as e:
+        IO_STATS.increment(site, "read_errors")
         logging.error(f"读取文件时发生错误: {filepath}, 错误: {e}", exc_info=True)
         return None
 
-def write_json_with_lock(filepath, lock, data):
-    """安全地写入 JSON 文件 (带锁，使用临时文件)。源自 backend.py """
-    temp_filepath = filepath + ".tmp"
+def write_json_with_lock(filepath, lock, data, critical=False, site=None):
+    """安全地写入 JSON 文件 (带锁，原子替换，按持久化模式 fsync)。源自 backend.py """
+    site = current_io_site(site or sys._getframe(1).f_code.co_name)
     try:
-        # 对写操作使用更长的超时时间
-        with lock.acquire(timeout=10):
-            dir_path = os.path.dirname(filepath)
-            if dir_path:
-                os.makedirs(dir_path, exist_ok=True)
-            with open(temp_filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            # 确保文件完全写入磁盘
-            # f.flush() # with open 会在退出时自动 flush
-            # os.fsync(f.fileno()) # 在 Windows 上可能不可靠或不必要
-
-            os.replace(temp_filepath, filepath) # 原子替换
+        with io_call_site(site), exclusive_file_lock(lock, timeout=DEFAULT_LOCK_TIMEOUT_SECONDS):
+            start = time.perf_counter()
+            payload = json_dumps_bytes(data)
+            serialized = time.perf_counter()
+            atomic_write_bytes(filepath, payload, critical=critical)
+            IO_STATS.observe(site, "serialize_ms", (serialized - start) * 1000)
+            IO_STATS.observe(site, "write_ms", (time.perf_counter() - serialized) * 1000)
+            IO_STATS.observe(site, "bytes_written", len(payload))
             logging.debug(f"成功写入 JSON 文件: {filepath}")
             return True
     except Timeout:
         logging.error(f"获取文件锁超时: {lock.lock_file}，无法写入 {filepath}")
         return False
     except Exception as e:
+        IO_STATS.increment(site, "write_errors")
         logging.error(f"写入 JSON 文件时发生错误: {filepath}, 错误: {e}", exc_info=True)
-        if os.path.exists(temp_filepath):
-            try:
-                os.remove(temp_filepath)
-                logging.info(f"已删除临时文件: {temp_filepath}")
-            except OSError as remove_err:
-                logging.error(f"删除临时文件失败: {temp_filepath}, 错误: {remove_err}")
         return False
 
 def read_yaml_with_lock(filepath, lock):
     """使用 filelock 文件锁从文件读取 YAML 数据。源自 main.py"""
     try:
-        with lock.acquire(timeout=5): # 为读操作设置超时
+        with shared_file_lock(lock, timeout=5): # 为读操作设置超时
             if not os.path.exists(filepath):
                  logging.warning(f"YAML 文件未找到，将返回空字典: {filepath}")
                  return {}
@@ -268,6 +726,123 @@ def get_task_display_info(task_data):
     return name, type_zh, type_key # 返回 key 用于可能的逻辑判断
 
 
+# --- Task Model (按 uuid / song_id / 全局音轨号索引的任务队列) ---
+def _track_sort_key(track):
+    return (track.get('disc_number', 1), track.get('track_number', 1))
+
+
+class TrackRecord:
+    """音轨索引记录：引用原始音轨字典，附带预先计算的全局音轨号。"""
+    __slots__ = ("data", "song_id", "global_number")
+
+    def __init__(self, data, global_number):
+        self.data = data
+        self.song_id = data.get("song_id")
+        self.global_number = global_number
+
+
+class TaskRecord:
+    """单个任务的索引：song_id -> TrackRecord 与 全局音轨号 -> TrackRecord。"""
+    __slots__ = ("task", "by_song_id", "by_global_number")
+
+    def __init__(self, task):
+        self.task = task
+        self.by_song_id = {}
+        self.by_global_number = {}
+        self.reindex_tracks()
+
+    def reindex_tracks(self):
+        """metadata (音轨列表) 附加或替换后调用，只在此处排序一次。"""
+        self.by_song_id = {}
+        self.by_global_number = {}
+        metadata = self.task.get("metadata")
+        tracks = metadata.get("tracks") if isinstance(metadata, dict) else None
+        if not isinstance(tracks, list):
+            return
+        ordered = sorted((t for t in tracks if isinstance(t, dict)), key=_track_sort_key)
+        for global_number, track in enumerate(ordered, start=1):
+            record = TrackRecord(track, global_number)
+            self.by_global_number[global_number] = record
+            if record.song_id is not None:
+                self.by_song_id.setdefault(record.song_id, record)
+
+
+def build_global_track_map(tracks):
+    """返回 {全局音轨号: 音轨字典} (按光盘号、音轨号排序，从 1 开始)。"""
+    return {record.global_number: record.data
+            for record in TaskRecord({"metadata": {"tracks": tracks or []}}).by_global_number.values()}
+
+
+TRACK_DONE_STATUSES = ("success", "exists")  # download_status / decryption_status 均属于这些值时视为已完成
+
+
+def is_track_done(track):
+    """音轨是否已完成：以调度器记录的 completion 为准，尚未记录时 (例如中断于音轨执行中) 看下载与解密状态。"""
+    completion = track.get("completion")
+    if completion is not None:
+        return completion in TRACK_DONE_STATUSES
+    return track.get("download_status") in TRACK_DONE_STATUSES and track.get("decryption_status") in TRACK_DONE_STATUSES
+
+
+class TaskQueueIndex:
+    """任务列表的索引视图：按 uuid 查找任务、按 song_id / 全局音轨号查找音轨均为 O(1)。
+
+    tasks 列表本身保持原顺序与原字典，可直接序列化回 task_queue.json。
+    """
+
+    def __init__(self, tasks=None):
+        self.tasks = []
+        self.by_uuid = {}
+        self.rebuild(tasks or [])
+
+    def rebuild(self, tasks):
+        self.tasks = tasks
+        self.by_uuid = {t.get("uuid"): TaskRecord(t) for t in tasks if isinstance(t, dict) and t.get("uuid")}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def get(self, uuid):
+        record = self.by_uuid.get(uuid)
+        return record.task if record else None
+
+    def get_track(self, uuid, song_id):
+        record = self.by_uuid.get(uuid)
+        track = record.by_song_id.get(song_id) if record else None
+        return track.data if track else None
+
+    def get_track_by_global_number(self, uuid, global_number):
+        record = self.by_uuid.get(uuid)
+        track = record.by_global_number.get(global_number) if record else None
+        return track.data if track else None
+
+    def add(self, task):
+        self.tasks.append(task)
+        self.by_uuid[task.get("uuid")] = TaskRecord(task)
+
+    def update_task(self, uuid, fields, remove_keys=()):
+        """更新任务顶层字段；替换 metadata 时重建该任务的音轨索引。返回是否找到。"""
+        record = self.by_uuid.get(uuid)
+        if record is None:
+            return False
+        record.task.update(fields)
+        for key in remove_keys:
+            record.task.pop(key, None)
+        if "metadata" in fields:
+            record.reindex_tracks()
+        return True
+
+    def remove(self, uuids):
+        """移除任务，返回移除数量。"""
+        uuid_set = {u for u in uuids if u in self.by_uuid}
+        if not uuid_set:
+            return 0
+        self.tasks[:] = [t for t in self.tasks if not (isinstance(t, dict) and t.get("uuid") in uuid_set)]
+        for uuid in uuid_set:
+            del self.by_uuid[uuid]
+        return len(uuid_set)
+
+
 # --- Username & Link Processing (originally from backend.py) ---
 def normalize_username(submitted_username, users_mapping):
     """将提交的用户名（忽略大小写）映射到标准用户名"""
@@ -46,52 +46,78 @@ export async function pollAndUpdateCovers(isInitialCall = false) {
 
     let allTasks = [];
     let shouldUseLongPolling = false;
+    let usedVersionPolling = false;
 
     try {
-        // 首先进行一次普通轮询检查当前状态
-        const quickResponse = await fetch('./api/task');
-        if (!quickResponse.ok) {
-            let errorMsg = `获取任务列表失败 (${quickResponse.status})`;
-            try { const errorData = await quickResponse.json(); errorMsg = errorData.error || errorMsg; } catch(e) { /* ignore */ }
-            throw new Error(errorMsg);
-        }
-        const quickTaskData = await quickResponse.json();
-        if (!Array.isArray(quickTaskData)) { throw new Error("无效的任务列表响应格式 (非数组)"); }
-        
-        // 如果有任务，直接使用快速查询结果
-        if (quickTaskData.length > 0) {
-            allTasks = quickTaskData;
-            shouldUseLongPolling = false;
+        const knownVersion = State.getLastQueueVersion();
+        if (!isInitialCall && knownVersion !== null) {
+            // 后端支持队列版本号：按版本长轮询增量，队列有任何变化 (包括调度器写入的进度/状态) 才返回
+            usedVersionPolling = true;
+            const versionResponse = await fetch(`./api/task?wait=true&timeout=30&since=${knownVersion}`, {
+                signal: AbortSignal.timeout(60000) // 客户端超时，设置为60秒，大于服务端30秒超时
+            });
+            if (versionResponse.status === 204) {
+                // 等待超时且队列无变化，无需重新渲染，直接发起下一次长轮询
+                adjustPollingInterval(true, State.latestTaskMap.size, false, true);
+                return;
+            }
+            if (!versionResponse.ok) {
+                let errorMsg = `长轮询请求失败 (${versionResponse.status})`;
+                try { const errorData = await versionResponse.json(); errorMsg = errorData.error || errorMsg; } catch(e) { /* ignore */ }
+                throw new Error(errorMsg);
+            }
+            rememberQueueVersion(versionResponse);
+            const delta = await versionResponse.json();
+            if (!delta || !Array.isArray(delta.tasks)) { throw new Error("无效的增量响应格式"); }
+            allTasks = applyQueueDelta(delta);
         } else {
-            // 如果没有任务，检查是否刚完成任务
-            if (State.isRecentlyCompleted()) {
-                // 任务刚完成，使用短轮询而不是长轮询
+            // 首先进行一次普通轮询检查当前状态
+            const quickResponse = await fetch('./api/task');
+            if (!quickResponse.ok) {
+                let errorMsg = `获取任务列表失败 (${quickResponse.status})`;
+                try { const errorData = await quickResponse.json(); errorMsg = errorData.error || errorMsg; } catch(e) { /* ignore */ }
+                throw new Error(errorMsg);
+            }
+            rememberQueueVersion(quickResponse);
+            const quickTaskData = await quickResponse.json();
+            if (!Array.isArray(quickTaskData)) { throw new Error("无效的任务列表响应格式 (非数组)"); }
+        
+            // 如果有任务，直接使用快速查询结果
+            if (quickTaskData.length > 0) {
                 allTasks = quickTaskData;
                 shouldUseLongPolling = false;
             } else {
-                // 任务完成超过5秒，启用长轮询等待新任务
-                if (isInitialCall) {
+                // 如果没有任务，检查是否刚完成任务
+                if (State.isRecentlyCompleted()) {
+                    // 任务刚完成，使用短轮询而不是长轮询
                     allTasks = quickTaskData;
                     shouldUseLongPolling = false;
                 } else {
-                    shouldUseLongPolling = true;
+                    // 任务完成超过5秒，启用长轮询等待新任务
+                    if (isInitialCall) {
+                        allTasks = quickTaskData;
+                        shouldUseLongPolling = false;
+                    } else {
+                        shouldUseLongPolling = true;
                     
-                    const longPollResponse = await fetch('./api/task?wait=true&timeout=30', {
-                        signal: AbortSignal.timeout(60000) // 客户端超时，设置为60秒，大于服务端30秒超时
-                    });
+                        const longPollResponse = await fetch('./api/task?wait=true&timeout=30', {
+                            signal: AbortSignal.timeout(60000) // 客户端超时，设置为60秒，大于服务端30秒超时
+                        });
                     
-                    if (!longPollResponse.ok) {
-                        let errorMsg = `长轮询请求失败 (${longPollResponse.status})`;
-                        try { const errorData = await longPollResponse.json(); errorMsg = errorData.error || errorMsg; } catch(e) { /* ignore */ }
-                        throw new Error(errorMsg);
-                    }
+                        if (!longPollResponse.ok) {
+                            let errorMsg = `长轮询请求失败 (${longPollResponse.status})`;
+                            try { const errorData = await longPollResponse.json(); errorMsg = errorData.error || errorMsg; } catch(e) { /* ignore */ }
+                            throw new Error(errorMsg);
+                        }
                     
-                    const longPollTaskData = await longPollResponse.json();
-                    if (!Array.isArray(longPollTaskData)) { throw new Error("无效的长轮询响应格式 (非数组)"); }
+                        rememberQueueVersion(longPollResponse);
+                        const longPollTaskData = await longPollResponse.json();
+                        if (!Array.isArray(longPollTaskData)) { throw new Error("无效的长轮询响应格式 (非数组)"); }
                     
-                    allTasks = longPollTaskData;
+                        allTasks = longPollTaskData;
                     
-                    // console.debug(`长轮询检测到新任务: ${allTasks.length} 个`);
+                        // console.debug(`长轮询检测到新任务: ${allTasks.length} 个`);
+                    }
                 }
             }
         }
@@ -219,7 +245,7 @@ export async function pollAndUpdateCovers(isInitialCall = false) {
         TaskQueue.renderTaskQueueCovers(allTasks);
 
         // 根据是否使用了长轮询调整下次轮询时间
-        adjustPollingInterval(shouldUseLongPolling, allTasks.length);
+        adjustPollingInterval(shouldUseLongPolling || usedVersionPolling, allTasks.length, false, usedVersionPolling);
 
     } catch (error) {
         console.error("轮询任务列表或处理时发生错误:", error); // 打印整个error对象
@@ -258,14 +284,45 @@ export async function pollAndUpdateCovers(isInitialCall = false) {
         }
         UI.updateScrollButtons(); // 即使出错也更新滚动按钮
         
-        // 如果长轮询出错，快速重试
+        // 如果长轮询出错，快速重试，并退回普通轮询直到重新拿到版本号
+        State.setLastQueueVersion(null);
         adjustPollingInterval(false, 0, true);
     }
     // console.debug("Polling finished.");
 }
 
+// 记录响应头中的队列版本号，旧版后端不返回该头时保持普通轮询
+function rememberQueueVersion(response) {
+    const version = response.headers.get('X-Queue-Version');
+    State.setLastQueueVersion(version !== null && version !== '' ? version : null);
+}
+
+// 把 GET /task?since= 的增量合并到上次的任务列表 (full 为 true 时直接使用全量)
+function applyQueueDelta(delta) {
+    if (delta.full) {
+        return delta.tasks;
+    }
+    const merged = new Map(State.latestTaskMap);
+    (delta.removed || []).forEach(uuid => merged.delete(uuid));
+    delta.tasks.forEach(task => merged.set(task.uuid, task));
+    Object.entries(delta.tracks || {}).forEach(([uuid, changedTracks]) => {
+        const task = merged.get(uuid);
+        if (!task || !task.metadata || !Array.isArray(task.metadata.tracks)) return;
+        const changedBySongId = new Map(changedTracks.map(track => [track.song_id, track]));
+        // 生成新的任务对象，避免与上次渲染的数据共用引用
+        merged.set(uuid, {
+            ...task,
+            metadata: {
+                ...task.metadata,
+                tracks: task.metadata.tracks.map(track => changedBySongId.get(track.song_id) || track)
+            }
+        });
+    });
+    return Array.from(merged.values());
+}
+
 // 新增：根据情况调整轮询间隔
-function adjustPollingInterval(usedLongPolling, taskCount, hasError = false) {
+function adjustPollingInterval(usedLongPolling, taskCount, hasError = false, usedVersionPolling = false) {
     if (State.taskPollingIntervalId) {
         clearInterval(State.taskPollingIntervalId);
         clearTimeout(State.taskPollingIntervalId);
@@ -275,6 +332,9 @@ function adjustPollingInterval(usedLongPolling, taskCount, hasError = false) {
     if (hasError) {
         // 出错时快速重试
         nextInterval = 2000;
+    } else if (usedVersionPolling) {
+        // 按版本长轮询只在队列变化时返回，稍作间隔以合并连续的进度变更
+        nextInterval = 250;
     } else if (usedLongPolling) {
         // 使用了长轮询，下次轮询间隔较短
         nextInterval = taskCount > 0 ? 1000 : 3000;
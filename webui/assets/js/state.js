@@ -9,6 +9,7 @@ export const POLLING_INTERVAL = 1000; // 轮询间隔 (ms)
 export let taskPollingIntervalId = null; // 轮询定时器 ID
 export let lastTaskCompletionTime = null; // 最后一次任务完成的时间
 export let hadRunningTasks = false; // 记录是否曾经有运行中的任务
+export let lastQueueVersion = null; // 最近一次 GET /task 返回的队列版本号 (X-Queue-Version)，用于按版本长轮询
 
 // 渲染状态管理
 export let currentRenderingTaskUuid = null; // 当前正在渲染的任务UUID
@@ -53,6 +54,8 @@ export function setPollingPaused(value) {
 }
 export function setLastTaskCompletionTime(time) { lastTaskCompletionTime = time; }
 export function setHadRunningTasks(value) { hadRunningTasks = value; }
+export function setLastQueueVersion(version) { lastQueueVersion = version; }
+export function getLastQueueVersion() { return lastQueueVersion; }
 
 // 渲染状态管理函数
 export function setCurrentRenderingTaskUuid(uuid) { currentRenderingTaskUuid = uuid; }